@@ -0,0 +1,219 @@
+import argparse, json, os, platform, resource, subprocess, sys, tempfile, time
+from dataclasses import dataclass
+from multiprocessing import get_context
+import numpy as np
+import PIL
+from components import Catalogue, Firmament
+from measurements import Color, Matrix, Projection
+from utilities import Encoder, Instruments, Table
+
+@dataclass
+class Synthetic:
+    '''
+    Writes random catalogues in the schema of the files in data/:
+    the real constellations, uniformly spread stars with a faint-heavy
+    magnitude distribution, and a chain of edges through each constellation.
+    '''
+    EDGES: int = 20
+
+    PALETTE = ["BECDFF", "FFD29C", "FFD9A9", "FFF4E8", "CAD7FF", "FFB56C"]
+
+    @staticmethod
+    def draws(stars: int, seed: int = 0):
+        '''
+        The random draws of a catalogue: constellation, star in it,
+        position, magnitude and palette entry of every star.
+        '''
+        rng = np.random.default_rng(seed)
+        with open(f"{os.path.dirname(__file__)}/data/aggregational-catalogue.csv") as ifile:
+            constellations = [line.strip().split(",") for line in ifile]
+        cindex = np.sort(rng.integers(1, len(constellations) + 1, stars))
+        first = np.searchsorted(cindex, cindex)
+        sindex = np.arange(stars) - first + 1
+        xyz = rng.normal(size = (stars, 3))
+        xyz /= np.linalg.norm(xyz, axis = 1, keepdims = True)
+        magnitude = np.round(8 - rng.exponential(1.5, stars), 2).clip(-1.5, 8)
+        rgb = rng.integers(0, len(Synthetic.PALETTE), stars)
+        return constellations, cindex, sindex, xyz, magnitude, rgb
+    
+    @staticmethod
+    def chains(cindex: np.ndarray):
+        '''
+        Vector rows: a chain of at most EDGES edges through each constellation.
+        '''
+        present, starts = np.unique(cindex, return_index = True)
+        return [[c, c, i + 1, c, i + 2] for c, start, end in zip(present.tolist(), starts.tolist(), [*starts[1:].tolist(), len(cindex)])
+                for i in range(start, min(end - 1, start + Synthetic.EDGES))]
+    
+    @staticmethod
+    def firmament(stars: int, seed: int = 0):
+        '''
+        The firmament of catalogue(stars, seed) built straight from the
+        draws, without writing or parsing any CSV. Parsing holds every row
+        as Python strings, which past a few million stars takes minutes
+        and gigabytes; this path reaches ten million.
+        '''
+        constellations, cindex, sindex, xyz, magnitude, rgb = Synthetic.draws(stars, seed)
+        abbreviations = np.array([c[2] for c in constellations], dtype = np.bytes_)
+        colors = np.array([Color.hex_to_rgb(c) for c in Synthetic.PALETTE], dtype = np.uint32)
+        designation = np.char.add(abbreviations[cindex - 1], sindex.astype(np.bytes_))
+        catalogue = Catalogue.grouped({"index": np.arange(1, stars + 1), "cindex": cindex, "sindex": sindex, "xyz": xyz,
+                                       "magnitude": magnitude, "rgb": colors[rgb], "designation": designation},
+                                      [int(c[0]) for c in constellations])
+        return Firmament(catalogue, Synthetic.chains(cindex), constellations)
+    
+    @staticmethod
+    def catalogue(folder: str, stars: int, seed: int = 0):
+        os.makedirs(folder, exist_ok = True)
+        sources = [f"{folder}/stellar-catalogue.csv", f"{folder}/vectoral-catalogue.csv", f"{folder}/aggregational-catalogue.csv"]
+        if all(map(os.path.exists, sources)): return sources
+        constellations, cindex, sindex, xyz, magnitude, rgb = Synthetic.draws(stars, seed)
+        abbreviations, palette = [c[2] for c in constellations], Synthetic.PALETTE
+        with open(sources[0], "w") as ofile:
+            for start in range(0, stars, 100000):
+                ofile.write("".join(f"{i + 1},{c},{s},{x!r},{y!r},{z!r},{palette[k]},{abbreviations[c - 1]}{s},{m}\n"
+                                    for i, c, s, (x, y, z), k, m in zip(range(start, stars), cindex[start:start + 100000].tolist(),
+                                                                        sindex[start:start + 100000].tolist(), xyz[start:start + 100000].tolist(),
+                                                                        rgb[start:start + 100000].tolist(), magnitude[start:start + 100000].tolist())))
+        with open(sources[1], "w") as ofile:
+            ofile.write("".join(",".join(map(str, v)) + "\n" for v in Synthetic.chains(cindex)))
+        with open(sources[2], "w") as ofile:
+            ofile.write("".join(",".join(c) + "\n" for c in constellations))
+        return sources
+
+@dataclass
+class Benchmark:
+    '''
+    Times every stage of a render separately: parsing, population,
+    projection, drawing (projection, rasterization and composition into
+    a frame) and PNG encoding of that frame, for each show mode.
+    Rasterization is the draw's own instrumented stage, timed on the
+    projection the draw already made. Each scale runs in a fresh process
+    so the peak resident memory it reports belongs to that scale alone.
+    Direct scales skip the CSV files (see Synthetic.firmament) and
+    report no parse stage.
+    '''
+    MODES = {0: "realistic", 2: "designation", 3: "pages", 4: "plain", 5: "photometric"}
+    ENCODINGS = [("png", None), ("png", 1), ("webp", None), ("webp", 0), ("rgb", None)]
+
+    @staticmethod
+    def timed(function, repeat: int = 1):
+        '''
+        Best wall time of repeat calls, and the last result.
+        '''
+        best, result = float("inf"), None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    @staticmethod
+    def stage(function, name: str, repeat: int = 1):
+        '''
+        Best time of the named Instruments stage over repeat calls.
+        '''
+        best = float("inf")
+        for _ in range(repeat):
+            with Instruments().render() as record: function()
+            best = min(best, record["stages"].get(name, {"seconds": 0.0})["seconds"])
+        return best
+    
+    @staticmethod
+    def views(f: Firmament, option: int, references: tuple[int, ...]):
+        if option in (3, 4): return [(r % len(Firmament.VIEWS), Firmament.VIEWS[r % len(Firmament.VIEWS)]) for r in references]
+        keys = list(f.set)
+        return [(keys[r % len(keys)], f.set[keys[r % len(keys)]].R) for r in references]
+
+    @staticmethod
+    def scale(stars: int, folder: str, seed: int = 0, repeat: int = 3, references: tuple[int, ...] = (0, 5, 10), direct: bool = False):
+        record = {"stars": stars, "stages": {}, "modes": {}}
+        if direct: record["stages"]["population"], f = Benchmark.timed(lambda: Synthetic.firmament(stars, seed))
+        else:
+            record["stages"]["generate"], sources = Benchmark.timed(lambda: Synthetic.catalogue(f"{folder}/{stars}-{seed}", stars, seed))
+            record["stages"]["parse"], tables = Benchmark.timed(lambda: [Table(source) for source in sources])
+            record["stages"]["population"], f = Benchmark.timed(lambda: Firmament(*tables))
+            del tables
+        record["edges"] = len(f.edges)
+        record["stages"]["index"], _ = Benchmark.timed(lambda: f.index)
+
+        for option, name in Benchmark.MODES.items():
+            stages = {"projection": 0.0, "draw": 0.0, "rasterization": 0.0, "encode": 0.0, "drawn": 0, "bytes": 0}
+            for reference, R in Benchmark.views(f, option, references):
+                projection, (rows, _, _) = Benchmark.timed(lambda: f.visibleStars(R), repeat)
+                draw, frame = Benchmark.timed(lambda: Benchmark.frame(f, option, R, reference), repeat)
+                rasterization = Benchmark.stage(lambda: f.draw(option, R, reference), "rasterization", repeat)
+                encode, png = Benchmark.timed(lambda: Encoder.pack(frame), repeat)
+                stages["projection"] += projection
+                stages["draw"] += draw
+                stages["rasterization"] += rasterization
+                stages["encode"] += encode
+                stages["drawn"] += len(rows)
+                stages["bytes"] += len(png)
+            for stage in ("projection", "draw", "rasterization", "encode"): stages[stage] /= len(references)
+            record["modes"][name] = stages
+        raster = f.draw(4, Firmament.VIEWS[references[0] % len(Firmament.VIEWS)])
+        record["kernels"] = Benchmark.kernels(f.catalogue.xyz, repeat)
+        record["encodings"] = {}
+        for format, level in Benchmark.ENCODINGS:
+            seconds, data = Benchmark.timed(lambda: Encoder.encode(raster, "RGB", format, level), repeat)
+            record["encodings"][f"{format}-{Encoder.level(format, level)}"] = {"seconds": seconds, "bytes": len(data)}
+        record["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return record
+
+    @staticmethod
+    def kernels(xyz: np.ndarray, repeat: int = 3):
+        '''
+        Throughput, in directions per second, of the canvas window and every
+        registered projection kernel mapping the whole catalogue to pixels
+        and its pixels back.
+        '''
+        record = {}
+        R = np.identity(3)
+        mappings = {"window": (Projection.project, Projection.unproject)}
+        mappings.update({name: (kernel.project, kernel.unproject) for name, kernel in Projection.KERNELS.items()})
+        for name, (project, unproject) in mappings.items():
+            forward, (x, y, visible) = Benchmark.timed(lambda: project(xyz, R), repeat)
+            inverse, _ = Benchmark.timed(lambda: unproject(x[visible], y[visible], R), repeat)
+            record[name] = {"forward": len(xyz) / forward, "inverse": int(visible.sum()) / max(inverse, 1e-9), "visible": int(visible.sum())}
+        return record
+    
+    @staticmethod
+    def frame(f: Firmament, option: int, R: 'Matrix | list', reference: int):
+        '''
+        A show() view drawn and composed into the image its PNG encodes.
+        '''
+        return Encoder.compose(f.draw(option, R, reference), "P" if option in (2, 3) else "RGB")
+
+    @staticmethod
+    def environment():
+        try: commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                     capture_output = True, text = True, check = True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError): commit = None
+        return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+                "pillow": PIL.__version__, "machine": platform.machine(), "system": platform.platform(), "cpus": os.cpu_count()}
+
+    @staticmethod
+    def run(scales: list[int], folder: str, seed: int = 0, repeat: int = 3, direct: int | None = None):
+        results = {"environment": Benchmark.environment(), "seed": seed, "repeat": repeat, "scales": []}
+        for stars in scales:
+            with get_context("spawn").Pool(1) as pool:
+                results["scales"].append(pool.apply(Benchmark.scale, (stars, folder, seed, repeat), {"direct": direct is not None and stars >= direct}))
+            print(f"{stars} stars: {json.dumps(results['scales'][-1]['stages'])}", file = sys.stderr)
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Times each render stage on synthetic catalogues.")
+    parser.add_argument("--scales", type = int, nargs = "+", default = [10000, 100000, 1000000],
+                        help = "catalogue sizes; CSV scales are parsed row by row in Python, which is impractical past a few million stars")
+    parser.add_argument("--direct", type = int, default = 2000000, metavar = "STARS",
+                        help = "build scales of at least STARS stars straight into arrays, skipping the CSV files, up to ten million and beyond")
+    parser.add_argument("--folder", default = f"{tempfile.gettempdir()}/skywatch-synthetic")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--output", default = "-")
+    args = parser.parse_args()
+    results = Benchmark.run(args.scales, args.folder, args.seed, args.repeat, args.direct)
+    if args.output == "-": json.dump(results, sys.stdout, indent = 2)
+    else:
+        with open(args.output, "w") as ofile: json.dump(results, ofile, indent = 2)
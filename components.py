@@ -1,31 +1,73 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
-from math import pi as PI
-import os
-from measurements import Color, Matrix
-from utilities import Canvas, Table
+from math import cos, pi as PI
+from numbers import Integral
+import contextvars, hashlib, io, json, os, threading, time
+import numpy as np
+from PIL import Image
+from measurements import Color, Ephemeris, Levels, Mat3, Matrix, Projection, Quat, SkyIndex, Vec3
+from utilities import Atlas, Bundle, Cache, Encoder, Exposure, Instruments, Raster, Shared, Table, Writer
 
 @dataclass
 class Star:
-    def __init__(self, index: str, cindex: str, sindex: str, x: str, y: str, z: str, rgb: str, designation:str, magnitude: str):
-        self.index:  int = int(index)
-        self.cindex: int = int(cindex)
-        self.sindex: int = int(sindex)
-        
-        self.x:     float = float(x)
-        self.x_var: float = float(self.x)
-        self.y:     float = float(y)
-        self.y_var: float = float(self.y)
-        self.z:     float = float(z)
-        self.z_var: float = float(self.z)
+    '''
+    Lightweight view over one row of a Catalogue.
+    '''
+    __slots__ = ("catalogue", "row", "x_var", "y_var", "z_var")
 
-        self.rgb:   str = rgb
-        
-        self.designation:   str   = designation
-        self.magnitude:     float = float(magnitude)
-        self.rgb_des:       str   = Star.designationColor(designation)
-        self.size:          float = Star.starSize(self.magnitude)
+    def __init__(self, catalogue: 'Catalogue', row: int):
+        self.catalogue: Catalogue = catalogue
+        self.row: int = row
+        self.x_var, self.y_var, self.z_var = catalogue.xyz[row].tolist()
         return None
     
+    @property
+    def index(self):
+        return int(self.catalogue.index[self.row])
+    
+    @property
+    def cindex(self):
+        return int(self.catalogue.cindex[self.row])
+    
+    @property
+    def sindex(self):
+        return int(self.catalogue.sindex[self.row])
+    
+    @property
+    def x(self):
+        return float(self.catalogue.xyz[self.row, 0])
+    
+    @property
+    def y(self):
+        return float(self.catalogue.xyz[self.row, 1])
+    
+    @property
+    def z(self):
+        return float(self.catalogue.xyz[self.row, 2])
+    
+    @property
+    def rgb(self):
+        return Color.rgb_to_hex(int(self.catalogue.rgb[self.row]))
+    
+    @property
+    def designation(self):
+        return self.catalogue.designation[self.row].decode()
+    
+    @property
+    def magnitude(self):
+        return float(self.catalogue.magnitude[self.row])
+    
+    @property
+    def rgb_des(self):
+        return Color.rgb_to_hex(int(self.catalogue.rgb_des[self.row]))
+    
+    @property
+    def size(self):
+        return float(self.catalogue.size[self.row])
+    
     @staticmethod
     def designationColor(designation: str):
         match designation[-1]:
@@ -62,31 +104,35 @@ class Star:
         elif magnitude < 6.0: return  1.0
         return 0.5
     
-    def rotate(self, R: Matrix = Matrix([[1, 0, 0], [0, 1, 0], [0, 0, 1]])):
-        v = Matrix.Vector(self.x, self.y, self.z)
-        # print(R.M)
-        # print(v.M)
-        self.x_var, self.y_var, self.z_var = Matrix.UnpackVector(R * v)
+    def rotated(self, R: 'Mat3 | Matrix' = Mat3.identity()):
+        return Mat3.of(R) * Vec3(self.x, self.y, self.z)
+    
+    def rotate(self, R: 'Mat3 | Matrix' = Mat3.identity()):
+        '''
+        Stateful form of rotated(), kept for position() without a view.
+        Renders never call it, so views of one catalogue can be shared.
+        '''
+        self.x_var, self.y_var, self.z_var = self.rotated(R)
         return None
     
-    def position(self):
-        v = Matrix.Vector(self.x_var, self.y_var, self.z_var)
-        theta, phi = Matrix.UnpackVector(Matrix.toPolar(v))[1:]
-        posX = 1571 - round(((theta + PI / 4) % (2 * PI)) * 1000)
-        posY = round((((phi + 3 * PI / 4) % PI) - PI / 2) * 1000)
-        if not 0 <= posX < 1572: return None
-        if not 0 <= posY < 1572: return None
+    def position(self, R: 'Mat3 | Matrix | None' = None):
+        v = self.rotated(R) if R is not None else Vec3(self.x_var, self.y_var, self.z_var)
+        theta, phi = list(v.toPolar())[1:]
+        posX = Projection.WIDTH - 1 - round(((theta + PI / 4) % (2 * PI)) * Projection.SCALE)
+        posY = round((((phi + 3 * PI / 4) % PI) - PI / 2) * Projection.SCALE)
+        if not 0 <= posX < Projection.WIDTH: return None
+        if not 0 <= posY < Projection.HEIGHT: return None
         return posX, posY
 
 @dataclass
 class Vector:
     def __init__(self, A: Star, B: Star, rgb: str):
-        self.A: Matrix = Matrix.Vector(A.x, A.y, A.z)
-        self.B: Matrix = Matrix.Vector(B.x, B.y, B.z)
+        self.A: Vec3 = Vec3(A.x, A.y, A.z)
+        self.B: Vec3 = Vec3(B.x, B.y, B.z)
         self.rgb: str = rgb
         return None
     
-    def position(self, R: Matrix = Matrix([[1, 0, 0], [0, 1, 0], [0, 0, 1]])):
+    def position(self, R: 'Mat3 | Matrix' = Mat3.identity()):
         # multA = [[sum([i * col[c]
         #             for c, i in enumerate(row)])
         #             for col in Matrix.transpose(self.A).M]
@@ -95,16 +141,17 @@ class Vector:
         #             for c, i in enumerate(row)])
         #             for col in Matrix.transpose(self.B).M]
         #             for row in R.M]
-        thetaA, phiA = Matrix.UnpackVector(Matrix.toPolar(R * self.A))[1:]
-        thetaB, phiB = Matrix.UnpackVector(Matrix.toPolar(R * self.B))[1:]
-        posXA = 1571 - round(((thetaA + PI / 4) % (2 * PI)) * 1000)
-        posYA = round((((phiA + 3 * PI / 4) % PI) - PI / 2) * 1000)
-        posXB = 1571 - round(((thetaB + PI / 4) % (2 * PI)) * 1000)
-        posYB = round((((phiB + 3 * PI / 4) % PI) - PI / 2) * 1000)
-        if not 0 <= posXA < 1572: return None
-        if not 0 <= posYA < 1572: return None
-        if not 0 <= posXB < 1572: return None
-        if not 0 <= posYB < 1572: return None
+        R = Mat3.of(R)
+        thetaA, phiA = list((R * self.A).toPolar())[1:]
+        thetaB, phiB = list((R * self.B).toPolar())[1:]
+        posXA = Projection.WIDTH - 1 - round(((thetaA + PI / 4) % (2 * PI)) * Projection.SCALE)
+        posYA = round((((phiA + 3 * PI / 4) % PI) - PI / 2) * Projection.SCALE)
+        posXB = Projection.WIDTH - 1 - round(((thetaB + PI / 4) % (2 * PI)) * Projection.SCALE)
+        posYB = round((((phiB + 3 * PI / 4) % PI) - PI / 2) * Projection.SCALE)
+        if not 0 <= posXA < Projection.WIDTH: return None
+        if not 0 <= posYA < Projection.HEIGHT: return None
+        if not 0 <= posXB < Projection.WIDTH: return None
+        if not 0 <= posYB < Projection.HEIGHT: return None
         return posXA, posYA, posXB, posYB
 
 @dataclass
@@ -118,73 +165,218 @@ class Constellation:
         self.name: str = name
         self.abbreviation: str = abbreviation
         self.rgb: str = rgb
-        self.starset: dict[int, Star] = {}
-        self.vectorset: list[Vector] = []
-        self.R: Matrix = Matrix([[float(R11), float(R12), float(R13)],
-                                 [float(R21), float(R22), float(R23)],
-                                 [float(R31), float(R32), float(R33)]])
+        self.color: int = Color.hex_to_rgb(rgb)
+        self.catalogue: Catalogue | None = None
+        self.start: int = 0
+        self.end: int = 0
+        self.edges: np.ndarray = np.zeros((0, 2), dtype = np.int64)
+        self.R: Mat3 = Mat3(float(R11), float(R12), float(R13),
+                            float(R21), float(R22), float(R23),
+                            float(R31), float(R32), float(R33))
     
     def __len__(self):
-        return self.starset.__len__()
+        return self.end - self.start
+    
+    @property
+    def starset(self):
+        return {s.index: s for s in map(lambda row: Star(self.catalogue, row), range(self.start, self.end))}
     
-    def populateStarSet(self, s: Star):
-        self.starset[s.index] = s
+    def populateStarSet(self, catalogue: 'Catalogue'):
+        self.catalogue = catalogue
+        self.start, self.end = catalogue.bounds.get(self.cindex, (0, 0))
         return None
     
-    def populateVectorSet(self, origin: Star, target: Star):
-        self.vectorset.append(Vector(origin,
-                                     target,
-                                     self.rgb))
+    def populateVectorSet(self, edges: np.ndarray):
+        '''
+        Constellation lines as (origin, target) catalogue row pairs.
+        '''
+        self.edges = edges
         return None
     
+    @property
+    def vectorset(self):
+        return [Vector(Star(self.catalogue, a), Star(self.catalogue, b), self.rgb) for a, b in self.edges.tolist()]
+    
     def get(self, index: int):
-        return self.starset[index]
+        return self.view(self.catalogue.find(index))
+    
+    def view(self, row: int):
+        if not self.start <= row < self.end: raise KeyError(row)
+        return Star(self.catalogue, row)
 
 @dataclass
-class Firmament:
-    def __init__(self, stars: Table, vectors: Table, constellations: Table):
-        self.set: dict[int, Constellation] = {}
-        self.populateConstellations(constellations)
-        self.populateStars(stars)
-        self.populateVectors(vectors)
+class Catalogue:
+    '''
+    Columnar star catalogue, one typed array per attribute.
+    Rows are grouped by constellation, so each constellation
+    is the index range given by bounds[cindex].
+    '''
+    COLUMNS = ("index", "cindex", "sindex", "xyz", "magnitude", "rgb", "designation", "size", "rgb_des", "lookup")
+    LIMITS = (0.8, 1.2, 2.0, 3.0, 5.0, 6.0)
+    SIZES = (10.0, 6.0, 5.0, 4.0, 2.0, 1.0, 0.5)
+
+    def __init__(self, index: np.ndarray, cindex: np.ndarray, sindex: np.ndarray,
+                 xyz: np.ndarray, magnitude: np.ndarray, rgb: np.ndarray, designation: np.ndarray,
+                 size: np.ndarray | None = None, rgb_des: np.ndarray | None = None, lookup: np.ndarray | None = None):
+        self.index:       np.ndarray = np.asarray(index, dtype = np.int32)
+        self.cindex:      np.ndarray = np.asarray(cindex, dtype = np.int16)
+        self.sindex:      np.ndarray = np.asarray(sindex, dtype = np.int32)
+        self.xyz:         np.ndarray = np.asarray(xyz, dtype = np.float64).reshape(-1, 3)
+        self.magnitude:   np.ndarray = np.asarray(magnitude, dtype = np.float64)
+        self.rgb:         np.ndarray = np.asarray(rgb, dtype = np.uint32)
+        self.designation: np.ndarray = np.asarray(designation, dtype = np.bytes_)
+
+        # Derived columns are recomputed unless a compiled bundle already holds them.
+        self.size:    np.ndarray = Catalogue.starSizes(self.magnitude) if size is None else np.asarray(size, dtype = np.float32)
+        self.rgb_des: np.ndarray = Catalogue.designationColors(self.designation) if rgb_des is None else np.asarray(rgb_des, dtype = np.uint32)
+        self.lookup:  np.ndarray = np.argsort(self.index, kind = "stable") if lookup is None else np.asarray(lookup, dtype = np.int64)
+        # Renders only read the columns, so one catalogue can serve many threads.
+        for column in Catalogue.COLUMNS:
+            view = getattr(self, column).view()
+            view.flags.writeable = False
+            setattr(self, column, view)
+        self.bounds:  dict[int, tuple[int, int]] = {}
+        edges = np.flatnonzero(np.diff(self.cindex)) + 1
+        for start, end in zip([0, *edges.tolist()], [*edges.tolist(), len(self)]):
+            if start < end: self.bounds[int(self.cindex[start])] = (start, end)
         return None
     
     @staticmethod
-    def create():
-        cur_folder = os.path.dirname(__file__)
-        return Firmament(Table(f"{cur_folder}/data/stellar-catalogue.csv"),
-                         Table(f"{cur_folder}/data/vectoral-catalogue.csv"),
-                         Table(f"{cur_folder}/data/aggregational-catalogue.csv"))
-        
-    def populateConstellations(self, dataset: Table):
-        for c in dataset: self.set[int(c[0])] = Constellation(*c)
-        return None
+    def fromTable(dataset: Table, order: list[int] | None = None):
+        return Catalogue.grouped(Catalogue.parse(list(dataset)), order)
     
-    def populateStars(self, dataset: Table):
-        for s in dataset: self.set[int(s[1])].populateStarSet(Star(*s))
-        return None
+    @staticmethod
+    def parse(rows: list[list[str]]):
+        '''
+        Typed columns of rows in the stellar catalogue schema, in file order.
+        '''
+        columns = list(zip(*rows)) or [()] * 9
+        index, cindex, sindex, x, y, z, rgb, designation, magnitude = columns
+        integers = lambda column: np.fromiter(map(int, column), dtype = np.int64, count = len(column))
+        floats = lambda column: np.fromiter(map(float, column), dtype = np.float64, count = len(column))
+        colors = {c: Color.hex_to_rgb(c) for c in set(rgb)}
+        return {"index": integers(index),
+                "cindex": integers(cindex),
+                "sindex": integers(sindex),
+                "xyz": np.stack([floats(x), floats(y), floats(z)], axis = 1),
+                "magnitude": floats(magnitude),
+                "rgb": np.fromiter(map(colors.__getitem__, rgb), dtype = np.uint32, count = len(rgb)),
+                "designation": np.array(designation, dtype = np.bytes_)}
     
-    def populateVectors(self, dataset: Table):
-        for v in dataset:
-            try:
-                origin = self.set[int(v[1])].get(int(v[2]))
-                target = self.set[int(v[3])].get(int(v[4]))
-            except KeyError: print(v) #patch
-            self.set[int(v[0])].populateVectorSet(origin, target)
-        return None
+    @staticmethod
+    def grouped(columns: dict[str, np.ndarray], order: list[int] | None = None):
+        '''
+        Catalogue of parsed columns, rows grouped by constellation in the given order.
+        '''
+        cindex = columns["cindex"]
+        if order is None: order = sorted(set(cindex.tolist()))
+        rank = np.full(max([0, *order, *cindex.tolist()]) + 1, len(order), dtype = np.int64)
+        rank[order] = np.arange(len(order))
+        rows = np.argsort(rank[cindex], kind = "stable")
+        return Catalogue(**{column: array[rows] for column, array in columns.items()})
     
-    def show(self, option: int = 0, reference: int = -1, filename: str = "out.png"):
-        match option:
-            case 0: self.showRealistic(reference, filename)
-            case 1: self.showConstellation(reference, filename)
-            case 2: self.showDesignation(reference, filename)
-            case 3: self.showPages(reference, filename)
-            case 4: self.showPlain(reference, filename)
-        return None
+    @staticmethod
+    def stream(filepath: str, order: list[int] | None = None, chunk: int = 100000,
+               magnitude: float | None = None, subset: list[int] | None = None,
+               region: tuple['Vec3 | list', float] | None = None, progress = None):
+        '''
+        Reads the stellar catalogue chunk rows at a time, keeping only stars
+        brighter than magnitude, in the constellations of subset and within
+        region = (direction, radius). Each chunk is parsed, filtered and
+        stored as compact arrays before the next is read. progress, when
+        given, is called after every chunk with (rows read, rows kept,
+        bytes read, file size).
+        '''
+        if region is not None:
+            direction = np.asarray(list(region[0]), dtype = np.float64)
+            direction, limit = direction / np.linalg.norm(direction), np.cos(region[1])
+        kept, read, total = [], 0, os.path.getsize(filepath)
+        for rows, position in Table.chunks(filepath, chunk):
+            columns = Catalogue.parse(rows)
+            mask = np.ones(len(rows), dtype = bool)
+            if magnitude is not None: mask &= columns["magnitude"] < magnitude
+            if subset is not None: mask &= np.isin(columns["cindex"], subset)
+            if region is not None: mask &= columns["xyz"] @ direction >= limit * np.linalg.norm(columns["xyz"], axis = 1)
+            kept.append({column: array[mask] for column, array in columns.items()})
+            read += len(rows)
+            if progress is not None: progress(read, sum(len(c["index"]) for c in kept), position, total)
+        if not kept: kept = [Catalogue.parse([])]
+        return Catalogue.grouped({column: np.concatenate([c[column] for c in kept]) for column in kept[0]}, order)
     
-    def showPlain(self, reference: int, filename: str):
-        if reference < 0: return None
-        R = [[[1,0,0],[0,0,1],[0,-1,0]],
+    def arrays(self):
+        return {column: getattr(self, column) for column in Catalogue.COLUMNS}
+    
+    def __len__(self):
+        return self.index.__len__()
+    
+    def __getitem__(self, row: int):
+        if not -len(self) <= row < len(self): raise IndexError(row)
+        return Star(self, row % len(self))
+    
+    def __iter__(self):
+        return (Star(self, row) for row in range(len(self)))
+    
+    def find(self, index: int):
+        row = int(self.rows([index])[0])
+        if row < 0: raise KeyError(index)
+        return row
+    
+    def rows(self, indexes: 'list[int] | np.ndarray'):
+        indexes = np.asarray(indexes, dtype = np.int64)
+        if not len(self): return np.full(indexes.shape, -1, dtype = np.int64)
+        positions = np.minimum(np.searchsorted(self.index, indexes, sorter = self.lookup), len(self) - 1)
+        rows = self.lookup[positions]
+        return np.where(self.index[rows] == indexes, rows, -1)
+    
+    @staticmethod
+    def starSizes(magnitude: np.ndarray):
+        # Star.starSize per magnitude bucket; its 8.0 branch is never reached.
+        return np.asarray(Catalogue.SIZES, dtype = np.float32)[Levels.bucketOf(magnitude, Catalogue.LIMITS)]
+    
+    @staticmethod
+    def designationColors(designation: np.ndarray):
+        if not len(designation): return np.zeros(0, dtype = np.uint32)
+        width = designation.dtype.itemsize
+        lengths = np.char.str_len(designation)
+        last = designation.view("S1").reshape(-1, width)[np.arange(len(designation)), np.maximum(lengths - 1, 0)]
+        letters, inverse = np.unique(last, return_inverse = True)
+        colors = np.array([Color.hex_to_rgb(Star.designationColor(l.decode() or " ")) for l in letters.tolist()], dtype = np.uint32)
+        return colors[inverse.reshape(-1)]
+
+@dataclass
+class Snapshot:
+    '''
+    Everything a render reads of a Firmament: the catalogue (with the
+    constellation ranges in its bounds), the vector edges, their line
+    rows, bounds per constellation and colours, and the ids of the
+    updates applied so far. Never changed once published; the sky and
+    magnitude indexes and the digest of the version, built on first use,
+    are derived from it alone.
+    '''
+    def __init__(self, catalogue: Catalogue | None = None, edges: np.ndarray | None = None, lines: np.ndarray | None = None,
+                 vectorbounds: dict[int, tuple[int, int]] | None = None, vectorColors: np.ndarray | None = None,
+                 changes: tuple = (), skyindex: SkyIndex | None = None, lod: Levels | None = None, digest: str | None = None):
+        self.catalogue: Catalogue | None = catalogue
+        self.edges: np.ndarray = np.zeros((0, 5), dtype = np.int64) if edges is None else edges
+        self.lines: np.ndarray = np.zeros((0, 2), dtype = np.int64) if lines is None else lines
+        self.vectorbounds: dict[int, tuple[int, int]] = {} if vectorbounds is None else vectorbounds
+        self.vectorColors: np.ndarray = np.zeros(0, dtype = np.uint32) if vectorColors is None else vectorColors
+        self.changes: tuple[tuple[str, np.ndarray, np.ndarray], ...] = tuple(changes)
+        self.skyindex: SkyIndex | None = skyindex
+        self.lod: Levels | None = lod
+        self.digest: str | None = digest
+        return None
+
+@dataclass
+class Firmament:
+    worker = None
+    reading = ContextVar("snapshot", default = None)
+    # Updates recorded as revisions before they fold into a new version (see update).
+    COMPACT = 64
+    # Layout of the compiled arrays: bump whenever the catalogue columns, the
+    # sizes and designation colours derived from them, or arrays() change.
+    LAYOUT = 1
+    VIEWS = [[[1,0,0],[0,0,1],[0,-1,0]],
              [[0.5,0.866025403784,0],[0,0,1],[0.866025403784,-0.5,0]],
              [[-0.5,0.866025403784,0],[0,0,1],[0.866025403784,0.5,0]],
              [[-1,0,0],[0,0,1],[0,1,0]],
@@ -199,65 +391,711 @@ class Firmament:
              [[-0.57735026919,-0.57735026919,-0.57735026919],[-0.707106781187,0,0.707106781187],[-0.408248290464,0.816496580928,-0.408248290464]],
              [[0.57735026919,-0.57735026919,-0.57735026919],[0.707106781187,0,0.707106781187],[-0.408248290464,-0.816496580928,0.408248290464]],
              [[0,0,1],[-1,0,0],[0,-1,0]],
-             [[0,0,-1],[1,0,0],[0,-1,0]]][reference]
-        img = Canvas.create()
+             [[0,0,-1],[1,0,0],[0,-1,0]]]
+
+    def __init__(self, stars: 'Table | Catalogue', vectors: Table, constellations: Table):
+        self.set: dict[int, Constellation] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.state: Snapshot = Snapshot()
+        self.instruments: Instruments | None = None
+        self.renders: Cache | None = None
+        self.writer: Writer | None = None
+        self.photometry: tuple[float, int, float] = (0.8, 1, 1.0)
+        self.populateConstellations(constellations)
+        self.populateStars(stars)
+        self.populateVectors(vectors)
+        return None
+    
+    @staticmethod
+    def create(compiled: bool = True):
+        cur_folder = os.path.dirname(__file__)
+        bundle = Bundle(f"{cur_folder}/data/compiled",
+                        [f"{cur_folder}/data/stellar-catalogue.csv",
+                         f"{cur_folder}/data/vectoral-catalogue.csv",
+                         f"{cur_folder}/data/aggregational-catalogue.csv"],
+                        f"firmament-{Firmament.LAYOUT}")
+        if not compiled: return Firmament(*map(Table, bundle.sources))
+        if bundle.isFresh(): return Firmament.load(bundle)
+        return Firmament.compile(bundle)
+    
+    @staticmethod
+    def ingest(stars: str, vectors: str, constellations: str, chunk: int = 100000,
+               magnitude: float | None = None, subset: list[int] | None = None,
+               region: tuple['Vec3 | list', float] | None = None, progress = None):
+        '''
+        Firmament of a large stellar catalogue streamed through Catalogue.stream
+        with the given filters. Vectors touching a filtered-out star are dropped.
+        '''
+        constellations = Table(constellations)
+        order = [int(c[0]) for c in constellations]
+        catalogue = Catalogue.stream(stars, order, chunk, magnitude, subset, region, progress)
+        edges = [v for v in Table(vectors) if subset is None or int(v[0]) in subset]
+        rows = catalogue.rows([int(index) for v in edges for index in (v[2], v[4])]).reshape(-1, 2)
+        edges = [v for v, (origin, target) in zip(edges, rows.tolist()) if origin >= 0 and target >= 0]
+        return Firmament(catalogue, edges, constellations)
+    
+    @staticmethod
+    def compile(bundle: Bundle):
+        f = Firmament(*map(Table, bundle.sources))
+        try: bundle.save(f.arrays())
+        except OSError: pass # read-only data folder, keep the parsed firmament
+        return f
+    
+    @staticmethod
+    def load(bundle: Bundle):
+        return Firmament.fromArrays(bundle.load())
+    
+    @staticmethod
+    def fromArrays(arrays: dict[str, np.ndarray], photometry: tuple[float, int, float] | None = None):
+        catalogue = Catalogue(**{column: arrays[f"stars.{column}"] for column in Catalogue.COLUMNS})
+        f = Firmament(catalogue, arrays["vectors"].tolist(), arrays["constellations"].tolist())
+        if photometry is not None: f.usePhotometry(*photometry)
+        return f
+    
+    def arrays(self):
+        arrays = {f"stars.{column}": array for column, array in self.catalogue.arrays().items()}
+        arrays["vectors"] = self.edges
+        arrays["constellations"] = np.array([[str(c.cindex), c.name, c.abbreviation, *map(repr, c.R), c.rgb]
+                                             for c in self.set.values()], dtype = np.str_).reshape(-1, 13)
+        return arrays
+        
+    def populateConstellations(self, dataset: Table):
+        for c in dataset: self.set[int(c[0])] = Constellation(*c)
+        self.publish(changes = (), digest = None)
+        return None
+    
+    def populateStars(self, dataset: 'Table | Catalogue'):
+        catalogue = dataset if isinstance(dataset, Catalogue) else Catalogue.fromTable(dataset, list(self.set))
+        # Line rows belong to the catalogue they were resolved against.
+        self.publish(catalogue = catalogue, **self.linkVectors(self.edges, self.resolveVectors(self.edges, catalogue)),
+                     changes = (), skyindex = None, lod = None, digest = None)
+        return None
+    
+    @property
+    def stars(self):
+        return self.catalogue
+    
+    def populateVectors(self, dataset: 'Table | list'):
+        '''
+        Resolves the vector table (owner, origin constellation, origin index,
+        target constellation, target index) into self.lines, the catalogue
+        rows of both ends of every vector, grouped by owner in constellation
+        order. Vectors naming a missing star, a star outside the stated
+        constellation or an unknown owner are rejected here, once.
+        '''
+        edges = np.array([list(map(int, v)) for v in dataset], dtype = np.int64).reshape(-1, 5)
+        self.publish(**self.linkVectors(edges, self.resolveVectors(edges, self.catalogue)), changes = (), digest = None)
+        return None
+    
+    def resolveVectors(self, edges: np.ndarray, catalogue: Catalogue):
+        rows = catalogue.rows(edges[:, [2, 4]].ravel()).reshape(-1, 2)
+        valid = (rows >= 0).all(axis = 1) & np.isin(edges[:, 0], list(self.set))
+        valid[valid] &= (catalogue.cindex[rows[valid]] == edges[valid][:, [1, 3]]).all(axis = 1)
+        if not valid.all(): raise ValueError(f"Invalid vectors: {edges[~valid].tolist()[:10]}")
+        return rows
+    
+    def linkVectors(self, edges: np.ndarray, rows: np.ndarray):
+        '''
+        Snapshot fields of the edges whose end rows are given: their
+        lines grouped by owner in constellation order, the bounds of
+        each owner's lines and the line colours.
+        '''
+        rank = {cindex: n for n, cindex in enumerate(self.set)}
+        owners = np.array([rank[owner] for owner in edges[:, 0].tolist()], dtype = np.int64)
+        order = np.argsort(owners, kind = "stable")
+        offsets = np.searchsorted(owners[order], np.arange(len(self.set) + 1)).tolist()
+        vectorbounds = {c.cindex: (start, end) for c, start, end in zip(self.set.values(), offsets, offsets[1:])}
+        vectorColors = np.repeat(np.array([c.color for c in self.set.values()], dtype = np.uint32), np.diff(offsets)).reshape(-1)
+        return {"edges": edges, "lines": rows[order], "vectorbounds": vectorbounds, "vectorColors": vectorColors}
+    
+    def publish(self, **fields):
+        '''
+        Swaps in a Snapshot with the given fields changed, in a single
+        assignment, then points the constellations at it.
+        '''
+        state = Snapshot(**{**vars(self.state), **fields})
+        self.state = state
+        if state.catalogue is None: return None
         for c in self.set.values():
-            for v in c.vectorset:
-                rgb = v.rgb
-                if v.position(Matrix(R)):
-                    xA, yA, xB, yB = v.position(Matrix(R))
-                    size = 3
-                    Canvas.drawLine(img, xA, yA, xB, yB, size, rgb)
-            for s in c.starset.values():
-                rgb = s.rgb
-                s.rotate(Matrix(R))
-                if s.position():
-                    x, y = s.position()
-                    size = s.size
-                    Canvas.drawCircle(img, x, y, size, rgb)
-        img.save(f"{os.path.dirname(__file__)}/images/{filename}")
-        # for c in self.set.values():
-        #     # for v in c.vectorset:
-        #     #     rgb = v.rgb
-        #     #     if v.position(Matrix(R)):
-        #     #         xA, yA, xB, yB = v.position(R)
-        #     #         size = 3
-        #     #         Canvas.drawLine(img, xA, yA, xB, yB, size, rgb)
-        #     for s in c.starset.values():
-        #         rgb = s.rgb
-        #         s.rotate(R)
-        #         if s.position():
-        #             x, y = s.position()
-        #             size = s.size
-        #             Canvas.drawCircle(img, x, y, size, rgb)
+            c.populateStarSet(state.catalogue)
+            start, end = state.vectorbounds.get(c.cindex, (0, 0))
+            c.populateVectorSet(state.lines[start:end])
+        return None
+    
+    @property
+    def snapshot(self):
+        '''
+        The Snapshot pinned by the render running in this context (see
+        pinned), or else the one last published.
+        '''
+        reading = Firmament.reading.get()
+        return reading[1] if reading is not None and reading[0] is self else self.state
+    
+    @contextmanager
+    def pinned(self):
+        '''
+        Reads everything inside from one Snapshot, whatever update()
+        publishes meanwhile. Nested pins keep the outer one.
+        '''
+        reading = Firmament.reading.get()
+        if reading is not None and reading[0] is self:
+            yield reading[1]
+            return
+        state = self.state
+        token = Firmament.reading.set((self, state))
+        try: yield state
+        finally: Firmament.reading.reset(token)
+    
+    @property
+    def catalogue(self):
+        return self.snapshot.catalogue
+    
+    @property
+    def edges(self):
+        return self.snapshot.edges
+    
+    @property
+    def lines(self):
+        return self.snapshot.lines
+    
+    @property
+    def vectorbounds(self):
+        return self.snapshot.vectorbounds
+    
+    @property
+    def vectorColors(self):
+        return self.snapshot.vectorColors
+    
+    @property
+    def changes(self):
+        return self.snapshot.changes
+    
+    def update(self, stars: list[list] = (), vectors: list[list] = (), deletedStars: list[int] = (), deletedVectors: list[list] = ()):
+        '''
+        Applies catalogue corrections to the running firmament, without a
+        reload. stars, rows in the stellar catalogue schema, are inserted
+        or replace the star of the same index; vectors, in the vectoral
+        schema, are added. Deleted stars take every vector touching them
+        along, and deleted vectors must exist. Rows, constellation ranges,
+        vector ends, sizes, colours, the index lookup and the sky and
+        magnitude indexes already built are patched rather than rebuilt;
+        stars keep their rows unless they change constellation. The result
+        is published as one new Snapshot, so renders running meanwhile
+        finish on the one they pinned. Invalid corrections raise
+        ValueError and change nothing.
+        Returns the id of the change, which joins the render keys of the
+        views it reaches (see revisions), so other cached renders stay valid.
+        Past COMPACT recorded updates they fold into the catalogue as a new
+        version, which keeps render keys and revision scans bounded at the
+        cost of one wholesale invalidation.
+        '''
+        stars, deletedStars = [list(map(str, s)) for s in stars], [int(index) for index in deletedStars]
+        vectors = np.array([list(map(int, v)) for v in vectors], dtype = np.int64).reshape(-1, 5)
+        deletedVectors = np.array([list(map(int, v)) for v in deletedVectors], dtype = np.int64).reshape(-1, 5)
+        values = Catalogue.parse(stars)
+        indexes = values["index"]
+        values["size"], values["rgb_des"] = Catalogue.starSizes(values["magnitude"]), Catalogue.designationColors(values["designation"])
+        if len(np.unique(indexes)) < len(indexes) or np.isin(indexes, deletedStars).any(): raise ValueError("Stars changed twice.")
+        unknown = ~np.isin(values["cindex"], list(self.set))
+        if unknown.any(): raise ValueError(f"Stars of unknown constellations: {indexes[unknown].tolist()[:10]}")
+        with self.lock:
+            # Render keys of the views no update reaches keep the version as populated.
+            version = self.version
+            state = self.state
+            old = state.catalogue
+            existing, gone = old.rows(indexes), old.rows(deletedStars)
+            if (gone < 0).any(): raise ValueError(f"Unknown stars: {np.asarray(deletedStars)[gone < 0].tolist()[:10]}")
+            same = existing >= 0
+            same[same] = old.cindex[existing[same]] == values["cindex"][same]
+            keep = np.ones(len(old), dtype = bool)
+            keep[gone] = False
+            keep[existing[(existing >= 0) & ~same]] = False
 
-        # for c in self.set.values():
-        #     for s in c.starset.values():
-        #         rgb = Color.WHITE
-        #         s.rotate(R)
-        #         if s.position():
-        #             x, y = s.position()
-        #             size = s.size
-        #             Canvas.drawCircle(img, x, y, size, rgb)
-        # img.save(f"{os.path.dirname(__file__)}/{filename}")
+            # Stars new to a constellation go after its last star.
+            rank = np.full(max([0, *self.set, int(old.cindex.max(initial = 0))]) + 1, len(self.set), dtype = np.int64)
+            rank[list(self.set)] = np.arange(len(self.set))
+            moved = np.flatnonzero(~same)
+            moved = moved[np.argsort(rank[values["cindex"][moved]], kind = "stable")]
+            at = np.searchsorted(rank[old.cindex[keep]], rank[values["cindex"][moved]], side = "right")
+            kept = np.cumsum(keep) - 1
+            arrays = {}
+            for column in Catalogue.COLUMNS[:-1]:
+                array = getattr(old, column)
+                # Longer designations widen the column instead of being cut.
+                dtype = np.result_type(array, values[column]) if column == "designation" else array.dtype
+                merged = array.astype(dtype) if keep.all() else array[keep].astype(dtype, copy = False)
+                merged[kept[existing[same]]] = values[column][same]
+                arrays[column] = np.insert(merged, at, values[column][moved], axis = 0) if len(moved) else merged
+            remap = np.full(len(old), -1, dtype = np.int64)
+            remap[keep] = np.arange(int(keep.sum())) + np.searchsorted(at, np.arange(int(keep.sum())), side = "right")
+            rows = np.empty(len(indexes), dtype = np.int64)
+            rows[same], rows[moved] = remap[existing[same]], at + np.arange(len(at))
+            lookup = remap[old.lookup]
+            lookup = lookup[lookup >= 0]
+            inserted = rows[moved][np.argsort(arrays["index"][rows[moved]], kind = "stable")]
+            lookup = np.insert(lookup, np.searchsorted(arrays["index"][lookup], arrays["index"][inserted]), inserted)
+            catalogue = Catalogue(**arrays, lookup = lookup)
+
+            drop = np.isin(state.edges[:, [2, 4]], deletedStars).any(axis = 1)
+            if len(deletedVectors):
+                where = {}
+                for n, edge in enumerate(state.edges.tolist()): where.setdefault(tuple(edge), []).append(n)
+                missing = [edge for edge in deletedVectors.tolist() if not where.get(tuple(edge))]
+                if missing: raise ValueError(f"Unknown vectors: {missing[:10]}")
+                for edge in deletedVectors.tolist(): drop[where[tuple(edge)].pop()] = True
+            edges = np.concatenate([state.edges[~drop], vectors])
+            ends = self.resolveVectors(edges, catalogue)
+
+            # Where the change shows: every changed star and line, before and after.
+            before = drop | np.isin(state.edges[:, [2, 4]], indexes).any(axis = 1)
+            after = np.isin(edges[:, [2, 4]], indexes).any(axis = 1)
+            after[len(edges) - len(vectors):] = True
+            stale = old.rows(state.edges[before][:, [2, 4]].ravel()).reshape(-1, 2)
+            positions = np.concatenate([old.xyz[gone], old.xyz[existing[existing >= 0]], catalogue.xyz[rows]])
+            lines = np.concatenate([old.xyz[stale], catalogue.xyz[ends[after]]]).reshape(-1, 2, 3)
+            change = hashlib.sha256(json.dumps([version, len(state.changes), stars, deletedStars, vectors.tolist(),
+                                                deletedVectors.tolist()]).encode()).hexdigest()
+
+            remap[existing[same]] = -1
+            skyindex = None if state.skyindex is None else state.skyindex.patched(catalogue.xyz, remap, rows)
+            lod = None if state.lod is None else state.lod.patched(catalogue.xyz, catalogue.magnitude, remap, rows)
+            changes = (*state.changes, (change, positions, lines))
+            if len(changes) > Firmament.COMPACT: changes, version = (), None
+            self.publish(catalogue = catalogue, **self.linkVectors(edges, ends), changes = changes, skyindex = skyindex, lod = lod,
+                         digest = version)
+        return change
+    
+    def applyDelta(self, filepath: str):
+        '''
+        Applies a delta file as one update(): a change per line, "+" or
+        "-", "star" or "vector", then the row in the schema of its
+        catalogue, or only the index of a deleted star.
+        '''
+        stars, vectors, deletedStars, deletedVectors = [], [], [], []
+        for line in Table(filepath):
+            if line == [""]: continue
+            match line[:2]:
+                case ["+", "star"]: stars.append(line[2:])
+                case ["+", "vector"]: vectors.append(line[2:])
+                case ["-", "star"]: deletedStars.extend(line[2:])
+                case ["-", "vector"]: deletedVectors.append(line[2:])
+                case _: raise ValueError(f"Unknown change {','.join(line[:2])!r}.")
+        return self.update(stars, vectors, deletedStars, deletedVectors)
+    
+    def revisions(self, R: 'Matrix | list', projection: str | None = None):
+        '''
+        Ids of the updates that changed a star or line a view through R
+        can show, in order: the ones its render key is made of.
+        '''
+        if not self.changes: return []
+        M = Projection.asArray(R)
+        reach, _ = self.projector(projection)
+        if reach >= PI or not np.allclose(M @ M.T, np.identity(3), atol = 1e-6): return [change for change, _, _ in self.changes]
+        return [change for change, stars, lines in self.changes
+                if np.any(np.concatenate([stars, lines.reshape(-1, 3)]) @ M[0] >= np.cos(reach))]
+    
+    @property
+    def vectors(self):
+        return [v for c in self.set.values() for v in c.vectorset]
+    
+    @property
+    def origins(self):
+        return self.catalogue.xyz[self.lines[:, 0]]
+    
+    @property
+    def targets(self):
+        return self.catalogue.xyz[self.lines[:, 1]]
+    
+    @staticmethod
+    def endpoints(lines: np.ndarray, rows: np.ndarray, x: np.ndarray, y: np.ndarray):
+        '''
+        Pixels of both ends of every line, looked up among the projected
+        star rows (sorted), and the mask of lines with both ends among them.
+        '''
+        if not len(rows): return (np.full(len(lines), -1, dtype = np.int64),) * 4 + (np.zeros(len(lines), dtype = bool),)
+        found = np.minimum(np.searchsorted(rows, lines), len(rows) - 1)
+        hit = rows[found] == lines
+        xs, ys = np.where(hit, x[found], -1), np.where(hit, y[found], -1)
+        return xs[:, 0], ys[:, 0], xs[:, 1], ys[:, 1], hit.all(axis = 1)
+    
+    def project(self, R: 'Matrix | list', magnitude: float | None = None, count: int | None = None):
+        '''
+        Projects every star and vector of the firmament at once.
+        Returns the star pixels and visibility mask, then the
+        vector endpoint pixels and the mask of fully visible vectors.
+        Stars left out by the magnitude or count limits are not visible.
+        '''
+        with self.pinned():
+            x, y, visible = Projection.project(self.catalogue.xyz, R)
+            if magnitude is not None or count is not None:
+                visible = np.zeros(len(self.catalogue), dtype = bool)
+                visible[self.visibleStars(R, magnitude, count)[0]] = True
+                x, y = np.where(visible, x, -1), np.where(visible, y, -1)
+            visibleV = visible[self.lines[:, 0]] & visible[self.lines[:, 1]]
+            (xA, xB), (yA, yB) = x[self.lines.T], y[self.lines.T]
+            return (x, y, visible), (xA, yA, xB, yB, visibleV)
+    
+    @property
+    def index(self):
+        state = self.snapshot
+        if state.skyindex is None:
+            with self.lock:
+                if state.skyindex is None: state.skyindex = SkyIndex(state.catalogue.xyz)
+        return state.skyindex
+    
+    @property
+    def levels(self):
+        state = self.snapshot
+        if state.lod is None:
+            with self.lock:
+                if state.lod is None: state.lod = Levels(state.catalogue.xyz, state.catalogue.magnitude, Catalogue.LIMITS)
+        return state.lod
+    
+    def cone(self, direction: 'Matrix | list', radius: float, magnitude: float | None = None):
+        '''
+        Catalogue rows within radius radians of direction,
+        optionally only those brighter than magnitude.
+        '''
+        if isinstance(direction, (Matrix, Mat3, Vec3)): direction = list(direction)
+        if magnitude is None: return self.index.cone(direction, radius)
+        return self.levels.cone(direction, radius, magnitude)
+    
+    def box(self, R: 'Matrix | list', theta: tuple[float, float], phi: tuple[float, float], magnitude: float | None = None):
+        '''
+        Catalogue rows whose polar angles seen through R lie within the
+        theta and phi ranges, optionally only those brighter than magnitude.
+        '''
+        if magnitude is None: return self.index.box(R, theta, phi)
+        return self.levels.box(R, theta, phi, magnitude)
+    
+    def visibleStars(self, R: 'Matrix | list', magnitude: float | None = None, count: int | None = None, zenith: np.ndarray | None = None,
+                     projection: str | None = None, rounded: bool = True):
+        '''
+        Projects only the stars of cells that can reach the canvas.
+        The canvas spans PI / 4 around the view axis in both angles,
+        so every visible star lies within PI / 3 of the first row of R.
+        Returns the visible rows in catalogue order and their pixels.
+        magnitude keeps only brighter stars and count only the count
+        brightest visible ones; both walk the magnitude buckets
+        brightest first and stop as soon as the limit is reached.
+        zenith, a sky direction, culls the stars below its horizon, and
+        projection names the Kernel mapping them to pixels (see show), and
+        rounded False keeps the pixels at sub-pixel precision.
+        '''
+        with self.pinned():
+            M = Projection.asArray(R)
+            if magnitude is not None or count is not None: rows, x, y = self.brightestStars(M, magnitude, count, zenith, projection, rounded)
+            else:
+                reach, project = self.projector(projection)
+                with Instruments.stage("culling"):
+                    if reach < PI and np.allclose(M @ M.T, np.identity(3), atol = 1e-6): rows = self.index.candidates(M[0], reach)
+                    else: rows = np.arange(len(self.catalogue))
+                    rows = self.above(rows, zenith)
+                with Instruments.stage("projection"):
+                    x, y, visible = project(self.catalogue.xyz[rows], M, rounded = rounded)
+                    rows, x, y = rows[visible], x[visible], y[visible]
+            Instruments.count("stars.considered", len(self.catalogue))
+            Instruments.count("stars.culled", len(self.catalogue) - len(rows))
+            return rows, x, y
+    
+    def brightestStars(self, M: np.ndarray, magnitude: float | None = None, count: int | None = None, zenith: np.ndarray | None = None,
+                       projection: str | None = None, rounded: bool = True):
+        reach, project = self.projector(projection)
+        culled = reach < PI and np.allclose(M @ M.T, np.identity(3), atol = 1e-6)
+        found, total = [], 0
+        for bucket in self.levels.buckets(magnitude):
+            with Instruments.stage("culling"):
+                if culled: rows = self.levels.candidates(bucket, M[0], reach, magnitude)
+                else: rows = self.levels.select(bucket, self.levels.rows[bucket], magnitude)
+                rows = self.above(rows, zenith)
+            with Instruments.stage("projection"):
+                x, y, visible = project(self.catalogue.xyz[rows], M, rounded = rounded)
+            found.append((rows[visible], x[visible], y[visible]))
+            total += int(visible.sum())
+            if count is not None and total >= count: break
+        rows, x, y = (np.concatenate(parts) for parts in zip(*found))
+        if count is not None and len(rows) > count: chosen = np.lexsort((rows, self.catalogue.magnitude[rows]))[:count]
+        else: chosen = np.arange(len(rows))
+        chosen = chosen[np.argsort(rows[chosen])]
+        return rows[chosen], x[chosen], y[chosen]
+    
+    @staticmethod
+    def projector(projection: str | None = None):
+        '''
+        Cone radius around the view axis holding every star a projection
+        can show, and its (xyz, R) -> (x, y, visible) mapping.
+        '''
+        if projection is None: return PI / 3 + 0.01, Projection.project
+        kernel = Projection.kernel(projection)
+        return kernel.reach + 0.01, kernel.project
+    
+    @staticmethod
+    def canvas(projection: str | None = None):
+        if projection is None: return (Projection.WIDTH, Projection.HEIGHT)
+        return Projection.kernel(projection).shape()
+    
+    def above(self, rows: np.ndarray, zenith: np.ndarray | None = None):
+        if zenith is None: return rows
+        return rows[self.catalogue.xyz[rows] @ np.asarray(zenith, dtype = np.float64) >= 0]
+    
+    def pick(self, x: int, y: int, R: 'Matrix | list', radius: float = 0.01, magnitude: float | None = None,
+             projection: str | None = None):
+        '''
+        Star under pixel x, y of the view through R: the star, its
+        constellation and its angular distance in radians from the
+        pixel, or None when no star lies within radius. magnitude
+        limits the match to brighter stars, as in limited renders.
+        '''
+        with self.pinned():
+            rows, distances = self.pickMany([x], [y], R, radius, magnitude, projection)
+            if rows[0] < 0: return None
+            star = Star(self.catalogue, int(rows[0]))
+            return star, self.set[star.cindex], float(distances[0])
+    
+    def pickMany(self, x: np.ndarray, y: np.ndarray, R: 'Matrix | list', radius: float = 0.01, magnitude: float | None = None,
+                 projection: str | None = None):
+        '''
+        Batch pick: catalogue rows of the stars under many pixels and
+        their angular distances, -1 and inf where no star is close enough
+        or the pixel is off the map.
+        '''
+        with self.pinned():
+            if projection is None: directions, valid = Projection.unproject(x, y, R), None
+            else: directions, valid = Projection.kernel(projection).unproject(x, y, R)
+            if magnitude is None: rows, distances = self.index.nearest(directions, radius)
+            else: rows, distances = self.levels.nearest(directions, radius, magnitude)
+            if valid is not None: rows[~valid], distances[~valid] = -1, np.inf
+            return rows, distances
+    
+    def instrument(self, *sinks, memory: bool = False, profile: bool = False):
+        '''
+        Turns on render instrumentation, reporting every show() to the
+        sinks (see Instruments). Without sinks it is turned off again.
+        '''
+        self.instruments = Instruments(*sinks, memory = memory, profile = profile) if sinks else None
+        return self.instruments
+    
+    def show(self, option: int = 0, reference: int = -1, filename: str = "out.png", magnitude: float | None = None, count: int | None = None,
+             projection: str | None = None):
+        '''
+        Renders one view to filename; magnitude and count limit the stars
+        drawn to the brighter or count brightest ones (see visibleStars).
+        projection names a registered Kernel to draw with instead of the
+        canvas window; full-sky ones show the whole sky in one image.
+        '''
+        if self.instruments is None: return self.dispatch(option, reference, filename, magnitude, count, projection)
+        with self.instruments.render(option = option, reference = reference, filename = filename, projection = projection):
+            return self.dispatch(option, reference, filename, magnitude, count, projection)
+    
+    def dispatch(self, option: int, reference: int, filename: str, magnitude: float | None = None, count: int | None = None,
+                 projection: str | None = None):
+        match option:
+            case 0: self.showRealistic(reference, filename, magnitude, count, projection)
+            case 1: self.showConstellation(reference, filename, magnitude, count)
+            case 2: self.showDesignation(reference, filename, magnitude, count, projection)
+            case 3: self.showPages(reference, filename, magnitude, count, projection)
+            case 4: self.showPlain(reference, filename, magnitude, count, projection)
+            case 5: self.showPhotometric(reference, filename, magnitude, count, projection)
+        return None
+    
+    def renderMany(self, jobs: list[tuple[int, int, str]], processes: int | None = None):
+        '''
+        Runs show(option, reference, filename) for every job on a process pool.
+        Workers attach to the catalogue arrays in shared memory instead of
+        re-loading or unpickling the firmament, and draw with its photometry. Returns one record per job,
+        in job order, with the render time in seconds and the worker pid.
+        '''
+        block, layout = Shared.pack(self.arrays())
+        try:
+            with ProcessPoolExecutor(processes, initializer = Firmament.attach, initargs = (block.name, layout, self.photometry)) as pool:
+                return list(pool.map(Firmament.renderJob, jobs))
+        finally:
+            block.close()
+            block.unlink()
+    
+    @staticmethod
+    def attach(name: str, layout: list, photometry: tuple[float, int, float] | None = None, cache: tuple[int, str | None] | None = None):
+        block, arrays = Shared.attach(name, layout)
+        f = Firmament.fromArrays(arrays, photometry)
+        if cache is not None: f.useCache(*cache)
+        Firmament.worker = (block, f)
+        return None
+    
+    @staticmethod
+    def renderJob(job: tuple[int, int, str]):
+        f = Firmament.worker[1]
+        start = time.perf_counter()
+        f.show(*job)
+        return {"job": job, "seconds": time.perf_counter() - start, "process": os.getpid()}
+    
+    def path(self, keyframes: list, steps: int = 30):
+        '''
+        View matrices of a camera path through the keyframes, which are
+        constellation indexes or matrices. Consecutive keyframes are joined
+        by steps slerp frames; keyframes themselves are kept exact.
+        Returns a (frames, 3, 3) array; ValueError when steps is below 1.
+        '''
+        if steps < 1: raise ValueError(f"A path needs at least one step between keyframes, not {steps}.")
+        matrices = [Projection.asArray(self.set[int(k)].R if isinstance(k, Integral) else k) for k in keyframes]
+        if len(matrices) < 2: return np.array(matrices).reshape(-1, 3, 3)
+        quats = [Quat.fromMatrix(M) for M in matrices]
+        t = np.arange(steps) / steps
+        path = [Quat.toMatrices(Quat.slerp(a, b, t)) for a, b in zip(quats, quats[1:])]
+        for segment, M in zip(path, matrices): segment[0] = M
+        return np.concatenate([*path, matrices[-1][None]])
+    
+    def animate(self, keyframes: list, steps: int = 30, option: int = 0, reference: int = -1):
+        '''
+        Lazily yields the RGB framebuffer of every frame of the camera path.
+        The same buffer is reused from frame to frame, so copy it to keep it.
+        '''
+        frame = None
+        for M in self.path(keyframes, steps):
+            frame = self.draw(option, M, reference).framebuffer(frame)
+            yield frame
+    
+    def record(self, keyframes: list, target, steps: int = 30, option: int = 0, reference: int = -1):
+        '''
+        Writes the animation either as an image sequence, when target is a
+        filename pattern such as "frames/{:05d}.png", or as raw rgb24 frames
+        to a binary stream (e.g. the stdin of an encoder). Returns the
+        number of frames written.
+        '''
+        count = 0
+        for count, frame in enumerate(self.animate(keyframes, steps, option, reference), 1):
+            if isinstance(target, str): Image.fromarray(frame).save(target.format(count - 1))
+            else: target.write(frame.tobytes())
+        return count
+    
+    def observe(self, latitude: float, longitude: float, times: np.ndarray, azimuth: float = PI, altitude: float = PI / 4):
+        '''
+        View matrices of a camera at latitude and longitude looking
+        towards azimuth and altitude, for every one of the times (see
+        Ephemeris), and the zenith of each as a sky direction. All
+        frames are computed together as (T, 3, 3) and (T, 3) arrays.
+        '''
+        frames = Ephemeris.frames(times, latitude, longitude)
+        return Ephemeris.view(azimuth, altitude) @ frames, frames[:, 2]
+    
+    def watch(self, latitude: float, longitude: float, times: np.ndarray, azimuth: float = PI, altitude: float = PI / 4,
+              option: int = 0, reference: int = -1, magnitude: float | None = None, count: int | None = None):
+        '''
+        Lazily yields the RGB framebuffer of the sky seen from latitude and
+        longitude at each of the times, stars below the horizon left out.
+        As in animate, the same buffer is reused from frame to frame.
+        '''
+        frame = None
+        views, zeniths = self.observe(latitude, longitude, times, azimuth, altitude)
+        for M, zenith in zip(views, zeniths):
+            frame = self.draw(option, M, reference, magnitude, count, zenith).framebuffer(frame)
+            yield frame
+    
+    def draw(self, option: int, R: 'Matrix | list', reference: int = -1, magnitude: float | None = None, count: int | None = None,
+             zenith: np.ndarray | None = None, projection: str | None = None):
+        '''
+        Draws the firmament seen through R in the style of the given
+        show option, without saving. reference is the constellation
+        highlighted by the designation style. zenith hides the
+        stars below its horizon (see observe), and projection names
+        the Kernel to draw with (see show).
+        '''
+        with self.pinned():
+            match option:
+                case 0: return self.drawRealistic(R, magnitude, count, zenith, projection)
+                case 2: return self.drawDesignation(R, reference, magnitude, count, zenith, projection)
+                case 3: return self.drawPages(R, magnitude, count, zenith, projection)
+                case 4: return self.drawPlain(R, magnitude, count, zenith, projection)
+                case 5: return self.drawPhotometric(R, magnitude, count, zenith, projection)
+            raise ValueError(f"Option {option} cannot be drawn.")
+    
+    def drawPlain(self, R: 'Matrix | list', magnitude: float | None = None, count: int | None = None, zenith: np.ndarray | None = None,
+                   projection: str | None = None):
+        raster = Raster(*self.canvas(projection))
+        rows, x, y = self.visibleStars(R, magnitude, count, zenith, projection)
+        with Instruments.stage("projection"):
+            xA, yA, xB, yB, visibleV = Firmament.endpoints(self.lines, rows, x, y)
+            if projection is not None:
+                # Lines torn by the seam of a full-sky map would span the whole image.
+                A, B = (Projection.rotate(self.catalogue.xyz[ends], R) for ends in self.lines.T)
+                visibleV &= ~Projection.kernel(projection).torn(A, B)
+        Instruments.count("vectors.considered", len(visibleV))
+        Instruments.count("vectors.culled", len(visibleV) - int(visibleV.sum()))
+        Instruments.count("vectors.drawn", int(visibleV.sum()))
+        Instruments.count("stars.drawn", len(rows))
+        with Instruments.stage("rasterization"):
+            ranges = self.catalogue.bounds
+            bounds = np.searchsorted(rows, [ranges.get(c.cindex, (0, 0)) for c in self.set.values()]).tolist()
+            sizes, colors = self.catalogue.size[rows], self.catalogue.rgb[rows]
+            for c, (first, last) in zip(self.set.values(), bounds):
+                start, end = self.vectorbounds[c.cindex]
+                chosen = np.flatnonzero(visibleV[start:end]) + start
+                size = 3
+                raster.lines(xA[chosen], yA[chosen], xB[chosen], yB[chosen], size, self.vectorColors[chosen])
+                raster.circles(x[first:last], y[first:last], sizes[first:last], colors[first:last])
+            raster.resolve()
+        return raster
+    
+    def drawRealistic(self, R: 'Matrix | list', magnitude: float | None = None, count: int | None = None, zenith: np.ndarray | None = None,
+                       projection: str | None = None):
+        raster = Raster(*self.canvas(projection))
+        rows, x, y = self.visibleStars(R, magnitude, count, zenith, projection)
+        Instruments.count("stars.drawn", len(rows))
+        with Instruments.stage("rasterization"):
+            raster.circles(x, y, self.catalogue.size[rows], self.catalogue.rgb[rows])
+            raster.resolve()
+        return raster
+    
+    def drawPhotometric(self, R: 'Matrix | list', magnitude: float | None = None, count: int | None = None, zenith: np.ndarray | None = None,
+                        projection: str | None = None):
+        '''
+        Additive render: every star adds a Gaussian of its flux, a star of
+        the white magnitude peaking at 1 before tone mapping (see usePhotometry).
+        '''
+        sigma, supersample, white = self.photometry
+        exposure = Exposure(*self.canvas(projection), sigma, supersample)
+        rows, x, y = self.visibleStars(R, magnitude, count, zenith, projection, rounded = False)
+        Instruments.count("stars.drawn", len(rows))
+        with Instruments.stage("rasterization"):
+            flux = 2 * PI * sigma * sigma * 10 ** (-0.4 * (self.catalogue.magnitude[rows].astype(np.float64) - white))
+            exposure.splat(x, y, flux, self.catalogue.rgb[rows])
+            exposure.resolve()
+        return exposure
+    
+    def drawDesignation(self, R: 'Matrix | list', reference: int, magnitude: float | None = None, count: int | None = None,
+                        zenith: np.ndarray | None = None, projection: str | None = None):
+        raster = Raster(*self.canvas(projection))
+        rows, x, y = self.visibleStars(R, magnitude, count, zenith, projection)
+        Instruments.count("stars.drawn", len(rows))
+        with Instruments.stage("rasterization"):
+            start, end = self.catalogue.bounds.get(reference, (0, 0))
+            colors = np.where((start <= rows) & (rows < end), self.catalogue.rgb_des[rows], Color.hex_to_rgb(Color.WHITE))
+            raster.circles(x, y, self.catalogue.size[rows], colors)
+            raster.resolve()
+        return raster
+    
+    def drawPages(self, R: 'Matrix | list', magnitude: float | None = None, count: int | None = None, zenith: np.ndarray | None = None,
+                   projection: str | None = None):
+        raster = Raster(*self.canvas(projection), background = Color.hex_to_rgb(Color.WHITE))
+        rows, x, y = self.visibleStars(R, magnitude, count, zenith, projection)
+        Instruments.count("stars.drawn", len(rows))
+        with Instruments.stage("rasterization"):
+            raster.circles(x, y, self.catalogue.size[rows], Color.hex_to_rgb(Color.BLACK))
+            raster.resolve()
+        return raster
+    
+    def showPlain(self, reference: int, filename: str, magnitude: float | None = None, count: int | None = None,
+                  projection: str | None = None):
+        if reference < 0: return None
+        self.output(4, reference, f"{os.path.dirname(__file__)}/images/{filename}", magnitude, count, projection)
         return None
 
-    def showRealistic(self, reference: int, filename: str):
+    def showRealistic(self, reference: int, filename: str, magnitude: float | None = None, count: int | None = None,
+                      projection: str | None = None):
         if reference < 0: return None
-        R = self.set[reference].R
-        img = Canvas.create()
-        for c in self.set.values():
-            for s in c.starset.values():
-                rgb = s.rgb
-                s.rotate(R)
-                if s.position():
-                    x, y = s.position()
-                    size = s.size
-                    Canvas.drawCircle(img, x, y, size, rgb)
-        img.save(f"{os.path.dirname(__file__)}/{filename}")
+        self.output(0, reference, f"{os.path.dirname(__file__)}/{filename}", magnitude, count, projection)
         return None
     
-    def showConstellation(self, reference: int, filename: str):
+    def showConstellation(self, reference: int, filename: str, magnitude: float | None = None, count: int | None = None):
         # if reference < 0: return None
         # R = self.set[reference].R
         # img = Canvas.create()
@@ -272,49 +1110,340 @@ class Firmament:
         # img.save(f"{os.path.dirname(__file__)}/{filename}")
         return None
     
-    def showDesignation(self, reference: int, filename: str):
-        # if reference < 0: return None
-        # R = self.set[reference].R
-        # img = Canvas.create()
-        # for c in self.set.values():
-        #     for s in c.starset.values():
-        #         if c.cindex == reference: rgb = s.rgb_des
-        #         else: rgb = Color.WHITE
-        #         s.rotate(R)
-        #         if s.position():
-        #             x, y = s.position()
-        #             size = s.size
-        #             Canvas.drawCircle(img, x, y, size, rgb)
-        # img.save(f"{os.path.dirname(__file__)}/{filename}")
+    def showPhotometric(self, reference: int, filename: str, magnitude: float | None = None, count: int | None = None,
+                        projection: str | None = None):
+        if reference < 0: return None
+        self.output(5, reference, f"{os.path.dirname(__file__)}/{filename}", magnitude, count, projection)
         return None
     
-    def showPages(self, reference: int, filename: str):
-        from PIL import Image
+    def showDesignation(self, reference: int, filename: str, magnitude: float | None = None, count: int | None = None,
+                        projection: str | None = None):
         if reference < 0: return None
-        R = [[[1,0,0],[0,0,1],[0,-1,0]],
-             [[0.5,0.866025403784,0],[0,0,1],[0.866025403784,-0.5,0]],
-             [[-0.5,0.866025403784,0],[0,0,1],[0.866025403784,0.5,0]],
-             [[-1,0,0],[0,0,1],[0,1,0]],
-             [[-0.5,-0.866025403784,0],[0,0,1],[-0.866025403784,0.5,0]],
-             [[0.5,-0.866025403784,0],[0,0,1],[-0.866025403784,-0.5,0]],
-             [[0.57735026919,0.57735026919,0.57735026919],[-0.707106781187,0,0.707106781187],[0.408248290464,-0.816496580928,0.408248290464]],
-             [[-0.57735026919,0.57735026919,0.57735026919],[0.707106781187,0,0.707106781187],[0.408248290464,0.816496580928,-0.408248290464]],
-             [[-0.57735026919,-0.57735026919,0.57735026919],[0.707106781187,0,0.707106781187],[-0.408248290464,0.816496580928,0.408248290464]],
-             [[0.57735026919,-0.57735026919,0.57735026919],[-0.707106781187,0,0.707106781187],[-0.408248290464,-0.816496580928,-0.408248290464]],
-             [[0.57735026919,0.57735026919,-0.57735026919],[0.707106781187,0,0.707106781187],[0.408248290464,-0.816496580928,-0.408248290464]],
-             [[-0.57735026919,0.57735026919,-0.57735026919],[-0.707106781187,0,0.707106781187],[0.408248290464,0.816496580928,0.408248290464]],
-             [[-0.57735026919,-0.57735026919,-0.57735026919],[-0.707106781187,0,0.707106781187],[-0.408248290464,0.816496580928,-0.408248290464]],
-             [[0.57735026919,-0.57735026919,-0.57735026919],[0.707106781187,0,0.707106781187],[-0.408248290464,-0.816496580928,0.408248290464]],
-             [[0,0,1],[-1,0,0],[0,-1,0]],
-             [[0,0,-1],[1,0,0],[0,-1,0]]][reference]
-        img = Image.new("RGB", (1572, 1572), Color.hex_to_tuple(Color.WHITE))
-        for c in self.set.values():
-            for s in c.starset.values():
-                rgb = Color.BLACK
-                s.rotate(Matrix(R))
-                if s.position():
-                    x, y = s.position()
-                    size = s.size
-                    Canvas.drawCircle(img, x, y, size, rgb)
-        img.save(f"{os.path.dirname(__file__)}/images/{filename}")
-        return None
\ No newline at end of file
+        self.output(2, reference, f"{os.path.dirname(__file__)}/{filename}", magnitude, count, projection)
+        return None
+    
+    def showPages(self, reference: int, filename: str, magnitude: float | None = None, count: int | None = None,
+                  projection: str | None = None):
+        if reference < 0: return None
+        self.output(3, reference, f"{os.path.dirname(__file__)}/images/{filename}", magnitude, count, projection)
+        return None
+    
+    def output(self, option: int, reference: int, filepath: str, magnitude: float | None = None, count: int | None = None,
+               projection: str | None = None):
+        '''
+        Renders one view to filepath, encoded as its suffix says (see
+        Encoder). With a writer (see useWriter) only the drawing happens
+        here; encoding and writing run in the background.
+        '''
+        with self.pinned():
+            format = Encoder.formatOf(filepath)
+            R = self.orientation(option, reference)
+            key = None if self.renders is None else self.renderKey(option, reference, magnitude, count, format, projection = projection)
+            data = self.cached(key)
+            if data is None:
+                raster = self.draw(option, R, reference, magnitude, count, projection = projection)
+                if self.writer is not None:
+                    self.writer.submit(lambda: self.save(self.encode(raster, option, key, format), filepath))
+                    return None
+                data = self.encode(raster, option, key, format)
+            if self.writer is not None: self.writer.submit(self.save, data, filepath)
+            else: self.save(data, filepath)
+            return None
+    
+    @staticmethod
+    def save(data: bytes, filepath: str):
+        with Instruments.stage("write"):
+            os.makedirs(os.path.dirname(filepath) or ".", exist_ok = True)
+            with open(filepath, "wb") as ofile: ofile.write(data)
+        return None
+    
+    def atlas(self, filepath: str, pages: list[tuple[int, int]] | None = None, magnitude: float | None = None, count: int | None = None,
+              projection: str | None = None, vector: bool = False, resolution: int = 300, workers: int = 1):
+        '''
+        Renders pages, (option, reference) pairs of show() views defaulting
+        to the 16 printable pages, into one multi-page PDF or TIFF (see
+        Atlas), vector paths instead of images when asked. Pages are drawn
+        on workers threads and written in order; at most one page per
+        worker is held at a time.
+        '''
+        pages = [(3, page) for page in range(len(Firmament.VIEWS))] if pages is None else pages
+        def prepare(option: int, reference: int):
+            R = self.orientation(option, reference)
+            return atlas.page(self.draw(option, R, reference, magnitude, count, projection = projection), "P" if option in (2, 3) else "RGB")
+        # Every page is drawn from the catalogue as it stood when the atlas began (see pinned).
+        with self.pinned(), Atlas(filepath, vector, resolution) as atlas, ThreadPoolExecutor(workers) as pool:
+            pending = deque()
+            for page in pages:
+                pending.append(pool.submit(contextvars.copy_context().run, prepare, *page))
+                if len(pending) >= workers: atlas.add(pending.popleft().result())
+            while pending: atlas.add(pending.popleft().result())
+        return None
+    
+    def useWriter(self, workers: int = 1, queue: int = 4):
+        '''
+        Hands the encoding and writing of show() views to a background
+        Writer, so batches overlap them with the next render; call
+        writer.wait() to make sure every file is written. Zero workers
+        closes the writer and turns it off.
+        '''
+        if self.writer is not None: self.writer.close()
+        self.writer = Writer(workers, queue) if workers else None
+        return self.writer
+    
+    def usePhotometry(self, sigma: float = 0.8, supersample: int = 1, white: float = 1.0):
+        '''
+        Settings of the photometric style (show option 5): the PSF width
+        in pixels, the supersampling factor and the magnitude whose stars
+        peak at full exposure before tone mapping.
+        '''
+        if sigma <= 0 or supersample < 1: raise ValueError("sigma must be positive and supersample at least 1.")
+        self.photometry = (float(sigma), int(supersample), float(white))
+        return self.photometry
+    
+    def useCache(self, capacity: int = 64, folder: str | None = None):
+        '''
+        Keeps encoded renders in a Cache of capacity images in memory,
+        backed by folder on disk when given. Zero capacity without a
+        folder turns caching off.
+        '''
+        self.renders = Cache(capacity, folder) if capacity or folder else None
+        return self.renders
+    
+    @property
+    def version(self):
+        '''
+        Content hash of the catalogue, vectors and constellations as last
+        populated, kept with the snapshot it was taken of. update() leaves
+        it be and records revisions instead.
+        '''
+        with self.pinned() as state:
+            if state.digest is None:
+                digest = hashlib.sha256()
+                for name, array in sorted(self.arrays().items()):
+                    digest.update(f"{name}:{array.dtype.str}:{array.shape}".encode())
+                    digest.update(np.ascontiguousarray(array).tobytes())
+                state.digest = digest.hexdigest()
+            return state.digest
+    
+    def orientation(self, option: int, reference: int):
+        return Firmament.VIEWS[reference] if option in (3, 4) else self.set[reference].R
+    
+    def renderKey(self, option: int, reference: int, magnitude: float | None = None, count: int | None = None,
+                  format: str = "png", level: int | None = None, projection: str | None = None):
+        R = self.orientation(option, reference)
+        level = Encoder.level(format, level)
+        view = [self.version, option, reference if option == 2 else None, Projection.asArray(R).tolist(),
+                [Projection.WIDTH, Projection.HEIGHT, Projection.SCALE], magnitude, count, format, level, projection,
+                self.photometry if option == 5 else None, *self.revisions(R, projection)]
+        digest = hashlib.sha256(json.dumps(view).encode()).hexdigest()
+        return digest[:2], f"{digest}.{format}"
+    
+    def render(self, option: int, reference: int, magnitude: float | None = None, count: int | None = None,
+               format: str = "png", level: int | None = None, projection: str | None = None):
+        '''
+        Encoded bytes of a show() view in the given format and level (see
+        Encoder), served from the render cache when the same view, mode,
+        canvas, limits, encoding and catalogue version were encoded before.
+        '''
+        with self.pinned():
+            R = self.orientation(option, reference)
+            # Without a cache nobody reads the key, and its version hashes every catalogue array.
+            key = None if self.renders is None else self.renderKey(option, reference, magnitude, count, format, level, projection)
+            data = self.cached(key)
+            if data is not None: return data
+            return self.encode(self.draw(option, R, reference, magnitude, count, projection = projection), option, key, format, level)
+    
+    def frame(self, option: int, reference: int, magnitude: float | None = None, count: int | None = None,
+              out: np.ndarray | None = None, projection: str | None = None):
+        '''
+        Raw (height, width, 3) uint8 framebuffer of a show() view, drawn
+        into out when given instead of a new array. Never cached.
+        '''
+        with self.pinned():
+            R = self.orientation(option, reference)
+            raster = self.draw(option, R, reference, magnitude, count, projection = projection)
+            with Instruments.stage("composition"): return raster.framebuffer(out)
+    
+    def cached(self, key: tuple | None):
+        if self.renders is None or key is None: return None
+        data = self.renders.get(key)
+        Instruments.count("cache.hits", data is not None)
+        return data
+    
+    def encode(self, raster: Raster, option: int, key: tuple | None, format: str = "png", level: int | None = None):
+        with Instruments.stage("composition"): composed = Encoder.compose(raster, "P" if option in (2, 3) else "RGB", format)
+        with Instruments.stage("encode"): data = Encoder.pack(composed, format, level)
+        if self.renders is not None and key is not None: self.renders.put(key, data)
+        return data
+
+@dataclass
+class Tiles:
+    '''
+    Whole-sky map cut into square tiles, rendered on demand at any zoom.
+    Zoom z spans 2 ** (z + 1) x 2 ** z tiles of an equirectangular map,
+    north up and longitude growing to the left as seen from inside the
+    sphere. Tiles are PNG bytes kept in a Cache, so a viewer can pan and
+    zoom without the full image ever being held in memory. magnitudes
+    gives a limiting magnitude per zoom, so coarse tiles skip faint stars.
+    '''
+    OPTIONS = (0, 3, 4)
+
+    def __init__(self, firmament: Firmament, option: int = 0, size: int = 256,
+                 capacity: int = 256, folder: str | None = None, magnitudes: list[float] | None = None):
+        if option not in Tiles.OPTIONS: raise ValueError(f"Option {option} cannot be tiled.")
+        self.firmament: Firmament = firmament
+        self.option: int = option
+        self.size: int = size
+        self.cache: Cache = Cache(capacity, folder, ".png")
+        self.magnitudes: list[float] | None = magnitudes
+        return None
+    
+    def magnitude(self, zoom: int):
+        '''
+        Limiting magnitude at zoom: magnitudes[zoom], the last entry
+        beyond the list, no limit without one.
+        '''
+        if not self.magnitudes: return None
+        return self.magnitudes[min(zoom, len(self.magnitudes) - 1)]
+    
+    def scale(self, zoom: int):
+        return self.size * 2 ** zoom / PI
+    
+    def count(self, zoom: int):
+        '''
+        Tiles across and down at zoom.
+        '''
+        return 2 ** (zoom + 1), 2 ** zoom
+    
+    def bounds(self, zoom: int, tx: int, ty: int, margin: float = 0.0):
+        '''
+        Sky region of a tile, widened by margin pixels: (theta, phi) ranges.
+        '''
+        scale = self.scale(zoom)
+        top, bottom = PI / 2 - (ty * self.size - margin) / scale, PI / 2 - ((ty + 1) * self.size + margin) / scale
+        phi = (max(bottom, -PI / 2), min(top, PI / 2) + 1e-12)
+        reach = max(abs(phi[0]), abs(phi[1]))
+        widen = margin / scale / cos(reach) if reach < PI / 2 - 1e-3 else PI
+        left, right = 2 * PI - tx * self.size / scale, 2 * PI - (tx + 1) * self.size / scale
+        if self.size / scale + 2 * widen >= 2 * PI: return (0.0, 0.0), phi
+        return ((right - widen) % (2 * PI), (left + widen) % (2 * PI)), phi
+    
+    def margin(self, zoom: int):
+        '''
+        Pixels around a tile whose stars and lines may still reach it.
+        '''
+        return 3 + 8 * min(self.scale(zoom) / Projection.SCALE, 1.0)
+    
+    def padding(self, zoom: int):
+        '''
+        Pixels a tile's canvas extends beyond it on every side: the margin
+        plus the largest star, so nothing reaching the tile is drawn at
+        negative coordinates, where PIL would clip it differently from
+        the neighbouring tile.
+        '''
+        return int(np.ceil(self.margin(zoom) + max(Catalogue.SIZES) * min(self.scale(zoom) / Projection.SCALE, 1.0))) + 1
+    
+    def pixels(self, xyz: np.ndarray, zoom: int, tx: int, ty: int):
+        '''
+        Tile pixels (row, column) of catalogue-frame positions; columns
+        wrap around the seam to the side nearest the tile's centre.
+        '''
+        scale, width = self.scale(zoom), self.count(zoom)[0] * self.size
+        theta, phi = Projection.toPolar(xyz)
+        row = np.rint((PI / 2 - phi) * scale).astype(np.int64) - ty * self.size
+        column = np.rint(((-theta) % (2 * PI)) * scale).astype(np.int64) - tx * self.size
+        # Wrapped around the tile's centre, so either side of a half-map tile keeps its stars.
+        centre = self.size // 2
+        column = (column - centre + width // 2) % width - width // 2 + centre
+        return row, column
+    
+    def render(self, zoom: int, tx: int, ty: int):
+        '''
+        Raster of one tile, drawn straight from the catalogue onto a
+        canvas padded by padding(zoom) pixels on every side.
+        '''
+        with self.firmament.pinned():
+            across, down = self.count(zoom)
+            if not (0 <= tx < across and 0 <= ty < down): raise ValueError(f"No tile ({zoom}, {tx}, {ty}).")
+            f, catalogue = self.firmament, self.firmament.catalogue
+            shrink, margin, pad = min(self.scale(zoom) / Projection.SCALE, 1.0), self.margin(zoom), self.padding(zoom)
+            raster = Raster(self.size + 2 * pad, self.size + 2 * pad, Color.hex_to_rgb(Color.WHITE) if self.option == 3 else 0)
+            with Instruments.stage("culling"):
+                rows = f.box(np.identity(3), *self.bounds(zoom, tx, ty, margin), self.magnitude(zoom))
+            with Instruments.stage("projection"):
+                x, y = self.pixels(catalogue.xyz[rows], zoom, tx, ty)
+                x, y = x + pad, y + pad
+            Instruments.count("stars.drawn", len(rows))
+            with Instruments.stage("rasterization"):
+                if self.option == 4:
+                    xA, yA, xB, yB, chosen = self.crossing(f.origins, f.targets, zoom, tx, ty)
+                    raster.lines(xA[chosen] + pad, yA[chosen] + pad, xB[chosen] + pad, yB[chosen] + pad, max(int(3 * shrink), 1), f.vectorColors[chosen])
+                sizes = np.maximum(catalogue.size[rows] * shrink, 0.5)
+                colors = Color.hex_to_rgb(Color.BLACK) if self.option == 3 else catalogue.rgb[rows]
+                raster.circles(x, y, sizes, colors)
+                raster.resolve()
+            return raster
+    
+    def crossing(self, A: np.ndarray, B: np.ndarray, zoom: int, tx: int, ty: int):
+        '''
+        Tile pixels of the lines from A to B, joined the short way round
+        the seam, and the mask of those whose box meets the tile.
+        '''
+        margin = self.margin(zoom)
+        xA, yA = self.pixels(A, zoom, tx, ty)
+        xB, yB = self.pixels(B, zoom, tx, ty)
+        width = self.count(zoom)[0] * self.size
+        yB = yA + (yB - yA + width // 2) % width - width // 2
+        chosen = ((np.minimum(xA, xB) < self.size + margin) & (np.maximum(xA, xB) >= -margin) &
+                  (np.minimum(yA, yB) < self.size + margin) & (np.maximum(yA, yB) >= -margin))
+        return xA, yA, xB, yB, chosen
+    
+    def revisions(self, zoom: int, tx: int, ty: int):
+        '''
+        Ids of the firmament updates that changed what a tile shows (see
+        Firmament.update).
+        '''
+        margin, found = self.margin(zoom), []
+        for change, stars, lines in self.firmament.changes:
+            x, y = self.pixels(stars, zoom, tx, ty)
+            hit = np.any((x >= -margin) & (x < self.size + margin) & (y >= -margin) & (y < self.size + margin))
+            if not hit and self.option == 4: hit = np.any(self.crossing(lines[:, 0], lines[:, 1], zoom, tx, ty)[4])
+            if hit: found.append(change)
+        return found
+    
+    def tile(self, zoom: int, tx: int, ty: int):
+        '''
+        PNG bytes of one tile, from the cache when possible. Tiles are
+        keyed by the firmament version and their size, so caches shared
+        by other Tiles or kept across catalogue changes never serve them
+        stale; tiles some firmament update reached are keyed by those
+        updates too.
+        '''
+        with self.firmament.pinned():
+            magnitude = self.magnitude(zoom)
+            key = (self.firmament.version, self.size, self.option, "all" if magnitude is None else magnitude, zoom, tx, ty)
+            revisions = self.revisions(zoom, tx, ty)
+            if revisions: key += (hashlib.sha256(" ".join(revisions).encode()).hexdigest()[:16],)
+            data = self.cache.get(key)
+            if data is not None: return data
+            raster = self.render(zoom, tx, ty)
+            with Instruments.stage("composition"):
+                pad = self.padding(zoom)
+                img = raster.image("P" if self.option == 3 else "RGB").crop((pad, pad, pad + self.size, pad + self.size))
+            with Instruments.stage("encode"):
+                stream = io.BytesIO()
+                img.save(stream, "PNG")
+            data = stream.getvalue()
+            self.cache.put(key, data)
+            return data
+    
+    def pyramid(self, levels: int):
+        '''
+        Lazily walks every tile of zooms 0 to levels - 1, coarsest first,
+        yielding (zoom, tx, ty, data).
+        '''
+        for zoom in range(levels):
+            across, down = self.count(zoom)
+            for ty in range(down):
+                for tx in range(across):
+                    yield zoom, tx, ty, self.tile(zoom, tx, ty)
@@ -0,0 +1,230 @@
+import argparse, asyncio, math
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlsplit
+from components import Firmament
+from measurements import Projection
+from utilities import Encoder, Shared
+
+@dataclass
+class Service:
+    '''
+    Asyncio HTTP render endpoint over one firmament loaded at start-up.
+
+        GET /render?option=0&reference=5[&magnitude=4.5][&count=500][&format=webp][&level=1][&projection=hammer]
+
+    answers with the bytes of Firmament.render in the given encoding,
+    PNG by default (see Encoder), never touching disk.
+    Renders run on a thread pool, or on a process pool attached to the
+    catalogue in shared memory with the firmament's photometry and cache
+    settings; the pool is attached anew once the firmament is updated
+    or repopulated, or its photometry or cache changes. Identical
+    requests in flight share one render, and distinct renders wait in a
+    bounded queue: once it is full new requests get 503 with Retry-After
+    instead of piling up.
+    '''
+    CHUNK = 65536
+    REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+    def __init__(self, firmament: Firmament, workers: int = 4, queue: int = 32, processes: bool = False):
+        self.firmament: Firmament = firmament
+        self.workers: int = workers
+        self.processes: bool = processes
+        self.queue: asyncio.Queue | None = None
+        self.limit: int = queue
+        self.pending: dict[tuple, asyncio.Future] = {}
+        self.rendered: int = 0
+        self.block = None
+        self.pool = None
+        self.attached: tuple | None = None
+        self.attaching: asyncio.Task | None = None
+        self.retiring: list[asyncio.Future] = []
+        self.server: asyncio.Server | None = None
+        self.tasks: list[asyncio.Task] = []
+        return None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080):
+        if self.processes: await self.attach()
+        else: self.pool = ThreadPoolExecutor(self.workers)
+        self.queue = asyncio.Queue(self.limit)
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for task in self.tasks: task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions = True)
+        if self.attaching is not None: await asyncio.gather(self.attaching, return_exceptions = True)
+        await asyncio.gather(*self.retiring)
+        if self.block is not None: Service.retire(self.pool, self.block)
+        else: self.pool.shutdown()
+        return None
+
+    async def attach(self):
+        '''
+        Process pool attached to the firmament as it stands: the catalogue
+        of its published snapshot in shared memory, its photometry and
+        the capacity and folder of its render cache. Packing runs on a
+        helper thread so the event loop keeps serving meanwhile.
+        '''
+        loop = asyncio.get_running_loop()
+        self.attached, self.block, self.pool = await loop.run_in_executor(None, self.prepare)
+        return None
+
+    def prepare(self):
+        f = self.firmament
+        photometry, cache = self.settings()
+        with f.pinned() as state:
+            block, layout = Shared.pack(f.arrays())
+        # Forking would copy the event loop and its helper threads mid-flight.
+        pool = ProcessPoolExecutor(self.workers, get_context("spawn"), Firmament.attach, (block.name, layout, photometry, cache))
+        return (state, (photometry, cache)), block, pool
+
+    def settings(self):
+        '''
+        Photometry of the firmament, and the capacity and folder of its
+        render cache (None without one), as process workers take them.
+        '''
+        f = self.firmament
+        return f.photometry, None if f.renders is None else (f.renders.capacity, f.renders.folder)
+
+    async def reattach(self):
+        '''
+        Attaches a new process pool when the firmament changed since the
+        last one; workers asking meanwhile wait for the same one, and the
+        old pool finishes its renders before its shared memory goes.
+        '''
+        state, settings = self.attached
+        if state is self.firmament.state and settings == self.settings(): return None
+        if self.attaching is None: self.attaching = asyncio.create_task(self.swap())
+        # A cancelled worker must not cancel the rebuild the others wait for.
+        await asyncio.shield(self.attaching)
+        return None
+
+    async def swap(self):
+        pool, block = self.pool, self.block
+        try: await self.attach()
+        finally: self.attaching = None
+        self.retiring = [retired for retired in self.retiring if not retired.done()]
+        self.retiring.append(asyncio.get_running_loop().run_in_executor(None, Service.retire, pool, block))
+        return None
+
+    @staticmethod
+    def retire(pool: ProcessPoolExecutor, block):
+        pool.shutdown()
+        block.close()
+        block.unlink()
+        return None
+
+    @staticmethod
+    def renderJob(job: tuple):
+        # Raw frames are memoryviews, which do not pickle.
+        return bytes(Firmament.worker[1].render(*job))
+
+    async def work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future = await self.queue.get()
+            try:
+                if self.processes:
+                    await self.reattach()
+                    data = await loop.run_in_executor(self.pool, Service.renderJob, job)
+                else: data = await loop.run_in_executor(self.pool, self.firmament.render, *job)
+                self.rendered += 1
+                future.set_result(data)
+            except Exception as error: future.set_exception(error)
+            finally:
+                self.pending.pop(job, None)
+                self.queue.task_done()
+
+    def job(self, query: str):
+        '''
+        Render parameters of a query string; ValueError when malformed,
+        KeyError when the view does not exist.
+        '''
+        values = {key: value[-1] for key, value in parse_qs(query).items()}
+        if "option" not in values or "reference" not in values: raise ValueError("option and reference are required.")
+        option, reference = int(values["option"]), int(values["reference"])
+        magnitude = float(values["magnitude"]) if "magnitude" in values else None
+        count = int(values["count"]) if "count" in values else None
+        if magnitude is not None and not (math.isfinite(magnitude) and magnitude >= 0): raise ValueError(f"Magnitude {magnitude} out of range.")
+        if count is not None and count < 1: raise ValueError(f"Count {count} out of range.")
+        format = values.get("format", "png")
+        level = Encoder.level(format, int(values["level"]) if "level" in values else None)
+        projection = Projection.kernel(values["projection"]).name if "projection" in values else None
+        if option not in (0, 2, 3, 4, 5): raise ValueError(f"Option {option} cannot be rendered.")
+        if option in (3, 4) and not 0 <= reference < len(Firmament.VIEWS): raise KeyError(reference)
+        if option in (0, 2, 5) and reference not in self.firmament.set: raise KeyError(reference)
+        return (option, reference, magnitude, count, format, level, projection)
+
+    def submit(self, job: tuple):
+        '''
+        Future of the render of job, shared with any identical request in flight.
+        '''
+        if job in self.pending: return self.pending[job]
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((job, future))
+        self.pending[job] = future
+        return future
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+            try:
+                method, target = request.split(" ", 2)[:2]
+                url = urlsplit(target)
+            except ValueError: method, url = None, None
+            if url is None: await self.respond(writer, 400, b"Malformed request line.\n")
+            elif not method == "GET": await self.respond(writer, 405, b"Only GET is served.\n")
+            elif not url.path == "/render": await self.respond(writer, 404, b"Unknown path.\n")
+            else:
+                try:
+                    job = self.job(url.query)
+                    future = self.submit(job)
+                except KeyError: await self.respond(writer, 404, b"Unknown view.\n")
+                except ValueError as error: await self.respond(writer, 400, f"{error}\n".encode())
+                except asyncio.QueueFull: await self.respond(writer, 503, b"Render queue full.\n", {"Retry-After": "1"})
+                else:
+                    try: data = await asyncio.shield(future)
+                    except Exception as error: await self.respond(writer, 500, f"{error}\n".encode())
+                    else: await self.respond(writer, 200, data, {"Content-Type": Encoder.typeOf(job[4])})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError): pass
+        finally:
+            writer.close()
+        return None
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, body: bytes, headers: dict[str, str] | None = None):
+        head = {"Content-Type": "text/plain", **(headers or {}), "Content-Length": str(len(body)), "Connection": "close"}
+        writer.write(f"HTTP/1.1 {status} {Service.REASONS[status]}\r\n".encode())
+        writer.write("".join(f"{key}: {value}\r\n" for key, value in head.items()).encode() + b"\r\n")
+        for start in range(0, len(body), Service.CHUNK):
+            writer.write(body[start:start + Service.CHUNK])
+            await writer.drain()
+        await writer.drain()
+        return None
+
+async def serve(host: str, port: int, workers: int, queue: int, processes: bool, cache: int):
+    f = Firmament.create()
+    if cache: f.useCache(cache)
+    service = Service(f, workers, queue, processes)
+    host, port = await service.start(host, port)
+    print(f"Serving renders on http://{host}:{port}/render")
+    try: await service.server.serve_forever()
+    finally: await service.stop()
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serves firmament renders over HTTP.")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--queue", type = int, default = 32)
+    parser.add_argument("--processes", action = "store_true", help = "render on a process pool instead of threads")
+    parser.add_argument("--cache", type = int, default = 64, help = "renders kept in memory, 0 to disable")
+    args = parser.parse_args()
+    try: asyncio.run(serve(args.host, args.port, args.workers, args.queue, args.processes, args.cache))
+    except KeyboardInterrupt: pass
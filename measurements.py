@@ -1,5 +1,7 @@
 from dataclasses import dataclass
 from math import sin, cos, asin, atan, pi as PI
+import copy, threading
+import numpy as np
 
 @dataclass
 class Matrix:
@@ -153,6 +155,820 @@ class Matrix:
         beta: float = -atan((x * y) / (x * x + z * z) / cos(alpha)) + (x < 0) * PI
         return Matrix.Vector(alpha, beta, gamma)
 
+@dataclass
+class Vec3:
+    '''
+    Fixed 3-vector, interchangeable with a Matrix column vector.
+    '''
+    __slots__ = ("x", "y", "z")
+    x: float
+    y: float
+    z: float
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+    
+    def __add__(self, other: 'Vec3'):
+        return Vec3(self.x + other.x, self.y + other.y, self.z + other.z)
+    
+    def __sub__(self, other: 'Vec3'):
+        return Vec3(self.x - other.x, self.y - other.y, self.z - other.z)
+    
+    def __mul__(self, k: float):
+        return Vec3(self.x * k, self.y * k, self.z * k)
+    
+    @property
+    def M(self):
+        return [[self.x], [self.y], [self.z]]
+    
+    @staticmethod
+    def of(v: 'Vec3 | Matrix | list | tuple | np.ndarray'):
+        if isinstance(v, Vec3): return v
+        if isinstance(v, Matrix): return Vec3(*Matrix.UnpackVector(v))
+        return Vec3(*map(float, np.ravel(v)))
+    
+    def toMatrix(self):
+        return Matrix.Vector(self.x, self.y, self.z)
+    
+    def dot(self, other: 'Vec3'):
+        return self.x * other.x + self.y * other.y + self.z * other.z
+    
+    def cross(self, other: 'Vec3'):
+        return Vec3(self.y * other.z - self.z * other.y,
+                    self.z * other.x - self.x * other.z,
+                    self.x * other.y - self.y * other.x)
+    
+    def norm(self):
+        return (self.x * self.x + self.y * self.y + self.z * self.z) ** 0.5
+    
+    def normalize(self):
+        rho = self.norm()
+        return Vec3(self.x / rho, self.y / rho, self.z / rho)
+    
+    def toPolar(self):
+        '''
+        (rho, theta, phi), as Matrix.toPolar.
+        '''
+        x, y, z = self.x, self.y, self.z
+        rho = (x * x + y * y + z * z) ** 0.5
+        theta = atan(y / x) + (x > 0 and y < 0) * 2 * PI + (x <= 0) * PI
+        return Vec3(rho, theta, asin(z / rho))
+    
+    def toCartesian(self):
+        rho, theta, phi = self.x, self.y, self.z
+        return Vec3(rho * cos(theta) * cos(phi), rho * sin(theta) * cos(phi), rho * sin(phi))
+    
+    @staticmethod
+    def toPolarMany(xyz: np.ndarray):
+        '''
+        (N, 3) cartesian rows to (N, 3) rows of (rho, theta, phi).
+        '''
+        theta, phi = Projection.toPolar(xyz)
+        return np.stack([np.linalg.norm(xyz, axis = 1), theta, phi], axis = 1)
+    
+    @staticmethod
+    def toCartesianMany(polar: np.ndarray):
+        rho, theta, phi = polar[:, 0], polar[:, 1], polar[:, 2]
+        return np.stack([rho * np.cos(theta) * np.cos(phi), rho * np.sin(theta) * np.cos(phi), rho * np.sin(phi)], axis = 1)
+
+@dataclass
+class Mat3:
+    '''
+    Fixed 3x3 matrix with closed-form products, interchangeable with Matrix:
+    M gives the nested list form, and products keep Matrix.__mul__\'s
+    summation order so results match it bit for bit.
+    '''
+    __slots__ = ("m00", "m01", "m02", "m10", "m11", "m12", "m20", "m21", "m22")
+    m00: float
+    m01: float
+    m02: float
+    m10: float
+    m11: float
+    m12: float
+    m20: float
+    m21: float
+    m22: float
+
+    def __iter__(self):
+        return iter((self.m00, self.m01, self.m02, self.m10, self.m11, self.m12, self.m20, self.m21, self.m22))
+    
+    def __mul__(self, other: 'Mat3 | Vec3 | Matrix'):
+        a00, a01, a02, a10, a11, a12, a20, a21, a22 = self
+        if isinstance(other, Vec3) or (isinstance(other, Matrix) and len(other.M[0]) == 1):
+            x, y, z = Vec3.of(other)
+            v = Vec3(a00 * x + a01 * y + a02 * z, a10 * x + a11 * y + a12 * z, a20 * x + a21 * y + a22 * z)
+            return v if isinstance(other, Vec3) else v.toMatrix()
+        b00, b01, b02, b10, b11, b12, b20, b21, b22 = Mat3.of(other)
+        m = Mat3(a00 * b00 + a01 * b10 + a02 * b20, a00 * b01 + a01 * b11 + a02 * b21, a00 * b02 + a01 * b12 + a02 * b22,
+                 a10 * b00 + a11 * b10 + a12 * b20, a10 * b01 + a11 * b11 + a12 * b21, a10 * b02 + a11 * b12 + a12 * b22,
+                 a20 * b00 + a21 * b10 + a22 * b20, a20 * b01 + a21 * b11 + a22 * b21, a20 * b02 + a21 * b12 + a22 * b22)
+        return m if isinstance(other, Mat3) else m.toMatrix()
+    
+    @property
+    def M(self):
+        return [[self.m00, self.m01, self.m02], [self.m10, self.m11, self.m12], [self.m20, self.m21, self.m22]]
+    
+    @staticmethod
+    def of(m: 'Mat3 | Matrix | list | np.ndarray'):
+        if isinstance(m, Mat3): return m
+        if isinstance(m, Matrix): m = m.M
+        return Mat3(*map(float, np.ravel(m)))
+    
+    @staticmethod
+    def identity():
+        return Mat3(1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+    
+    def toMatrix(self):
+        return Matrix(self.M)
+    
+    def transpose(self):
+        return Mat3(self.m00, self.m10, self.m20, self.m01, self.m11, self.m21, self.m02, self.m12, self.m22)
+    
+    def determinant(self):
+        a, b, c, d, e, f, g, h, i = self
+        return a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+    
+    def invert(self, orthonormal: bool = False):
+        '''
+        Adjugate over determinant; rotations pass orthonormal = True
+        and get their transpose.
+        '''
+        if orthonormal: return self.transpose()
+        a, b, c, d, e, f, g, h, i = self
+        det = self.determinant()
+        return Mat3((e * i - f * h) / det, (c * h - b * i) / det, (b * f - c * e) / det,
+                    (f * g - d * i) / det, (a * i - c * g) / det, (c * d - a * f) / det,
+                    (d * h - e * g) / det, (b * g - a * h) / det, (a * e - b * d) / det)
+    
+    @staticmethod
+    def rMatrix(v: 'Vec3 | Matrix'):
+        '''
+        Closed form of Matrix.rMatrix.
+        '''
+        alpha, beta, gamma = Vec3.of(v)
+        ca, sa, cb, sb, cg, sg = cos(alpha), sin(alpha), cos(beta), sin(beta), cos(gamma), sin(gamma)
+        return Mat3(ca * cb, -sb, sa * cb,
+                    ca * sb * cg + sa * sg, cb * cg, sa * sb * cg - ca * sg,
+                    ca * sb * sg - sa * cg, cb * sg, sa * sb * sg + ca * cg)
+    
+    @staticmethod
+    def rFactors(v: 'Vec3 | Matrix', gamma: float = -(PI / 2)):
+        x, y, z = Vec3.of(v)
+        alpha = atan(z / x)
+        beta = -atan((x * y) / (x * x + z * z) / cos(alpha)) + (x < 0) * PI
+        return Vec3(alpha, beta, gamma)
+    
+    @staticmethod
+    def applyMany(R: 'Mat3 | Matrix | np.ndarray', xyz: np.ndarray):
+        '''
+        Rotates (N, 3) rows by one matrix, or by (N, 3, 3) matrices row by row.
+        '''
+        R = Projection.asArray(R)
+        if R.ndim == 2: return Projection.rotate(xyz, R)
+        return np.einsum("nij,nj->ni", R, xyz)
+    
+    @staticmethod
+    def rMatrices(angles: np.ndarray):
+        '''
+        (N, 3) rows of (alpha, beta, gamma) to (N, 3, 3) rotation matrices.
+        '''
+        ca, cb, cg = np.cos(angles).T
+        sa, sb, sg = np.sin(angles).T
+        return np.stack([ca * cb, -sb, sa * cb,
+                         ca * sb * cg + sa * sg, cb * cg, sa * sb * cg - ca * sg,
+                         ca * sb * sg - sa * cg, cb * sg, sa * sb * sg + ca * cg], axis = 1).reshape(-1, 3, 3)
+    
+    @staticmethod
+    def rFactorsMany(xyz: np.ndarray, gamma: float = -(PI / 2)):
+        x, y, z = xyz.T
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            alpha = np.arctan(z / x)
+            beta = -np.arctan((x * y) / (x * x + z * z) / np.cos(alpha)) + (x < 0) * PI
+        return np.stack([alpha, beta, np.full_like(alpha, gamma)], axis = 1)
+
+@dataclass
+class Quat:
+    __slots__ = ("w", "x", "y", "z")
+    w: float
+    x: float
+    y: float
+    z: float
+
+    def __iter__(self):
+        return iter((self.w, self.x, self.y, self.z))
+    
+    def __mul__(self, other: 'Quat'):
+        w1, x1, y1, z1 = self
+        w2, x2, y2, z2 = other
+        return Quat(w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                    w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                    w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                    w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2)
+    
+    def conjugate(self):
+        return Quat(self.w, -self.x, -self.y, -self.z)
+    
+    def rotate(self, v: 'Vec3'):
+        q = self * Quat(0.0, v.x, v.y, v.z) * self.conjugate()
+        return Vec3(q.x, q.y, q.z)
+    
+    @staticmethod
+    def fromMatrix(m: 'Mat3 | Matrix | list | np.ndarray'):
+        '''
+        Quaternion of a proper rotation matrix (Shepperd's method).
+        '''
+        (m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = Projection.asArray(m).tolist()
+        trace = m00 + m11 + m22
+        if trace > 0:
+            s = (trace + 1) ** 0.5 * 2
+            q = Quat(s / 4, (m21 - m12) / s, (m02 - m20) / s, (m10 - m01) / s)
+        elif m00 > m11 and m00 > m22:
+            s = (1 + m00 - m11 - m22) ** 0.5 * 2
+            q = Quat((m21 - m12) / s, s / 4, (m01 + m10) / s, (m02 + m20) / s)
+        elif m11 > m22:
+            s = (1 + m11 - m00 - m22) ** 0.5 * 2
+            q = Quat((m02 - m20) / s, (m01 + m10) / s, s / 4, (m12 + m21) / s)
+        else:
+            s = (1 + m22 - m00 - m11) ** 0.5 * 2
+            q = Quat((m10 - m01) / s, (m02 + m20) / s, (m12 + m21) / s, s / 4)
+        return Quat.normalize(q)
+    
+    @staticmethod
+    def normalize(q: 'Quat'):
+        norm = (q.w * q.w + q.x * q.x + q.y * q.y + q.z * q.z) ** 0.5
+        return Quat(q.w / norm, q.x / norm, q.y / norm, q.z / norm)
+    
+    @staticmethod
+    def toMatrices(q: np.ndarray):
+        '''
+        Rotation matrices of an (N, 4) array of unit quaternions, as (N, 3, 3).
+        '''
+        w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+        return np.stack([np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis = -1),
+                         np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis = -1),
+                         np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis = -1)], axis = 1)
+    
+    def toMat3(self):
+        return Mat3.of(Quat.toMatrices(np.array([list(self)]))[0])
+    
+    def toMatrix(self):
+        return self.toMat3().toMatrix()
+    
+    @staticmethod
+    def slerp(a: 'Quat', b: 'Quat', t: 'float | np.ndarray'):
+        '''
+        Spherical interpolation along the shorter arc, as an (N, 4) array
+        with one quaternion per value of t.
+        '''
+        t = np.atleast_1d(np.asarray(t, dtype = np.float64))[:, None]
+        qa, qb = np.array(list(a)), np.array(list(b))
+        dot = float(qa @ qb)
+        if dot < 0: qb, dot = -qb, -dot
+        if dot > 0.9995:
+            q = qa + t * (qb - qa)
+        else:
+            angle = np.arccos(dot)
+            q = (np.sin((1 - t) * angle) * qa + np.sin(t * angle) * qb) / np.sin(angle)
+        return q / np.linalg.norm(q, axis = 1, keepdims = True)
+
+@dataclass
+class Ephemeris:
+    '''
+    Observer frames for whole arrays of times at once. Catalogue positions
+    are J2000 equatorial unit vectors; frames() stacks, for every time,
+    the matrix taking them to the horizon frame (south, east, zenith) of
+    an observer: IAU 1976 precession to the equator of date, Earth
+    rotation by the local sidereal time, then the tilt to the latitude.
+    Angles are radians, longitudes positive east, times UTC datetime64
+    values or Julian dates (UT1 is taken as UTC).
+    '''
+    J2000: float = 2451545.0
+    UNIX: float = 2440587.5
+    ARCSECOND: float = PI / 648000
+
+    @staticmethod
+    def julian(times: np.ndarray):
+        times = np.atleast_1d(np.asarray(times))
+        if times.dtype.kind not in "MOU": return times.astype(np.float64)
+        days = (times.astype("datetime64[us]") - np.datetime64(0, "us")) / np.timedelta64(86400000000, "us")
+        return days + Ephemeris.UNIX
+    
+    @staticmethod
+    def rotations(angles: np.ndarray, axis: int):
+        '''
+        (T, 3, 3) frame rotations by angles about the given axis (0, 1 or 2).
+        '''
+        angles = np.atleast_1d(np.asarray(angles, dtype = np.float64))
+        c, s = np.cos(angles), np.sin(angles)
+        i, j = (axis + 1) % 3, (axis + 2) % 3
+        out = np.zeros((len(angles), 3, 3))
+        out[:, axis, axis] = 1.0
+        out[:, i, i], out[:, i, j], out[:, j, i], out[:, j, j] = c, s, -s, c
+        return out
+    
+    @staticmethod
+    def precession(jd: np.ndarray):
+        T = (np.atleast_1d(np.asarray(jd, dtype = np.float64)) - Ephemeris.J2000) / 36525
+        zeta = (2306.2181 * T + 0.30188 * T ** 2 + 0.017998 * T ** 3) * Ephemeris.ARCSECOND
+        z = (2306.2181 * T + 1.09468 * T ** 2 + 0.018203 * T ** 3) * Ephemeris.ARCSECOND
+        theta = (2004.3109 * T - 0.42665 * T ** 2 - 0.041833 * T ** 3) * Ephemeris.ARCSECOND
+        return Ephemeris.rotations(-z, 2) @ Ephemeris.rotations(theta, 1) @ Ephemeris.rotations(-zeta, 2)
+    
+    @staticmethod
+    def sidereal(jd: np.ndarray):
+        '''
+        Greenwich mean sidereal time, in radians.
+        '''
+        d = np.atleast_1d(np.asarray(jd, dtype = np.float64)) - Ephemeris.J2000
+        T = d / 36525
+        degrees = 280.46061837 + 360.98564736629 * d + 0.000387933 * T ** 2 - T ** 3 / 38710000
+        return np.radians(degrees % 360)
+    
+    @staticmethod
+    def horizon(latitude: float):
+        return np.array([[sin(latitude), 0.0, -cos(latitude)],
+                         [0.0, 1.0, 0.0],
+                         [cos(latitude), 0.0, sin(latitude)]])
+    
+    @staticmethod
+    def frames(times: np.ndarray, latitude: float, longitude: float):
+        jd = Ephemeris.julian(times)
+        rotation = Ephemeris.rotations(Ephemeris.sidereal(jd) + longitude, 2)
+        return Ephemeris.horizon(latitude) @ rotation @ Ephemeris.precession(jd)
+    
+    @staticmethod
+    def view(azimuth: float, altitude: float):
+        '''
+        View matrix, in the horizon frame, of a camera looking towards
+        azimuth (from north through east) and altitude with the zenith up.
+        '''
+        forward = np.array([-cos(azimuth) * cos(altitude), sin(azimuth) * cos(altitude), sin(altitude)])
+        up = np.array([cos(azimuth) * sin(altitude), -sin(azimuth) * sin(altitude), cos(altitude)])
+        return np.stack([forward, up, np.cross(forward, up)])
+    
+    @staticmethod
+    def altitudes(xyz: np.ndarray, frames: np.ndarray):
+        '''
+        (T, N) altitudes of the (N, 3) positions in each of the T frames.
+        '''
+        return np.arcsin(np.clip(frames[:, 2] @ xyz.T, -1, 1))
+
+@dataclass
+class Projection:
+    '''
+    Batch counterpart of Star.rotate / Star.position:
+    rotates an (N, 3) coordinate block by a 3x3 view matrix
+    and maps it to canvas pixels in one array operation.
+    Other mappings are registered by name as Kernels.
+    '''
+    WIDTH: int = 1572
+    HEIGHT: int = 1572
+    SCALE: int = 1000
+    KERNELS = {}
+
+    @staticmethod
+    def register(kernel: 'Kernel'):
+        Projection.KERNELS[kernel.name] = kernel
+        return kernel
+    
+    @staticmethod
+    def kernel(name: str):
+        if name not in Projection.KERNELS: raise ValueError(f"Unknown projection {name!r}.")
+        return Projection.KERNELS[name]
+
+    @staticmethod
+    def asArray(R: 'Mat3 | Matrix | list | np.ndarray'):
+        if isinstance(R, (Matrix, Mat3)): R = R.M
+        return np.asarray(R, dtype = np.float64)
+
+    @staticmethod
+    def rotate(xyz: np.ndarray, R: 'Matrix | list | np.ndarray'):
+        # Same summation order as Matrix.__mul__, so results match bit for bit.
+        R = Projection.asArray(R)
+        x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+        out = np.empty((len(xyz), 3), dtype = np.float64)
+        for row in range(3):
+            out[:, row] = R[row, 0] * x + R[row, 1] * y + R[row, 2] * z
+        return out
+    
+    @staticmethod
+    def toPolar(xyz: np.ndarray):
+        x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+        rho = np.sqrt(x * x + y * y + z * z)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            theta = np.arctan(y / x) + ((x > 0) & (y < 0)) * 2 * PI + (x <= 0) * PI
+            phi = np.arcsin(z / rho)
+        return theta, phi
+    
+    @staticmethod
+    def toPixels(theta: np.ndarray, phi: np.ndarray, width: int = 0, height: int = 0, scale: float = 0, rounded: bool = True):
+        '''
+        Canvas pixels of polar angles, -1 where off the canvas. Unrounded,
+        they are the exact float positions of the same visible points.
+        '''
+        width, height, scale = width or Projection.WIDTH, height or Projection.HEIGHT, scale or Projection.SCALE
+        u, v = ((theta + PI / 4) % (2 * PI)) * scale, (((phi + 3 * PI / 4) % PI) - PI / 2) * scale
+        posX = width - 1 - np.rint(u)
+        posY = np.rint(v)
+        visible = (0 <= posX) & (posX < width) & (0 <= posY) & (posY < height)
+        if not rounded: return np.where(visible, width - 1 - u, -1.0), np.where(visible, v, -1.0), visible
+        posX = np.where(visible, posX, -1).astype(np.int64)
+        posY = np.where(visible, posY, -1).astype(np.int64)
+        return posX, posY, visible
+    
+    @staticmethod
+    def project(xyz: np.ndarray, R: 'Matrix | list | np.ndarray', rounded: bool = True):
+        return Projection.toPixels(*Projection.toPolar(Projection.rotate(xyz, R)), rounded = rounded)
+    
+    @staticmethod
+    def fromPixels(x: np.ndarray, y: np.ndarray, width: int = 0, height: int = 0, scale: float = 0):
+        '''
+        Inverse of toPixels: polar angles at the centre of each pixel,
+        or of the part of it the projection reaches.
+        '''
+        width, scale = width or Projection.WIDTH, scale or Projection.SCALE
+        theta = (width - 1 - np.asarray(x, dtype = np.float64)) / scale - PI / 4
+        u = np.asarray(y, dtype = np.float64) / scale + PI / 2
+        # toPixels folds phi + 3 PI / 4 into [0, PI), so the pixel holding PI is cut short there.
+        u = np.where(u + 0.5 / scale > PI, (u - 0.5 / scale + PI) / 2, u)
+        phi = np.where(u >= PI / 4, u - 3 * PI / 4, u + PI / 4)
+        return theta, phi
+    
+    @staticmethod
+    def toCartesian(theta: np.ndarray, phi: np.ndarray):
+        return np.stack([np.cos(theta) * np.cos(phi), np.sin(theta) * np.cos(phi), np.sin(phi)], axis = -1)
+    
+    @staticmethod
+    def unproject(x: np.ndarray, y: np.ndarray, R: 'Matrix | list | np.ndarray'):
+        '''
+        Inverse of project: (N, 3) unit sky directions under pixels x, y
+        seen through R.
+        '''
+        view = Projection.toCartesian(*Projection.fromPixels(np.ravel(x), np.ravel(y)))
+        return Projection.rotate(view, np.linalg.inv(Projection.asArray(R)))
+
+@dataclass
+class Kernel:
+    '''
+    Named projection of view directions, x forward, y up and z right,
+    onto a map and back. forward takes (N, 3) unit vectors to map
+    coordinates a (right) and b (up) and the mask of those it shows;
+    inverse takes map coordinates back to unit vectors and the mask of
+    those on the map. extent is the half width and half height of the
+    map, reach the largest angle from the view axis it shows. Maps are
+    drawn Projection.HEIGHT pixels tall and as wide as their aspect.
+    '''
+    def __init__(self, name: str, forward, inverse, extent: tuple[float, float], reach: float):
+        self.name: str = name
+        self.forward = forward
+        self.inverse = inverse
+        self.extent: tuple[float, float] = extent
+        self.reach: float = reach
+        return None
+    
+    def shape(self, rows: int = 0):
+        rows = rows or Projection.HEIGHT
+        return rows, int(round(rows * self.extent[0] / self.extent[1]))
+    
+    def toPixels(self, xyz: np.ndarray, rows: int = 0, rounded: bool = True):
+        rows, columns = self.shape(rows)
+        scale = (rows - 1) / (2 * self.extent[1])
+        a, b, valid = self.forward(xyz)
+        with np.errstate(invalid = "ignore"):
+            u, v = (rows - 1) / 2 - b * scale, (columns - 1) / 2 + a * scale
+            posX, posY = np.rint(u), np.rint(v)
+            visible = valid & (0 <= posX) & (posX < rows) & (0 <= posY) & (posY < columns)
+        if not rounded: return np.where(visible, u, -1.0), np.where(visible, v, -1.0), visible
+        posX = np.where(visible, posX, -1).astype(np.int64)
+        posY = np.where(visible, posY, -1).astype(np.int64)
+        return posX, posY, visible
+    
+    def fromPixels(self, x: np.ndarray, y: np.ndarray, rows: int = 0):
+        rows, columns = self.shape(rows)
+        scale = (rows - 1) / (2 * self.extent[1])
+        a = (np.asarray(y, dtype = np.float64) - (columns - 1) / 2) / scale
+        b = ((rows - 1) / 2 - np.asarray(x, dtype = np.float64)) / scale
+        return self.inverse(a, b)
+    
+    def project(self, xyz: np.ndarray, R: 'Matrix | list | np.ndarray', rows: int = 0, rounded: bool = True):
+        return self.toPixels(Projection.rotate(xyz, R), rows, rounded)
+    
+    def unproject(self, x: np.ndarray, y: np.ndarray, R: 'Matrix | list | np.ndarray', rows: int = 0):
+        view, valid = self.fromPixels(np.ravel(x), np.ravel(y), rows)
+        return Projection.rotate(view, np.linalg.inv(Projection.asArray(R))), valid
+    
+    def torn(self, A: np.ndarray, B: np.ndarray):
+        '''
+        Mask of the view-frame segments A to B whose arc crosses the seam
+        behind a full-sky map, where their ends land on opposite sides.
+        '''
+        if self.reach < PI: return np.zeros(len(A), dtype = bool)
+        zA, zB = A[:, 2], B[:, 2]
+        # The arc meets z = 0 between opposite signs, at sign(zA) * (zA * B - zB * A).
+        return (zA * zB < 0) & (np.sign(zA) * (zA * B[:, 0] - zB * A[:, 0]) < 0)
+    
+    @staticmethod
+    def compose(a: np.ndarray, b: np.ndarray, forward: np.ndarray):
+        # View vectors from their right (a), up (b) and forward components.
+        return np.stack([forward, b, a], axis = -1)
+    
+    @staticmethod
+    def stereographic(xyz: np.ndarray):
+        x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+        with np.errstate(divide = "ignore", invalid = "ignore"): k = 2 / (1 + x)
+        return k * z, k * y, x > -1
+    
+    @staticmethod
+    def stereographicInverse(a: np.ndarray, b: np.ndarray):
+        rho = a * a + b * b
+        s = 4 / (4 + rho)
+        return Kernel.compose(s * a, s * b, (4 - rho) / (4 + rho)), np.ones(len(a), dtype = bool)
+    
+    @staticmethod
+    def gnomonic(xyz: np.ndarray):
+        x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+        with np.errstate(divide = "ignore", invalid = "ignore"): return z / x, y / x, x > 0
+    
+    @staticmethod
+    def gnomonicInverse(a: np.ndarray, b: np.ndarray):
+        n = np.sqrt(1 + a * a + b * b)
+        return Kernel.compose(a / n, b / n, 1 / n), np.ones(len(a), dtype = bool)
+    
+    @staticmethod
+    def orthographic(xyz: np.ndarray):
+        return xyz[:, 2], xyz[:, 1], xyz[:, 0] >= 0
+    
+    @staticmethod
+    def orthographicInverse(a: np.ndarray, b: np.ndarray):
+        rho = a * a + b * b
+        return Kernel.compose(a, b, np.sqrt(np.maximum(1 - rho, 0))), rho <= 1
+    
+    @staticmethod
+    def equirectangular(xyz: np.ndarray):
+        return np.arctan2(xyz[:, 2], xyz[:, 0]), np.arcsin(np.clip(xyz[:, 1], -1, 1)), np.ones(len(xyz), dtype = bool)
+    
+    @staticmethod
+    def equirectangularInverse(a: np.ndarray, b: np.ndarray):
+        valid = (np.abs(a) <= PI) & (np.abs(b) <= PI / 2)
+        return Kernel.compose(np.cos(b) * np.sin(a), np.sin(b), np.cos(b) * np.cos(a)), valid
+    
+    @staticmethod
+    def hammer(xyz: np.ndarray):
+        longitude, latitude = np.arctan2(xyz[:, 2], xyz[:, 0]), np.arcsin(np.clip(xyz[:, 1], -1, 1))
+        d = np.sqrt(1 + np.cos(latitude) * np.cos(longitude / 2))
+        return 2 * np.sqrt(2) * np.cos(latitude) * np.sin(longitude / 2) / d, np.sqrt(2) * np.sin(latitude) / d, np.ones(len(xyz), dtype = bool)
+    
+    @staticmethod
+    def hammerInverse(a: np.ndarray, b: np.ndarray):
+        valid = (a / 4) ** 2 + (b / 2) ** 2 <= 0.5
+        z = np.sqrt(np.maximum(1 - (a / 4) ** 2 - (b / 2) ** 2, 0))
+        longitude, latitude = 2 * np.arctan2(z * a, 2 * (2 * z * z - 1)), np.arcsin(np.clip(z * b, -1, 1))
+        return Kernel.compose(np.cos(latitude) * np.sin(longitude), np.sin(latitude), np.cos(latitude) * np.cos(longitude)), valid
+
+Projection.register(Kernel("stereographic", Kernel.stereographic, Kernel.stereographicInverse, (2.0, 2.0), 2 * np.arctan(np.sqrt(2))))
+Projection.register(Kernel("gnomonic", Kernel.gnomonic, Kernel.gnomonicInverse, (1.0, 1.0), np.arctan(np.sqrt(2))))
+Projection.register(Kernel("orthographic", Kernel.orthographic, Kernel.orthographicInverse, (1.0, 1.0), PI / 2))
+Projection.register(Kernel("hammer", Kernel.hammer, Kernel.hammerInverse, (2 * np.sqrt(2), np.sqrt(2)), PI))
+Projection.register(Kernel("equirectangular", Kernel.equirectangular, Kernel.equirectangularInverse, (PI, PI / 2), PI))
+
+@dataclass
+class SkyIndex:
+    '''
+    Spatial index over unit-sphere positions. The sphere is split
+    into the 6 x n x n cells of a gnomonic cube, and positions are
+    stored sorted by cell, so a query only reads the cells whose
+    bounding cap meets the query region.
+    '''
+    def __init__(self, xyz: np.ndarray, resolution: int = 0):
+        self.xyz: np.ndarray = xyz
+        if resolution < 1: resolution = int(np.clip(np.sqrt(len(xyz) / 96), 1, 256))
+        self.resolution: int = resolution
+        cells = SkyIndex.cellOf(xyz, resolution)
+        self.order: np.ndarray = np.argsort(cells, kind = "stable")
+        self.offsets: np.ndarray = np.searchsorted(cells[self.order], np.arange(6 * resolution ** 2 + 1))
+        self.centers, self.radii = SkyIndex.cellCaps(resolution)
+        return None
+    
+    @staticmethod
+    def faces(xyz: np.ndarray):
+        axis = np.argmax(np.abs(xyz), axis = 1)
+        major = xyz[np.arange(len(xyz)), axis]
+        face = axis * 2 + (major < 0)
+        u = xyz[np.arange(len(xyz)), (axis + 1) % 3] / np.abs(major)
+        v = xyz[np.arange(len(xyz)), (axis + 2) % 3] / np.abs(major)
+        return face, u, v
+    
+    @staticmethod
+    def cellOf(xyz: np.ndarray, resolution: int):
+        if not len(xyz): return np.zeros(0, dtype = np.int64)
+        face, u, v = SkyIndex.faces(xyz)
+        iu = np.clip(np.floor((u + 1) / 2 * resolution), 0, resolution - 1).astype(np.int64)
+        iv = np.clip(np.floor((v + 1) / 2 * resolution), 0, resolution - 1).astype(np.int64)
+        return (face * resolution + iu) * resolution + iv
+    
+    @staticmethod
+    def cellCaps(resolution: int):
+        # Direction of the cell centre and angular radius to its farthest corner.
+        edges = np.linspace(-1, 1, resolution + 1)
+        face, iu, iv = np.meshgrid(np.arange(6), np.arange(resolution), np.arange(resolution), indexing = "ij")
+        face, iu, iv = face.reshape(-1), iu.reshape(-1), iv.reshape(-1)
+        def directions(u: np.ndarray, v: np.ndarray):
+            axis = face // 2
+            xyz = np.zeros((len(face), 3))
+            xyz[np.arange(len(face)), axis] = np.where(face % 2, -1.0, 1.0)
+            xyz[np.arange(len(face)), (axis + 1) % 3] = u
+            xyz[np.arange(len(face)), (axis + 2) % 3] = v
+            return xyz / np.linalg.norm(xyz, axis = 1, keepdims = True)
+        centers = directions((edges[iu] + edges[iu + 1]) / 2, (edges[iv] + edges[iv + 1]) / 2)
+        radii = np.zeros(len(face))
+        for du, dv in ((0, 0), (0, 1), (1, 0), (1, 1)):
+            corner = directions(edges[iu + du], edges[iv + dv])
+            radii = np.maximum(radii, np.arccos(np.clip(np.sum(centers * corner, axis = 1), -1, 1)))
+        return centers, radii
+    
+    def patched(self, xyz: np.ndarray, remap: np.ndarray, added: np.ndarray):
+        '''
+        Index of the updated positions xyz without a rebuild: remap is
+        the new row of every indexed one, -1 once it is gone or moved,
+        and added the rows to index anew. Kept rows must keep their
+        relative order, so the result equals a fresh index of xyz at the
+        same resolution. The cell caps are shared.
+        '''
+        index = copy.copy(self)
+        cells = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        rows = remap[self.order]
+        keep = rows >= 0
+        rows, cells = rows[keep], cells[keep]
+        added = np.sort(np.asarray(added, dtype = np.int64))
+        where = SkyIndex.cellOf(xyz[added], self.resolution)
+        new = np.argsort(where, kind = "stable")
+        # Cell-major keys put every added row at its place in its cell.
+        at = np.searchsorted(cells * len(xyz) + rows, where[new] * len(xyz) + added[new])
+        index.xyz = xyz
+        index.order = np.insert(rows, at, added[new])
+        index.offsets = np.searchsorted(np.insert(cells, at, where[new]), np.arange(len(self.offsets)))
+        return index
+    
+    def candidates(self, direction: np.ndarray, radius: float):
+        '''
+        Rows of every cell whose cap intersects the cone, in row order.
+        '''
+        direction = np.asarray(direction, dtype = np.float64)
+        direction = direction / np.linalg.norm(direction)
+        reach = np.minimum(radius + self.radii, PI)
+        return self.cells(np.flatnonzero(self.centers @ direction >= np.cos(reach)))
+    
+    def cells(self, cells: np.ndarray):
+        starts, ends = self.offsets[cells], self.offsets[cells + 1]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.sort(self.order[np.arange(total) + shift])
+    
+    def nearest(self, directions: np.ndarray, radius: float, keep: np.ndarray | None = None):
+        '''
+        Row of the position closest to each of the (M, 3) directions and
+        its angular distance, or -1 and inf when none lies within radius.
+        keep masks the positions allowed to match. Queries are answered
+        together per cell: every query in a cell shares its candidates.
+        '''
+        directions = np.asarray(directions, dtype = np.float64).reshape(-1, 3)
+        directions = directions / np.linalg.norm(directions, axis = 1, keepdims = True)
+        rows = np.full(len(directions), -1, dtype = np.int64)
+        best = np.full(len(directions), np.inf)
+        if not len(self.xyz) or not len(directions): return rows, best
+        cells = SkyIndex.cellOf(directions, self.resolution)
+        for cell in np.unique(cells).tolist():
+            queries = np.flatnonzero(cells == cell)
+            # Any query of the cell lies within its radius of the cell centre.
+            reach = np.minimum(radius + self.radii + self.radii[cell], PI)
+            candidates = self.cells(np.flatnonzero(self.centers @ self.centers[cell] >= np.cos(reach)))
+            if keep is not None: candidates = candidates[keep[candidates]]
+            if not len(candidates): continue
+            # Squared chords keep their precision at small angles, where cosines lose it.
+            chords = np.square(directions[queries, None, :] - self.xyz[candidates][None, :, :]).sum(axis = 2)
+            closest = np.argmin(chords, axis = 1)
+            rows[queries], best[queries] = candidates[closest], chords[np.arange(len(queries)), closest]
+        found = best <= (2 * sin(min(radius, PI) / 2)) ** 2
+        rows[~found] = -1
+        return rows, np.where(found, 2 * np.arcsin(np.minimum(np.sqrt(best) / 2, 1)), np.inf)
+    
+    def cone(self, direction: np.ndarray, radius: float):
+        direction = np.asarray(direction, dtype = np.float64)
+        direction = direction / np.linalg.norm(direction)
+        rows = self.candidates(direction, radius)
+        return rows[self.xyz[rows] @ direction >= np.cos(min(radius, PI))]
+    
+    def box(self, R: 'Matrix | list | np.ndarray', theta: tuple[float, float], phi: tuple[float, float]):
+        '''
+        Rows whose polar angles after rotation by R lie within
+        theta[0] <= theta < theta[1] (wrapping) and phi[0] <= phi < phi[1].
+        '''
+        R = Projection.asArray(R)
+        width = (theta[1] - theta[0]) % (2 * PI) or 2 * PI
+        middle = theta[0] + width / 2
+        samples = np.linspace(0, 1, 33)
+        boundary = [(theta[0] + width * samples, np.full(33, phi[0])),
+                    (theta[0] + width * samples, np.full(33, phi[1])),
+                    (np.full(33, theta[0]), phi[0] + (phi[1] - phi[0]) * samples),
+                    (np.full(33, theta[1]), phi[0] + (phi[1] - phi[0]) * samples)]
+        toCartesian = lambda t, p: np.stack([np.cos(t) * np.cos(p), np.sin(t) * np.cos(p), np.sin(p)], axis = -1)
+        center = toCartesian(np.array([middle]), np.array([(phi[0] + phi[1]) / 2]))[0]
+        reach = max(np.arccos(np.clip(toCartesian(t, p) @ center, -1, 1)).max() for t, p in boundary)
+        spacing = max(width, phi[1] - phi[0]) / 32
+        # R maps the sky into the view, so R.T maps view directions back onto the sky.
+        rows = self.candidates(R.T @ center, reach + spacing) if reach + spacing < PI / 2 else np.arange(len(self.xyz))
+        t, p = Projection.toPolar(Projection.rotate(self.xyz[rows], R))
+        inside = ((t - theta[0]) % (2 * PI) < width) & (phi[0] <= p) & (p < phi[1])
+        return rows[inside]
+
+@dataclass
+class Levels:
+    '''
+    Level-of-detail buckets: rows split by magnitude at the given limits,
+    brightest bucket first, each with its own SkyIndex. Queries with a
+    limiting magnitude stop at the first bucket that is too faint, so the
+    faint tail is never read.
+    '''
+    def __init__(self, xyz: np.ndarray, magnitude: np.ndarray, limits: tuple[float, ...]):
+        self.xyz: np.ndarray = xyz
+        self.magnitude: np.ndarray = magnitude
+        self.limits: tuple[float, ...] = tuple(limits)
+        bucket = Levels.bucketOf(magnitude, self.limits)
+        order = np.argsort(bucket, kind = "stable")
+        offsets = np.searchsorted(bucket[order], np.arange(len(self.limits) + 2)).tolist()
+        self.rows: list[np.ndarray] = [order[start:end] for start, end in zip(offsets, offsets[1:])]
+        self.indexes: list[SkyIndex | None] = [None] * len(self.rows)
+        self.lock: threading.Lock = threading.Lock()
+        return None
+    
+    @staticmethod
+    def bucketOf(magnitude: np.ndarray, limits: tuple[float, ...]):
+        return np.searchsorted(np.asarray(limits, dtype = np.float64), magnitude, side = "right")
+    
+    def patched(self, xyz: np.ndarray, magnitude: np.ndarray, remap: np.ndarray, added: np.ndarray):
+        '''
+        Levels of the updated positions and magnitudes, as SkyIndex.patched:
+        each bucket merges its added rows and patches its index when built.
+        '''
+        levels = copy.copy(self)
+        levels.xyz, levels.magnitude, levels.lock = xyz, magnitude, threading.Lock()
+        added = np.sort(np.asarray(added, dtype = np.int64))
+        bucket = Levels.bucketOf(magnitude[added], self.limits)
+        levels.rows, levels.indexes = [], []
+        for b, (rows, index) in enumerate(zip(self.rows, self.indexes)):
+            moved = remap[rows]
+            kept, new = moved[moved >= 0], added[bucket == b]
+            at = np.searchsorted(kept, new)
+            merged = np.insert(kept, at, new)
+            levels.rows.append(merged)
+            if index is None: levels.indexes.append(None); continue
+            local = np.full(len(rows), -1, dtype = np.int64)
+            local[moved >= 0] = np.arange(len(kept)) + np.searchsorted(at, np.arange(len(kept)), side = "right")
+            levels.indexes.append(index.patched(xyz[merged], local, at + np.arange(len(new))))
+        return levels
+    
+    def index(self, bucket: int):
+        if self.indexes[bucket] is None:
+            with self.lock:
+                if self.indexes[bucket] is None: self.indexes[bucket] = SkyIndex(self.xyz[self.rows[bucket]])
+        return self.indexes[bucket]
+    
+    def buckets(self, magnitude: float | None = None):
+        '''
+        Buckets holding stars brighter than magnitude, brightest first.
+        '''
+        for bucket in range(len(self.rows)):
+            if magnitude is not None and bucket > 0 and self.limits[bucket - 1] >= magnitude: return None
+            yield bucket
+    
+    def select(self, bucket: int, rows: np.ndarray, magnitude: float | None = None):
+        if magnitude is None or (bucket < len(self.limits) and self.limits[bucket] <= magnitude): return rows
+        return rows[self.magnitude[rows] < magnitude]
+    
+    def candidates(self, bucket: int, direction: np.ndarray, radius: float, magnitude: float | None = None):
+        rows = self.rows[bucket][self.index(bucket).candidates(direction, radius)]
+        return self.select(bucket, rows, magnitude)
+    
+    def cone(self, direction: np.ndarray, radius: float, magnitude: float | None = None):
+        rows = [self.select(b, self.rows[b][self.index(b).cone(direction, radius)], magnitude) for b in self.buckets(magnitude)]
+        return np.sort(np.concatenate([np.zeros(0, dtype = np.int64), *rows]))
+    
+    def box(self, R: 'Matrix | list | np.ndarray', theta: tuple[float, float], phi: tuple[float, float], magnitude: float | None = None):
+        rows = [self.select(b, self.rows[b][self.index(b).box(R, theta, phi)], magnitude) for b in self.buckets(magnitude)]
+        return np.sort(np.concatenate([np.zeros(0, dtype = np.int64), *rows]))
+    
+    def nearest(self, directions: np.ndarray, radius: float, magnitude: float | None = None):
+        rows = np.full(len(np.reshape(directions, (-1, 3))), -1, dtype = np.int64)
+        distances = np.full(len(rows), np.inf)
+        for b in self.buckets(magnitude):
+            if not len(self.rows[b]): continue
+            keep = None if self.select(b, self.rows[b], magnitude) is self.rows[b] else self.magnitude[self.rows[b]] < magnitude
+            found, distance = self.index(b).nearest(directions, radius, keep)
+            closer = distance < distances
+            rows[closer], distances[closer] = self.rows[b][found[closer]], distance[closer]
+        return rows, distances
+
 @dataclass
 class Color:
     WHITE: str      = "FFFFFF"
@@ -179,12 +995,7 @@ class Color:
     @staticmethod
     def hex_to_rgb(hex: str):
         assert len(hex) == 6
-        HEX = "0123456789ABCDEF"
-        rgb = 0
-        for c in f"{hex[4:6]}{hex[2:4]}{hex[0:2]}":
-            rgb *= 16
-            rgb += HEX.find(c)
-        return rgb
+        return int(hex[0:2], 16) + int(hex[2:4], 16) * 256 + int(hex[4:6], 16) * 256 * 256
     
     @staticmethod
     def tuple_to_hex(r: int, g: int, b: int):
@@ -213,12 +1024,11 @@ class Color:
     @staticmethod
     def hex_to_tuple(hex: str):
         assert len(hex) == 6
-        HEX = "0123456789ABCDEF"
-        rgb = 0
-        for c in f"{hex[4:6]}{hex[2:4]}{hex[0:2]}":
-            rgb *= 16
-            rgb += HEX.find(c)
-        r = rgb % 256
-        g = (rgb // 256) % 256
-        b = ((rgb // 256) // 256) % 256
-        return (r, g, b)
+        return (int(hex[0:2], 16), int(hex[2:4], 16), int(hex[4:6], 16))
+    
+    @staticmethod
+    def rgb_to_array(rgb: np.ndarray):
+        '''
+        Unpacks an array of packed colours into an (N, 3) uint8 array.
+        '''
+        return np.ascontiguousarray(rgb, dtype = "<u4").view(np.uint8).reshape(-1, 4)[:, :3]
@@ -1,7 +1,14 @@
-import os, random, sys, unittest
+import io, json, os, random, sys, tempfile, threading, unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from math import pi as PI
+from PIL import Image
 root = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(root)
-from components import Star, Vector, Constellation, Firmament
+from benchmarks import Synthetic
+from components import Star, Vector, Constellation, Catalogue, Firmament, Tiles
+from measurements import Ephemeris, Matrix, Projection, SkyIndex
+from utilities import Instruments, Table
 
 
 class ComponentTests(unittest.TestCase):
@@ -16,5 +23,504 @@ class ComponentTests(unittest.TestCase):
         for direction in range(16):
             f.show(4, direction, f"Image {'0' if direction < 9 else ''}{direction + 1}.png")
         return None
+    
+    def testsIfBatchProjectionMatchesStarPositions(self):
+        f = Firmament.create()
+        views = [Matrix(R) for R in random.sample(Firmament.VIEWS, 3)] + [f.set[random.randrange(1, 89)].R]
+        for R in views:
+            (x, y, visible), _ = f.project(R)
+            for i, s in enumerate(f.stars):
+                s.rotate(R)
+                expected = s.position()
+                actual = (x[i], y[i]) if visible[i] else None
+                self.assertEqual(expected, actual, "Batch projection differs from Star.position.")
+        return None
+    
+    def testsIfVectorsShareTheirStarsPixels(self):
+        f = Firmament.create()
+        R = Matrix(random.choice(Firmament.VIEWS))
+        _, (xA, yA, xB, yB, visible) = f.project(R)
+        for n, v in enumerate(f.vectors):
+            expected = v.position(R)
+            actual = (xA[n], yA[n], xB[n], yB[n]) if visible[n] else None
+            self.assertEqual(expected, actual, "Vector endpoints differ from Vector.position.")
+        edges = f.edges.tolist()
+        edges[random.randrange(len(edges))][4] = 10 ** 6
+        with self.assertRaises(ValueError): f.populateVectors(edges)
+        self.assertEqual(len(f.vectors), len(edges), "Rejected vectors replaced the valid ones.")
+        return None
+    
+    def testsIfCatalogueViewsMatchSourceRows(self):
+        f = Firmament.create()
+        with open(f"{root}/data/stellar-catalogue.csv") as ifile: rows = [line.strip().split(",") for line in ifile]
+        for row in random.sample(rows, 50):
+            s = f.set[int(row[1])].get(int(row[0]))
+            self.assertEqual((s.index, s.cindex, s.sindex), (int(row[0]), int(row[1]), int(row[2])), "Different star indexes.")
+            self.assertEqual((s.x, s.y, s.z), (float(row[3]), float(row[4]), float(row[5])), "Different star coordinates.")
+            self.assertEqual((s.rgb, s.designation, s.magnitude), (row[6], row[7], float(row[8])), "Different star attributes.")
+            self.assertEqual(s.rgb_des, Star.designationColor(row[7]), "Different designation color.")
+            self.assertEqual(s.size, Star.starSize(float(row[8])), "Different star size.")
+        self.assertEqual(sum(len(c) for c in f.set.values()), len(rows), "Stars missing from constellations.")
+        self.assertRaises(KeyError, f.set[1].get, int(rows[-1][0]))
+        return None
+    
+    def testsIfCompiledCatalogueMatchesSourceCatalogue(self):
+        compiled = Firmament.create()
+        parsed = Firmament.create(compiled = False)
+        for column, array in parsed.catalogue.arrays().items():
+            self.assertTrue(np.array_equal(compiled.catalogue.arrays()[column], array), f"Different {column} column.")
+        self.assertEqual([c.name for c in compiled.set.values()], [c.name for c in parsed.set.values()], "Different constellations.")
+        self.assertTrue(np.array_equal(compiled.origins, parsed.origins), "Different vectors.")
+        return None
+    
+    def testsIfBatchRendersMatchSerialRenders(self):
+        f = Firmament.create()
+        directions = random.sample(range(16), 3)
+        records = f.renderMany([(4, d, f"Batch {d}.png") for d in directions], processes = 2)
+        self.assertEqual([r["job"][1] for r in records], directions, "Records out of job order.")
+        for d in directions:
+            f.show(4, d, f"Serial {d}.png")
+            with open(f"{root}/images/Batch {d}.png", "rb") as batch, open(f"{root}/images/Serial {d}.png", "rb") as serial:
+                self.assertEqual(batch.read(), serial.read(), "Batch render differs from serial render.")
+        self.assertTrue(all(r["seconds"] > 0 for r in records), "Missing job timings.")
+        return None
+
+    def testsIfBatchRendersKeepThePhotometry(self):
+        f = Firmament.create()
+        f.usePhotometry(1.6, 2, 4.0)
+        reference = random.choice(list(f.set))
+        f.renderMany([(5, reference, "images/Batch Photometric.png")], processes = 1)
+        f.show(5, reference, "images/Photometric.png")
+        with open(f"{root}/images/Batch Photometric.png", "rb") as batch, open(f"{root}/images/Photometric.png", "rb") as serial:
+            self.assertTrue(batch.read() == serial.read(), "Batch render drew with other photometry.")
+        return None
+
+    def testsIfAnimationsStartAtTheirKeyframes(self):
+        f = Firmament.create()
+        keyframes = random.sample(list(f.set), 2)
+        frames = [frame.copy() for frame in f.animate(keyframes, steps = 3)]
+        self.assertEqual(len(frames), 4, "Different frame count.")
+        self.assertTrue(np.array_equal(frames[0], f.drawRealistic(f.set[keyframes[0]].R).framebuffer()), "Different first frame.")
+        self.assertTrue(np.array_equal(frames[-1], f.drawRealistic(f.set[keyframes[1]].R).framebuffer()), "Different last frame.")
+        stream = io.BytesIO()
+        self.assertEqual(f.record(keyframes, stream, steps = 3), 4, "Different recorded frame count.")
+        self.assertEqual(stream.getvalue(), b"".join(frame.tobytes() for frame in frames), "Different raw frames.")
+        return None
+
+    def testsIfPathsTakeCatalogueIndexesAndRejectEmptySteps(self):
+        f = Firmament.create()
+        keyframes = random.sample(list(f.set), 2)
+        path = f.path(np.array(keyframes, dtype = f.catalogue.cindex.dtype), steps = 2)
+        self.assertTrue(np.array_equal(path, f.path(keyframes, steps = 2)), "Different path through numpy keyframes.")
+        with self.assertRaises(ValueError): f.path(keyframes, steps = 0)
+        return None
+
+    def testsIfSyntheticCataloguesMatchTheSourceSchema(self):
+        with tempfile.TemporaryDirectory() as folder:
+            f = Firmament(*map(Table, Synthetic.catalogue(folder, 2000, seed = random.randrange(1 << 30))))
+        self.assertEqual(len(f.catalogue), 2000, "Different star count.")
+        self.assertEqual(len(f.vectors), len(f.edges), "Edges missing from constellations.")
+        self.assertTrue(np.all(np.diff(f.catalogue.cindex) >= 0), "Stars not grouped by constellation.")
+        return None
+
+    def testsIfInstrumentedRendersReportStagesAndCounts(self):
+        f = Firmament.create()
+        records, lines = [], io.StringIO()
+        f.instrument(records.append, Instruments.jsonLines(lines))
+        f.show(4, random.randrange(16), "Instrumented.png")
+        record = records[0]
+        self.assertEqual(json.loads(lines.getvalue()), record, "Different JSON lines record.")
+        self.assertTrue({"culling", "projection", "rasterization", "composition", "encode"} <= set(record["stages"]), "Stages missing.")
+        counts = record["counts"]
+        self.assertEqual(counts["stars.considered"], len(f.catalogue), "Different considered star count.")
+        self.assertEqual(counts["stars.culled"] + counts["stars.drawn"], counts["stars.considered"], "Stars unaccounted for.")
+        self.assertEqual(counts["vectors.culled"] + counts["vectors.drawn"], len(f.vectors), "Vectors unaccounted for.")
+        f.instrument()
+        f.show(4, 0, "Instrumented.png")
+        self.assertEqual(len(records), 1, "Disabled instrumentation still reports.")
+        return None
+    
+    def testsIfBackgroundWritesReportToTheirRender(self):
+        f = Firmament.create()
+        records = []
+        f.instrument(records.append)
+        f.useWriter(1)
+        for view in random.sample(range(16), 2): f.show(4, view, "Instrumented.png")
+        f.writer.wait()
+        f.useWriter(0)
+        self.assertEqual(len(records), 2, "Different record count.")
+        for record in records:
+            self.assertTrue({"rasterization", "encode", "write"} <= set(record["stages"]), "Background stages missing.")
+            self.assertEqual(record["stages"]["write"]["calls"], 1, "Write reported to another render.")
+        return None
+
+    def testsIfPhotometricRendersProjectOnce(self):
+        f = Firmament.create()
+        records = []
+        f.instrument(records.append)
+        f.show(5, random.choice(list(f.set)), "images/Photometric.png")
+        f.instrument()
+        self.assertEqual(records[0]["stages"]["projection"]["calls"], 1, "Visible stars projected again.")
+        return None
+
+    def testsIfTilesDrawStarsWhereTheyLie(self):
+        f = Firmament.create()
+        tiles = Tiles(f, 3, size = 128)
+        zoom = random.randrange(1, 4)
+        for row in random.sample(range(len(f.catalogue)), 5):
+            theta, phi = Projection.toPolar(f.catalogue.xyz[row:row + 1])
+            scale = tiles.scale(zoom)
+            x, y = int(np.rint((PI / 2 - phi[0]) * scale)), int(np.rint(((-theta[0]) % (2 * PI)) * scale)) % (tiles.count(zoom)[0] * 128)
+            img = Image.open(io.BytesIO(tiles.tile(zoom, y // 128, x // 128))).convert("L")
+            self.assertEqual(img.getpixel((y % 128, x % 128)), 0, "Star missing from its tile.")
+        data = tiles.tile(zoom, 0, 0)
+        self.assertIs(tiles.tile(zoom, 0, 0), data, "Tile not served from cache.")
+        self.assertEqual(sum(1 for _ in tiles.pyramid(2)), 10, "Different pyramid tile count.")
+        return None
+
+    def testsIfStitchedTilesMatchOneLargerTile(self):
+        f = Firmament.create()
+        tile = lambda tiles, *key: np.asarray(Image.open(io.BytesIO(tiles.tile(*key))).convert("RGB"))
+        for option in Tiles.OPTIONS:
+            # Zoom 1 tiles of 128 pixels cover the zoom 0 tiles of 256 pixels at the same scale.
+            fine, coarse = Tiles(f, option, size = 128), Tiles(f, option, size = 256)
+            stitched = np.concatenate([np.concatenate([tile(fine, 1, tx, ty) for tx in range(4)], axis = 1) for ty in range(2)], axis = 0)
+            whole = np.concatenate([tile(coarse, 0, tx, 0) for tx in range(2)], axis = 1)
+            self.assertTrue(np.array_equal(stitched, whole), f"Seams between option {option} tiles.")
+        return None
+
+    def testsIfStreamedCataloguesMatchFilteredSources(self):
+        f = Firmament.create(compiled = False)
+        sources = [f"{root}/data/{name}-catalogue.csv" for name in ("stellar", "vectoral", "aggregational")]
+        reports = []
+        streamed = Firmament.ingest(*sources, chunk = random.randrange(500, 5000), progress = lambda *report: reports.append(report))
+        for column, array in f.catalogue.arrays().items():
+            self.assertTrue(np.array_equal(streamed.catalogue.arrays()[column], array), f"Different {column} column.")
+        self.assertEqual(reports[-1][:2], (len(f.catalogue), len(f.catalogue)), "Different progress counts.")
+        self.assertEqual(reports[-1][2], reports[-1][3], "Catalogue not read to the end.")
+
+        subset = random.sample(list(f.set), 10)
+        direction, radius = f.catalogue.xyz[random.randrange(len(f.catalogue))], random.uniform(0.3, 1.5)
+        streamed = Firmament.ingest(*sources, chunk = 1000, magnitude = 5.0, subset = subset, region = (direction, radius))
+        mask = (f.catalogue.magnitude < 5.0) & np.isin(f.catalogue.cindex, subset) & (f.catalogue.xyz @ direction >= np.cos(radius))
+        self.assertTrue(np.array_equal(streamed.catalogue.index, f.catalogue.index[mask]), "Different filtered stars.")
+        self.assertTrue(np.all(streamed.catalogue.rows(streamed.edges[:, [2, 4]].ravel()) >= 0), "Vector to a filtered-out star.")
+        return None
+
+    def testsIfLimitedRendersKeepTheBrightestStars(self):
+        f = Firmament.create()
+        R = f.set[random.choice(list(f.set))].R
+        rows, x, y = f.visibleStars(R)
+        magnitude = random.uniform(0.5, 6.5)
+        limited = f.visibleStars(R, magnitude = magnitude)
+        bright = f.catalogue.magnitude[rows] < magnitude
+        for expected, actual in zip((rows[bright], x[bright], y[bright]), limited):
+            self.assertTrue(np.array_equal(expected, actual), "Different stars brighter than the limit.")
+
+        count = random.randrange(1, len(rows))
+        chosen = np.sort(np.lexsort((rows, f.catalogue.magnitude[rows]))[:count])
+        limited = f.visibleStars(R, count = count)
+        for expected, actual in zip((rows[chosen], x[chosen], y[chosen]), limited):
+            self.assertTrue(np.array_equal(expected, actual), "Different brightest stars.")
+        (_, _, visible), _ = f.project(R, magnitude = magnitude)
+        self.assertTrue(np.array_equal(np.flatnonzero(visible), rows[bright]), "Different projected stars.")
+
+        direction = f.catalogue.xyz[random.randrange(len(f.catalogue))]
+        cone = f.cone(direction, 0.5)
+        self.assertTrue(np.array_equal(f.cone(direction, 0.5, magnitude), cone[f.catalogue.magnitude[cone] < magnitude]), "Different cone stars.")
+        return None
+
+    def testsIfRenderCacheServesAndInvalidatesViews(self):
+        f = Firmament.create()
+        reference = random.choice(list(f.set))
+        with tempfile.TemporaryDirectory() as folder:
+            f.useCache(4, folder)
+            data = f.render(0, reference)
+            self.assertIs(f.render(0, reference), data, "View not served from memory.")
+            f.useCache(4, folder)
+            self.assertEqual(f.render(0, reference), data, "View not served from disk.")
+            self.assertNotEqual(f.render(0, reference, magnitude = 3.0), data, "Limited view served from cache.")
+            self.assertEqual(f.renders.misses, 1, "Different cache misses.")
+
+            version = f.version
+            catalogue = f.catalogue.arrays()
+            catalogue["magnitude"] = catalogue["magnitude"] - 1.0
+            f.populateStars(Catalogue(**{column: array for column, array in catalogue.items() if column not in ("size", "rgb_des")}))
+            self.assertNotEqual(f.version, version, "Same version for a changed catalogue.")
+            self.assertNotEqual(f.render(0, reference), data, "Stale view served after a catalogue change.")
+        return None
+
+    def testsIfUncachedRendersSkipTheVersion(self):
+        f = Firmament.create()
+        reference = random.choice(list(f.set))
+        f.useCache(0)
+        data = f.render(0, reference)
+        self.assertIsNone(f.state.digest, "Version hashed for an uncached render.")
+        f.useCache(4)
+        self.assertEqual(f.render(0, reference), data, "Different cached render.")
+        self.assertIsNotNone(f.state.digest, "Cached render keyed without the version.")
+        return None
+
+    def testsIfReloadedCataloguesKeepTheirLines(self):
+        f = Firmament.create()
+        origins, targets = f.origins, f.targets
+        columns = {column: array for column, array in f.catalogue.arrays().items() if column not in ("size", "rgb_des", "lookup")}
+        shuffle = np.random.permutation(len(f.catalogue))
+        shuffled = Catalogue.grouped({column: array[shuffle] for column, array in columns.items()}, list(f.set))
+        self.assertFalse(np.array_equal(shuffled.index, f.catalogue.index), "Catalogue not reordered.")
+        f.populateStars(shuffled)
+        self.assertTrue(np.array_equal(f.origins, origins), "Lines start at other stars.")
+        self.assertTrue(np.array_equal(f.targets, targets), "Lines end at other stars.")
+        return None
+
+    def testsIfPinnedRendersKeepTheirOwnVersion(self):
+        f, fresh = Firmament.create(), Firmament.create()
+        catalogue = f.catalogue.arrays()
+        catalogue["magnitude"] = catalogue["magnitude"] - 1.0
+        changed = Catalogue(**{column: array for column, array in catalogue.items() if column not in ("size", "rgb_des")})
+        fresh.populateStars(changed)
+        with f.pinned():
+            # A render that began before the repopulation hashes the catalogue it pinned.
+            f.populateStars(changed)
+            pinned = f.version
+        self.assertNotEqual(pinned, f.version, "Old version published for the new catalogue.")
+        self.assertEqual(f.version, fresh.version, "Different version of the same catalogue.")
+        return None
+
+    def testsIfBackgroundWritesMatchDirectWrites(self):
+        f = Firmament.create()
+        view = random.randrange(16)
+        f.show(4, view, "Direct.webp")
+        f.useWriter(2)
+        f.show(4, view, "Background.webp")
+        f.writer.wait()
+        f.useWriter(0)
+        with open(f"{root}/images/Direct.webp", "rb") as direct, open(f"{root}/images/Background.webp", "rb") as background:
+            self.assertEqual(direct.read(), background.read(), "Different background write.")
+        frame = f.frame(4, view)
+        self.assertEqual(bytes(f.render(4, view, format = "rgb")), frame.tobytes(), "Different raw render.")
+        self.assertTrue(np.array_equal(np.asarray(Image.open(io.BytesIO(f.render(4, view, format = "png", level = 1)))), frame), "Different fast PNG.")
+        return None
+    
+    def testsIfOutputsAreEncodedAsTheirSuffixSays(self):
+        f = Firmament.create()
+        view = random.randrange(16)
+        for filename, magic in (("Suffix.jpg", b"\xff\xd8\xff"), ("Suffix.bmp", b"BM"), ("Suffix.gif", b"GIF8")):
+            f.show(4, view, filename)
+            with open(f"{root}/images/{filename}", "rb") as ifile: self.assertEqual(ifile.read(len(magic)), magic, f"{filename} not encoded as its suffix.")
+        with self.assertRaises(ValueError): f.show(4, view, "Suffix.xyz")
+        return None
+    
+    def testsIfPickedStarsAreUnderTheirPixels(self):
+        f = Firmament.create()
+        R = Matrix(random.choice(Firmament.VIEWS))
+        rows, x, y = f.visibleStars(R)
+        n = random.randrange(len(rows))
+        star, constellation, distance = f.pick(int(x[n]), int(y[n]), R)
+        expected = 2 * np.arcsin(np.linalg.norm(Projection.unproject([x[n]], [y[n]], R)[0] - f.catalogue.xyz[rows[n]]) / 2)
+        self.assertLessEqual(distance, expected + 1e-12, "Picked star farther than the star drawn there.")
+        self.assertLess(distance, 1 / Projection.SCALE, "Picked star farther than a pixel.")
+        self.assertEqual(constellation.cindex, star.cindex, "Different constellation.")
+        picked, _ = f.pickMany(x, y, R, magnitude = 3.0)
+        bright = picked[picked >= 0]
+        self.assertTrue(np.all(f.catalogue.magnitude[bright] < 3.0), "Picked a star fainter than the limit.")
+        self.assertIsNone(f.pick(0, 0, R, radius = 0.0), "Picked a star at no distance.")
+        return None
+    
+    def testsIfObservedSkiesHideStarsBelowTheHorizon(self):
+        f = Firmament.create()
+        latitude, longitude = random.uniform(-PI / 2, PI / 2), random.uniform(-PI, PI)
+        times = np.datetime64("2024-01-01T00:00") + np.arange(0, 24 * 60, 90).astype("timedelta64[m]")
+        views, zeniths = f.observe(latitude, longitude, times, random.uniform(0, 2 * PI), 0.0)
+        for n in random.sample(range(len(times)), 3):
+            frames = Ephemeris.frames(times[n:n + 1], latitude, longitude)
+            self.assertTrue(np.allclose(zeniths[n], frames[0, 2]), "Batch frame differs from a single one.")
+            rows, _, _ = f.visibleStars(views[n], zenith = zeniths[n])
+            self.assertTrue(np.all(Ephemeris.altitudes(f.catalogue.xyz[rows], frames) >= 0), "Star drawn below the horizon.")
+            self.assertLess(len(rows), len(f.visibleStars(views[n])[0]), "Horizon culled nothing.")
+        return None
+    
+    def testsIfFullSkyProjectionsShowEveryStar(self):
+        f = Firmament.create()
+        view = random.randrange(16)
+        rows, x, y = f.visibleStars(Firmament.VIEWS[view], projection = "hammer")
+        self.assertEqual(len(rows), len(f.catalogue), "Stars missing from the full sky.")
+        f.show(4, view, "Hammer.png", projection = "hammer")
+        with Image.open(f"{root}/images/Hammer.png") as img:
+            self.assertEqual(img.size[::-1], Projection.kernel("hammer").shape(), "Different map size.")
+        n = random.randrange(len(rows))
+        _, _, distance = f.pick(int(x[n]), int(y[n]), Firmament.VIEWS[view], projection = "hammer")
+        sky, _ = Projection.kernel("hammer").unproject([x[n]], [y[n]], Firmament.VIEWS[view])
+        self.assertLessEqual(distance, 2 * np.arcsin(np.linalg.norm(sky[0] - f.catalogue.xyz[rows[n]]) / 2) + 1e-12, "Picked a farther star.")
+        with self.assertRaises(ValueError): f.show(4, view, "Unknown.png", projection = "mercator")
+        return None
+    
+    def testsIfPhotometricRendersLightTheBrightestStars(self):
+        f = Firmament.create()
+        reference = random.choice(list(f.set))
+        rows, x, y = f.visibleStars(f.set[reference].R, count = 20)
+        frame = f.frame(5, reference)
+        self.assertEqual(frame.shape, (Projection.WIDTH, Projection.HEIGHT, 3), "Different frame size.")
+        self.assertTrue(np.all(frame[x, y].max(axis = 1) > 0), "Bright star left dark.")
+        self.assertGreater(np.mean(frame.max(axis = 2) == 0), 0.5, "Background not dark.")
+        key = f.renderKey(5, reference)
+        f.usePhotometry(sigma = 1.5, supersample = 2)
+        self.assertNotEqual(f.renderKey(5, reference), key, "Photometry settings missing from the render key.")
+        with self.assertRaises(ValueError): f.usePhotometry(sigma = 0)
+        with self.assertRaises(ValueError): f.usePhotometry(supersample = 0)
+        return None
+    
+    def testsIfAtlasesHoldEveryPageInOrder(self):
+        f = Firmament.create()
+        pages = [(3, page) for page in random.sample(range(16), 3)] + [(4, random.randrange(16))]
+        with tempfile.TemporaryDirectory() as folder:
+            f.atlas(f"{folder}/Atlas.tiff", pages, workers = 2)
+            with Image.open(f"{folder}/Atlas.tiff") as img:
+                self.assertEqual(img.n_frames, len(pages), "Different page count.")
+                for n, (option, reference) in enumerate(pages):
+                    img.seek(n)
+                    self.assertTrue(np.array_equal(np.asarray(img.convert("RGB")), f.frame(option, reference)), "Different page.")
+            for vector in (False, True):
+                f.atlas(f"{folder}/Atlas.pdf", pages, vector = vector, workers = 2)
+                with open(f"{folder}/Atlas.pdf", "rb") as ifile: data = ifile.read()
+                start = int(data.rsplit(b"startxref", 1)[1].split()[0])
+                offsets = [int(line[:10]) for line in data[start:].split(b"\n")[3:] if line.endswith(b" n ")]
+                for number, offset in enumerate(offsets, 1):
+                    self.assertTrue(data[offset:].startswith(b"%d 0 obj" % number), "Broken cross-reference table.")
+                self.assertIn(b"/Count %d" % len(pages), data, "Different page count.")
+                self.assertEqual(data.count(b"/Subtype /Image"), 0 if vector else len(pages), "Images in vector pages.")
+        with self.assertRaises(ValueError): f.atlas("Atlas.png")
+        with self.assertRaises(ValueError): f.atlas("Atlas.tiff", vector = True)
+        return None
+    
+    def testsIfUpdatesMatchRebuiltFirmaments(self):
+        stars, vectors, constellations = (list(Table(f"{root}/data/{name}-catalogue.csv")) for name in ("stellar", "vectoral", "aggregational"))
+        f = Firmament(stars, vectors, constellations)
+        f.index, f.levels.index(0)
+        linked = {int(v[i]) for v in vectors for i in (2, 4)}
+        deleted = random.sample([int(s[0]) for s in stars], 3)
+        changed = [[*s[:8], str(float(s[8]) + 1)] for s in random.sample(stars, 4) if int(s[0]) not in deleted]
+        moved = [[s[0], str(random.choice(list(f.set))), *s[2:]] for s in random.sample(stars, 2)
+                 if int(s[0]) not in linked and int(s[0]) not in deleted and not any(c[0] == s[0] for c in changed)]
+        added = [[str(10 ** 6 + n), str(random.choice(list(f.set))), "1", "0.6", "0.0", "0.8", "FFFFFF", f"Nova{n}", "1.5"] for n in range(2)]
+        kept = [v for v in vectors if not {int(v[2]), int(v[4])} & set(deleted)]
+        f.update(changed + moved + added, [], deleted, [kept[0]])
+
+        updates = {s[0]: s for s in changed + moved + added}
+        rows = [updates.get(s[0], s) for s in stars if int(s[0]) not in deleted and not any(m[0] == s[0] for m in moved)] + moved + added
+        g = Firmament(rows, kept[1:], constellations)
+        for name, array in g.arrays().items(): self.assertTrue(np.array_equal(f.arrays()[name], array), f"Different {name}.")
+        self.assertTrue(np.array_equal(f.lines, g.lines), "Different vector ends.")
+        self.assertTrue(np.array_equal(f.index.order, SkyIndex(g.catalogue.xyz, f.index.resolution).order), "Stale sky index.")
+        self.assertTrue(np.array_equal(f.levels.rows[0], g.levels.rows[0]), "Stale magnitude buckets.")
+
+        catalogue = f.catalogue
+        with self.assertRaises(ValueError): f.update(deletedStars = [10 ** 7])
+        with self.assertRaises(ValueError): f.update(vectors = [[added[0][1], added[0][1], added[0][0], "0", "0"]])
+        self.assertIs(f.catalogue, catalogue, "Invalid update applied.")
+        return None
+    
+    def testsIfUpdatesOnlyInvalidateTheViewsTheyReach(self):
+        f = Firmament.create()
+        f.useCache(64)
+        near = random.choice(list(f.set))
+        axis = Projection.asArray(f.set[near].R)[0]
+        far = min(f.set, key = lambda c: float(Projection.asArray(f.set[c].R)[0] @ axis))
+        renders = {reference: f.render(0, reference) for reference in (near, far)}
+        tiles = Tiles(f, 0, size = 64)
+        tile = tiles.tile(0, 0, 0)
+        with tempfile.TemporaryDirectory() as folder:
+            with open(f"{folder}/delta.csv", "w") as ofile:
+                ofile.write(f"+,star,{10 ** 6},{near},1,{','.join(map(repr, axis.tolist()))},FFFFFF,Nova,-1.0\n")
+            f.applyDelta(f"{folder}/delta.csv")
+        self.assertIs(f.render(0, far), renders[far], "Unreached view rendered again.")
+        self.assertNotEqual(f.render(0, near), renders[near], "Stale view served after an update.")
+        self.assertEqual(f.render(0, near), f.render(0, near, magnitude = 99), "Updated view missing the new star.")
+        self.assertEqual(len(f.revisions(Firmament.VIEWS[0], "hammer")), 1, "Full-sky view missed the update.")
+        reached = [(tx, ty) for tx in range(2) for ty in range(1) if tiles.revisions(0, tx, ty)]
+        self.assertTrue(reached, "No tile reached by the update.")
+        if (0, 0) not in reached: self.assertIs(tiles.tile(0, 0, 0), tile, "Unreached tile rendered again.")
+        return None
+    
+    def testsIfTilesAreKeyedBySizeAndVersion(self):
+        f = Firmament.create()
+        with tempfile.TemporaryDirectory() as folder:
+            Tiles(f, 0, size = 64, folder = folder).tile(0, 0, 0)
+            img = Image.open(io.BytesIO(Tiles(f, 0, size = 128, folder = folder).tile(0, 0, 0)))
+            self.assertEqual(img.size, (128, 128), "Tile of another size served from a shared folder.")
+        tiles = Tiles(f, 0, size = 64)
+        data = tiles.tile(0, 0, 0)
+        catalogue = f.catalogue.arrays()
+        catalogue["magnitude"] = catalogue["magnitude"] - 1.0
+        f.populateStars(Catalogue(**{column: array for column, array in catalogue.items() if column not in ("size", "rgb_des")}))
+        self.assertIsNot(tiles.tile(0, 0, 0), data, "Tile of the old catalogue served.")
+        self.assertEqual(tiles.tile(0, 0, 0), Tiles(f, 0, size = 64).tile(0, 0, 0), "Different tile of the new catalogue.")
+        return None
+
+    def testsIfUpdateLogsFoldIntoNewVersions(self):
+        f, updated = Firmament.create(), Firmament.create()
+        f.useCache(64)
+        near = random.choice(list(f.set))
+        nova = [str(10 ** 6), str(near), "1", *map(repr, Projection.asArray(f.set[near].R)[0].tolist()), "FFFFFF", "Nova", "-1.0"]
+        updated.update([nova])
+        version, compact = f.version, Firmament.COMPACT
+        try:
+            Firmament.COMPACT = 4
+            for n in range(9):
+                f.update(deletedStars = [nova[0]]) if n % 2 else f.update([nova])
+                self.assertLessEqual(len(f.changes), Firmament.COMPACT, "Update log grew past its bound.")
+                self.assertEqual(f.render(0, near), (updated if n % 2 == 0 else Firmament.create()).render(0, near), "Stale view after an update.")
+        finally: Firmament.COMPACT = compact
+        self.assertNotEqual(f.version, version, "Folded updates kept the populated version.")
+        return None
+
+    def testsIfRendersDuringUpdatesSeeOneCatalogue(self):
+        f, clean, updated = Firmament.create(), Firmament.create(), Firmament.create()
+        f.useCache(64)
+        near = random.choice(list(f.set)[:-1])
+        # A star new to an early constellation shifts the rows of every later one.
+        nova = [str(10 ** 6), str(near), "1", *map(repr, Projection.asArray(f.set[near].R)[0].tolist()), "FFFFFF", "Nova", "-1.0"]
+        updated.update([nova])
+        jobs = [(4, view) for view in random.sample(range(16), 3)] + [(2, near)]
+        expected = {job: {clean.render(*job), updated.render(*job)} for job in jobs}
+        done = threading.Event()
+
+        def toggle():
+            try:
+                for n in range(200): f.update(deletedStars = [nova[0]]) if n % 2 else f.update([nova])
+            finally: done.set()
+            return None
+
+        def render(job: tuple[int, int]):
+            frames = []
+            while not done.is_set(): frames.append(f.render(*job))
+            return job, frames
+
+        with ThreadPoolExecutor(len(jobs) + 1) as pool:
+            writer = pool.submit(toggle)
+            results = list(pool.map(render, jobs))
+            writer.result()
+        for job, frames in results:
+            self.assertTrue(frames, "No render ran during the updates.")
+            self.assertTrue(all(frame in expected[job] for frame in frames), f"Torn render of {job}.")
+        self.assertTrue(all(f.render(*job) == clean.render(*job) for job in jobs), "Stale render after the updates.")
+        return None
+
+    def testsIfThreadsShareOneFirmament(self):
+        f = Firmament.create()
+        jobs = [(random.choice((0, 2)), random.choice(list(f.set))) for _ in range(4)] + [(random.choice((3, 4)), random.randrange(16)) for _ in range(4)]
+        with ThreadPoolExecutor(4) as pool:
+            shared = list(pool.map(lambda job: f.render(*job), jobs * 2))
+        private = Firmament.create()
+        for job, data in zip(jobs * 2, shared):
+            self.assertEqual(data, private.render(*job), "Concurrent render differs from a serial one.")
+        self.assertFalse(f.catalogue.xyz.flags.writeable, "Shared catalogue is writeable.")
+
+        s = f.stars[random.randrange(len(f.catalogue))]
+        R = f.set[random.choice(list(f.set))].R
+        expected = s.position(R)
+        s.rotate(Firmament.VIEWS[0])
+        self.assertEqual(s.position(R), expected, "Star position depends on an earlier rotation.")
+        return None
 
 if __name__ == "__main__": unittest.main()
\ No newline at end of file
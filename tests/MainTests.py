@@ -0,0 +1,130 @@
+import asyncio, os, random, sys, tempfile, unittest
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from components import Firmament
+from main import Service
+from measurements import Projection
+
+class MainTests(unittest.TestCase):
+    @staticmethod
+    async def get(port: int, target: str):
+        return await MainTests.send(port, f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+
+    @staticmethod
+    async def send(port: int, request: bytes):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b"\r\n\r\n", 1)
+        return int(head.split(b" ")[1]), body
+
+    def testsIfIdenticalRequestsShareOneRender(self):
+        f = Firmament.create()
+        view = random.randrange(16)
+
+        async def run():
+            service = Service(f, workers = 2, queue = 4)
+            _, port = await service.start(port = 0)
+            try: responses = await asyncio.gather(*[MainTests.get(port, f"/render?option=4&reference={view}") for _ in range(6)])
+            finally: await service.stop()
+            return service, responses
+
+        service, responses = asyncio.run(run())
+        self.assertEqual(service.rendered, 1, "Identical requests rendered more than once.")
+        for status, body in responses:
+            self.assertEqual(status, 200, "Render request failed.")
+            self.assertEqual(body, f.render(4, view), "Different served render.")
+        return None
+
+    def testsIfBadRequestsAreRejected(self):
+        f = Firmament.create()
+
+        async def run():
+            service = Service(f, workers = 1, queue = 1)
+            _, port = await service.start(port = 0)
+            try:
+                statuses = [(await MainTests.get(port, target))[0] for target in
+                            ("/render?option=0", "/render?option=9&reference=1", "/render?option=0&reference=999", "/other")]
+                statuses.append((await MainTests.send(port, b"GARBAGE\r\n\r\n"))[0])
+                limits = [(await MainTests.get(port, f"/render?option=4&reference=0&{limit}"))[0] for limit in
+                          ("count=-5", "count=0", "magnitude=-1", "magnitude=nan", "magnitude=inf")]
+                # Three distinct renders submitted at once overflow one worker and a one-slot queue.
+                burst = await asyncio.gather(*[MainTests.get(port, f"/render?option=0&reference={c}") for c in (1, 2, 3)])
+            finally: await service.stop()
+            return statuses, limits, {status for status, _ in burst}
+
+        statuses, limits, burst = asyncio.run(run())
+        self.assertEqual(statuses, [400, 400, 404, 404, 400], "Different error statuses.")
+        self.assertEqual(limits, [400] * 5, "Out of range limits rendered.")
+        self.assertEqual(burst, {200, 503}, "Full queue did not push back.")
+        return None
+
+    def testsIfProcessWorkersDrawWithTheFirmamentsPhotometry(self):
+        f = Firmament.create()
+        f.usePhotometry(1.6, 2, 4.0)
+        reference = random.choice(list(f.set))
+
+        async def run(processes: bool):
+            service = Service(f, workers = 1, queue = 1, processes = processes)
+            _, port = await service.start(port = 0)
+            try: return await MainTests.get(port, f"/render?option=5&reference={reference}")
+            finally: await service.stop()
+
+        threaded, spawned = asyncio.run(run(False)), asyncio.run(run(True))
+        self.assertTrue(threaded == (200, f.render(5, reference)), "Different threaded photometric render.")
+        self.assertTrue(spawned == threaded, "Process workers drew with other photometry.")
+        return None
+
+    def testsIfProcessWorkersCacheAndFollowUpdates(self):
+        f = Firmament.create()
+        reference = random.choice(list(f.set))
+        nova = [str(10 ** 6), str(reference), "1", *map(repr, Projection.asArray(f.set[reference].R)[0].tolist()), "FFFFFF", "Nova", "-1.0"]
+
+        async def run(folder: str, moved: str):
+            f.useCache(4, folder)
+            service = Service(f, workers = 1, queue = 1, processes = True)
+            _, port = await service.start(port = 0)
+            try:
+                before = await MainTests.get(port, f"/render?option=0&reference={reference}")
+                f.update([nova])
+                after = await MainTests.get(port, f"/render?option=0&reference={reference}")
+                f.useCache(4, moved)
+                await MainTests.get(port, "/render?option=4&reference=0")
+            finally: await service.stop()
+            return before, after, sum(len(files) for _, _, files in os.walk(folder)), sum(len(files) for _, _, files in os.walk(moved))
+
+        with tempfile.TemporaryDirectory() as folder, tempfile.TemporaryDirectory() as moved:
+            before, after, cached, recached = asyncio.run(run(folder, moved))
+        self.assertEqual(before[0], 200, "Render request failed.")
+        self.assertTrue(after == (200, f.render(0, reference)), "Process workers served the sky before the update.")
+        self.assertNotEqual(before[1], after[1], "Update not drawn.")
+        self.assertEqual(cached, 2, "Process workers left the render cache unused.")
+        self.assertEqual(recached, 1, "Process workers kept the cache they started with.")
+        return None
+
+    def testsIfWorkersShareOneReattach(self):
+        f = Firmament.create()
+        reference = random.choice(list(f.set))
+        nova = [str(10 ** 6), str(reference), "1", *map(repr, Projection.asArray(f.set[reference].R)[0].tolist()), "FFFFFF", "Nova", "-1.0"]
+
+        async def run():
+            service = Service(f, workers = 2, queue = 4, processes = True)
+            _, port = await service.start(port = 0)
+            try:
+                first = service.pool
+                f.update([nova])
+                responses = await asyncio.gather(*(MainTests.get(port, target) for target in
+                                                   (f"/render?option=0&reference={reference}", "/render?option=4&reference=0")))
+                retired = len(service.retiring)
+                self.assertIsNot(service.pool, first, "Process pool not reattached.")
+            finally: await service.stop()
+            return responses, retired
+
+        responses, retired = asyncio.run(run())
+        self.assertEqual([status for status, _ in responses], [200, 200], "Render requests failed.")
+        self.assertEqual(retired, 1, "Workers attached a pool each.")
+        self.assertEqual(responses[0][1], f.render(0, reference), "Process workers served the sky before the update.")
+        return None
+
+if __name__ == "__main__": unittest.main()
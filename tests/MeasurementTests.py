@@ -1,6 +1,8 @@
 import os, random, sys, unittest
+from math import pi as PI
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from measurements import Color, Matrix
+import numpy as np
+from measurements import Color, Ephemeris, Levels, Mat3, Matrix, Projection, Quat, SkyIndex, Vec3
 
 class MeasurementTests(unittest.TestCase):
     def testsIfVectorMethodsAreWorking(self):
@@ -35,7 +37,150 @@ class MeasurementTests(unittest.TestCase):
         self.assertEqual(hex1, hex2, "Different hex color values.")
         self.assertEqual(int1, int2, "Different integer color values.")
         return None
+    
+    def testsIfPackedColorArraysUnpack(self):
+        colors = np.random.randint(0, 256, (50, 3))
+        packed = np.array([Color.hex_to_rgb(Color.tuple_to_hex(*c)) for c in colors.tolist()], dtype = np.uint32)
+        self.assertTrue(np.array_equal(Color.rgb_to_array(packed), colors), "Different unpacked color values.")
+        self.assertEqual(Color.hex_to_rgb("A0B1C2"), Color.tuple_to_rgb(0xA0, 0xB1, 0xC2), "Different packed color value.")
+        return None
+    
+    def testsIfSkyIndexQueriesMatchFullScans(self):
+        xyz = np.random.default_rng(random.randrange(1 << 30)).normal(size = (5000, 3))
+        xyz /= np.linalg.norm(xyz, axis = 1, keepdims = True)
+        index = SkyIndex(xyz)
+        for _ in range(10):
+            direction = xyz[random.randrange(len(xyz))]
+            radius = random.uniform(0.01, 2.0)
+            expected = np.flatnonzero(xyz @ direction >= np.cos(radius))
+            self.assertTrue(np.array_equal(index.cone(direction, radius), expected), "Different cone query rows.")
+
+            R = Matrix.rMatrix(Matrix.Vector(random.uniform(-PI, PI), random.uniform(-PI, PI), random.uniform(-PI, PI)))
+            theta = (random.uniform(-PI, PI), random.uniform(-PI, PI))
+            phi = tuple(sorted((random.uniform(-PI / 2, PI / 2), random.uniform(-PI / 2, PI / 2))))
+            t, p = Projection.toPolar(Projection.rotate(xyz, R))
+            width = (theta[1] - theta[0]) % (2 * PI)
+            expected = np.flatnonzero(((t - theta[0]) % (2 * PI) < width) & (phi[0] <= p) & (p < phi[1]))
+            self.assertTrue(np.array_equal(index.box(R, theta, phi), expected), "Different box query rows.")
+        return None
+
+    def testsIfFixedTypesMatchMatrix(self):
+        angles = Matrix.Vector(random.uniform(-PI, PI), random.uniform(-PI, PI), random.uniform(-PI, PI))
+        v = Matrix.Vector(random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1))
+        R, R3, v3 = Matrix.rMatrix(angles), Mat3.rMatrix(Vec3.of(angles)), Vec3.of(v)
+        self.assertEqual(R.M, R3.M, "Different rotation matrices.")
+        self.assertEqual((R * v).M, (R3 * v3).M, "Different rotated vectors.")
+        self.assertEqual((R * R).M, (R3 * R3).M, "Different matrix products.")
+        self.assertEqual((R * R3).M, (R3 * R).M, "Mixed products differ.")
+        self.assertEqual(Matrix.transpose(R).M, R3.transpose().M, "Different transposes.")
+        self.assertEqual(Matrix.toPolar(v).M, v3.toPolar().M, "Different polar coordinates.")
+        self.assertEqual(Matrix.rFactors(v).M, Mat3.rFactors(v3).M, "Different rotation factors.")
+        self.assertTrue(Matrix.invert(R) == R3.invert() and Matrix.invert(R) == R3.invert(orthonormal = True), "Different inverses.")
+
+        xyz = np.random.default_rng(random.randrange(1 << 30)).normal(size = (20, 3))
+        polar = Vec3.toPolarMany(xyz)
+        self.assertTrue(np.allclose(Vec3.toCartesianMany(polar), xyz), "Polar round trip differs.")
+        self.assertTrue(np.allclose(Mat3.applyMany(Mat3.rMatrices(polar), xyz)[0], list(Mat3.rMatrix(Vec3(*polar[0])) * Vec3(*xyz[0]))), "Different batch rotations.")
+        self.assertTrue(np.allclose(Mat3.rFactorsMany(xyz)[0], list(Mat3.rFactors(Vec3(*xyz[0])))), "Different batch rotation factors.")
+        return None
+    
+    def testsIfQuaternionsRoundTripRotations(self):
+        R = Matrix.rMatrix(Matrix.Vector(random.uniform(-PI, PI), random.uniform(-PI, PI), random.uniform(-PI, PI)))
+        q = Quat.fromMatrix(R)
+        self.assertTrue(np.allclose(q.toMatrix().M, R.M), "Different rotation matrices.")
+
+        S = Matrix.rMatrix(Matrix.Vector(random.uniform(-PI, PI), random.uniform(-PI, PI), random.uniform(-PI, PI)))
+        path = Quat.toMatrices(Quat.slerp(q, Quat.fromMatrix(S), [0, 0.5, 1]))
+        self.assertTrue(np.allclose(path[0], R.M) and np.allclose(path[2], S.M), "Different path endpoints.")
+        self.assertTrue(np.allclose(path[1] @ path[1].T, np.identity(3)), "Interpolated matrix is not a rotation.")
+        return None
 
+    def testsIfUnprojectedPixelsProjectBack(self):
+        R = Matrix.rMatrix(Matrix.Vector(random.uniform(-PI, PI), random.uniform(-PI, PI), random.uniform(-PI, PI)))
+        x, y = np.random.randint(0, Projection.WIDTH, 500), np.random.randint(0, Projection.HEIGHT, 500)
+        px, py, visible = Projection.project(Projection.unproject(x, y, R), R)
+        self.assertTrue(visible.all() and np.array_equal(px, x) and np.array_equal(py, y), "Pixels do not project back.")
+        return None
+
+    def testsIfNearestPositionsMatchBruteForce(self):
+        xyz = np.random.normal(size = (3000, 3))
+        xyz /= np.linalg.norm(xyz, axis = 1, keepdims = True)
+        queries = np.random.normal(size = (400, 3))
+        queries /= np.linalg.norm(queries, axis = 1, keepdims = True)
+        radius = random.uniform(0.01, 0.2)
+        rows, distances = SkyIndex(xyz).nearest(queries, radius)
+        chords = np.linalg.norm(queries[:, None, :] - xyz[None, :, :], axis = 2)
+        found = 2 * np.arcsin(chords.min(axis = 1) / 2) <= radius
+        self.assertTrue(np.array_equal(rows, np.where(found, chords.argmin(axis = 1), -1)), "Different nearest positions.")
+        self.assertTrue(np.all(np.isinf(distances[~found])), "Distance reported without a match.")
+        return None
+
+    def testsIfPatchedIndexesMatchFreshIndexes(self):
+        xyz = np.random.normal(size = (3000, 3))
+        xyz /= np.linalg.norm(xyz, axis = 1, keepdims = True)
+        magnitude = np.random.uniform(-1, 8, 3000)
+        index, levels = SkyIndex(xyz), Levels(xyz, magnitude, (1.0, 3.0, 5.0))
+        for bucket in random.sample(range(4), 2): levels.index(bucket)
+        keep = np.random.random(3000) > 0.05
+        at = np.sort(np.random.randint(0, keep.sum() + 1, 40))
+        fresh = np.random.normal(size = (40, 3))
+        patchedXyz = np.insert(xyz[keep], at, fresh / np.linalg.norm(fresh, axis = 1, keepdims = True), axis = 0)
+        patchedMagnitude = np.insert(magnitude[keep], at, np.random.uniform(-1, 8, 40))
+        remap = np.full(3000, -1)
+        remap[keep] = np.arange(keep.sum()) + np.searchsorted(at, np.arange(keep.sum()), side = "right")
+        added = at + np.arange(40)
+        patched, rebuilt = index.patched(patchedXyz, remap, added), SkyIndex(patchedXyz, index.resolution)
+        self.assertTrue(np.array_equal(patched.order, rebuilt.order) and np.array_equal(patched.offsets, rebuilt.offsets), "Different patched index.")
+        patched, rebuilt = levels.patched(patchedXyz, patchedMagnitude, remap, added), Levels(patchedXyz, patchedMagnitude, levels.limits)
+        for bucket, rows in enumerate(rebuilt.rows):
+            self.assertTrue(np.array_equal(patched.rows[bucket], rows), "Different patched bucket.")
+            if levels.indexes[bucket] is None: self.assertIsNone(patched.indexes[bucket], "Unbuilt bucket index patched.")
+            else: self.assertTrue(np.array_equal(patched.index(bucket).order, rebuilt.index(bucket).order), "Different patched bucket index.")
+        return None
+
+    def testsIfEphemerisMatchesReferenceValues(self):
+        # Meeus, Astronomical Algorithms, examples 12.a and 21.b.
+        gmst = np.degrees(Ephemeris.sidereal(Ephemeris.julian(np.datetime64("1987-04-10T00:00"))))[0]
+        self.assertAlmostEqual(gmst, 197.693195, 5, "Different sidereal time.")
+        ra, dec = np.radians(41.054063), np.radians(49.227750)
+        xyz = Ephemeris.precession(2462088.69)[0] @ [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)]
+        self.assertAlmostEqual(np.degrees(np.arctan2(xyz[1], xyz[0])), 41.547214, 5, "Different precessed right ascension.")
+        self.assertAlmostEqual(np.degrees(np.arcsin(xyz[2])), 49.348483, 5, "Different precessed declination.")
 
+        latitude, longitude = random.uniform(-PI / 2, PI / 2), random.uniform(-PI, PI)
+        times = Ephemeris.J2000 + np.random.uniform(-1, 1, 50) / 36525
+        ra, dec = random.uniform(0, 2 * PI), random.uniform(-PI / 2, PI / 2)
+        star = np.array([[np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)]])
+        hour = Ephemeris.sidereal(times) + longitude - ra
+        expected = np.arcsin(np.sin(latitude) * np.sin(dec) + np.cos(latitude) * np.cos(dec) * np.cos(hour))
+        altitudes = Ephemeris.altitudes(star, Ephemeris.frames(times, latitude, longitude))[:, 0]
+        self.assertTrue(np.allclose(altitudes, expected, atol = 1e-6), "Different altitudes.")
+        return None
+
+    def testsIfKernelsInvertTheirProjections(self):
+        xyz = np.random.normal(size = (2000, 3))
+        xyz /= np.linalg.norm(xyz, axis = 1, keepdims = True)
+        R = Matrix.rMatrix(Matrix.Vector(random.uniform(-PI, PI), random.uniform(-PI, PI), random.uniform(-PI, PI)))
+        for name, kernel in Projection.KERNELS.items():
+            a, b, valid = kernel.forward(xyz)
+            with np.errstate(invalid = "ignore"): valid &= (np.abs(a) <= kernel.extent[0]) & (np.abs(b) <= kernel.extent[1])
+            back, onMap = kernel.inverse(a[valid], b[valid])
+            self.assertTrue(onMap.all() and np.allclose(back, xyz[valid], atol = 1e-9), f"{name} inverse differs.")
+            x, y, visible = kernel.project(xyz, R)
+            sky, onMap = kernel.unproject(x[visible], y[visible], R)
+            px, py, _ = kernel.project(sky[onMap], R)
+            self.assertTrue(np.array_equal(px, x[visible][onMap]) and np.array_equal(py, y[visible][onMap]), f"{name} pixels do not project back.")
+        return None
+
+    def testsIfKernelMapsAreCanvasHeightTall(self):
+        height = Projection.HEIGHT
+        try:
+            Projection.HEIGHT = Projection.WIDTH // 2
+            for name, kernel in Projection.KERNELS.items():
+                rows, columns = kernel.shape()
+                self.assertEqual(rows, Projection.HEIGHT, f"{name} map not as tall as the canvas.")
+                self.assertEqual(columns, round(rows * kernel.extent[0] / kernel.extent[1]), f"{name} map of a different aspect.")
+        finally: Projection.HEIGHT = height
+        return None
 
 if __name__ == "__main__": unittest.main()
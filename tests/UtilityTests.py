@@ -1,4 +1,127 @@
-import os, random, sys, unittest
+import io, os, random, sys, tempfile, threading, unittest
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from utilities import Canvas, Table
+import numpy as np
+from PIL import Image
+from measurements import Color
+from utilities import Bundle, Cache, Canvas, Encoder, Exposure, Raster, Table, Writer
 
+class UtilityTests(unittest.TestCase):
+    def testsIfBundlesDetectStaleSources(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source = f"{folder}/source.csv"
+            with open(source, "w") as ofile: ofile.write("1,2,3\n")
+            bundle = Bundle(f"{folder}/compiled", [source])
+            self.assertFalse(bundle.isFresh(), "Missing bundle reported as fresh.")
+
+            values = np.array([random.random() for _ in range(10)])
+            bundle.save({"values": values})
+            self.assertTrue(bundle.isFresh(), "Saved bundle reported as stale.")
+            self.assertTrue(np.array_equal(bundle.load()["values"], values), "Different bundle values.")
+
+            os.utime(source, ns = (0, 0))
+            self.assertTrue(bundle.isFresh(), "Touched but unchanged source invalidated the bundle.")
+            self.assertFalse(Bundle(f"{folder}/compiled", [source], "other").isFresh(), "Bundle of another layout reported as fresh.")
+
+            with open(source, "w") as ofile: ofile.write("1,2,4\n")
+            self.assertFalse(bundle.isFresh(), "Changed source not detected.")
+        return None
+    
+    def testsIfRasterMatchesCanvasDrawing(self):
+        img = Canvas.create(300, 300)
+        raster = Raster(300, 300)
+        for _ in range(20):
+            n = random.randrange(0, 30)
+            x = np.random.randint(-20, 320, n)
+            y = np.random.randint(-20, 320, n)
+            sizes = np.random.choice([10.0, 6.0, 5.0, 4.0, 2.0, 1.0, 0.5], n)
+            colors = np.random.randint(0, 1 << 24, n)
+            for i in range(n): Canvas.drawCircle(img, int(x[i]), int(y[i]), float(sizes[i]), Color.rgb_to_hex(int(colors[i])))
+            raster.circles(x, y, sizes, colors)
+            x0, y0, x1, y1 = np.random.randint(-20, 320, (4, 5))
+            for i in range(5): Canvas.drawLine(img, int(x0[i]), int(y0[i]), int(x1[i]), int(y1[i]), 3, Color.RED)
+            raster.lines(x0, y0, x1, y1, 3, Color.hex_to_rgb(Color.RED))
+        self.assertTrue(np.array_equal(np.asarray(img), raster.framebuffer()), "Raster differs from Canvas drawing.")
+        return None
+
+    def testsIfRasterLinesMatchCanvasAtEveryWidth(self):
+        for size in (1, 2, 4, 5, 8):
+            img = Canvas.create(120, 120)
+            raster = Raster(120, 120)
+            x0, y0, x1, y1 = np.random.randint(-20, 140, (4, 40))
+            x1[:5], y1[:5] = x0[:5], y0[:5] + np.arange(5) - 2
+            colors = np.random.randint(0, 1 << 24, 40)
+            for i in range(40): Canvas.drawLine(img, int(x0[i]), int(y0[i]), int(x1[i]), int(y1[i]), size, Color.rgb_to_hex(int(colors[i])))
+            raster.lines(x0, y0, x1, y1, size, colors)
+            self.assertTrue(np.array_equal(np.asarray(img), raster.framebuffer()), f"Raster lines of width {size} differ from Canvas.")
+        return None
+
+    def testsIfRastersResolveOnceUntilDrawnAgain(self):
+        raster = Raster(50, 50)
+        raster.circles([10], [10], 2.0, Color.hex_to_rgb(Color.RED))
+        self.assertIs(raster.resolve(), raster.resolve(), "Raster resolved again.")
+        raster.lines([0], [0], [49], [49], 1, Color.hex_to_rgb(Color.GREEN))
+        self.assertIn(49 * 50 + 49, raster.resolve()[0], "Stale resolve after a new primitive.")
+        return None
+
+    def testsIfPaletteImagesMatchRGBImages(self):
+        raster = Raster(200, 200, Color.hex_to_rgb(Color.WHITE))
+        colors = [Color.hex_to_rgb(c) for c in (Color.BLACK, Color.RED, Color.BLUE, Color.PINK)]
+        raster.circles(np.random.randint(0, 200, 50), np.random.randint(0, 200, 50), 4.0, np.random.choice(colors, 50))
+        raster.lines([0], [0], [199], [199], 3, Color.hex_to_rgb(Color.GREEN))
+        img = raster.image("P")
+        self.assertEqual(img.mode, "P", "Palette image not created.")
+        self.assertTrue(np.array_equal(np.asarray(img.convert("RGB")), np.asarray(raster.image())), "Different palette image colors.")
+        return None
+
+    def testsIfCachesEvictLeastRecentlyUsedEntries(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = Cache(2, folder, ".bin")
+            for n in range(3): cache.put(("a", n), bytes([n]))
+            self.assertEqual(list(cache.entries), [("a", 1), ("a", 2)], "Different memory tier.")
+            self.assertEqual(cache.get(("a", 0)), bytes([0]), "Entry missing from disk tier.")
+            self.assertEqual(list(cache.entries), [("a", 2), ("a", 0)], "Disk hit not promoted.")
+            self.assertIsNone(Cache(2).get(("a", 0)), "Memory-only cache hit on disk.")
+        return None
+
+    def testsIfEncodingsKeepTheFramebuffer(self):
+        raster = Raster(120, 80)
+        raster.circles(np.random.randint(0, 120, 30), np.random.randint(0, 80, 30), 3.0, Color.hex_to_rgb(Color.RED))
+        frame = raster.framebuffer()
+        for format, level in (("png", random.randint(0, 9)), ("webp", random.randint(0, 6))):
+            decoded = np.asarray(Image.open(io.BytesIO(Encoder.encode(raster, "RGB", format, level))).convert("RGB"))
+            self.assertTrue(np.array_equal(decoded, frame), f"Lossy {format} encoding.")
+        self.assertEqual(bytes(Encoder.encode(raster, "RGB", "rgb")), frame.tobytes(), "Different raw frame.")
+        with self.assertRaises(ValueError): Encoder.encode(raster, "RGB", "png", 10)
+        with self.assertRaises(ValueError): Encoder.encode(raster, "RGB", "gif", 1)
+        with self.assertRaises(ValueError): Encoder.encode(raster, "RGB", "xyz")
+        return None
+
+    def testsIfWritersBoundTheirQueueAndReportFailures(self):
+        release, running = threading.Event(), []
+        with Writer(1, 1) as writer:
+            for n in range(2): writer.submit(lambda: (running.append(1), release.wait()))
+            blocked = threading.Thread(target = writer.submit, args = (lambda: None,))
+            blocked.start()
+            blocked.join(0.2)
+            self.assertTrue(blocked.is_alive(), "Full writer queue accepted another job.")
+            release.set()
+            blocked.join()
+            writer.submit(lambda: 1 / 0)
+            with self.assertRaises(ZeroDivisionError): writer.wait()
+        self.assertEqual(len(running), 2, "Queued jobs not run.")
+        return None
+
+    def testsIfExposuresKeepTheFluxOfTheirStars(self):
+        x, y, flux = np.random.uniform(20, 60, 5), np.random.uniform(20, 100, 5), np.random.uniform(0.5, 50, 5)
+        exposure = Exposure(80, 120, sigma = random.uniform(0.5, 2))
+        exposure.splat(x, y, flux, Color.hex_to_rgb(Color.WHITE))
+        frame = exposure.framebuffer()
+        self.assertAlmostEqual(float(exposure.total.mean()), flux.sum(), delta = 1e-3 * flux.sum(), msg = "Flux lost by the PSF.")
+        for n in range(5): self.assertGreater(frame[int(x[n] + 0.5), int(y[n] + 0.5)].min(), 0, "Star missing from the frame.")
+        self.assertEqual(frame[0, 0].max(), 0, "Light far from every star.")
+        finer = Exposure(80, 120, exposure.sigma, supersample = 3)
+        finer.splat(x, y, flux, Color.hex_to_rgb(Color.WHITE))
+        self.assertLessEqual(np.abs(finer.framebuffer().astype(int) - frame).max(), 64, "Supersampling moved the stars.")
+        return None
+
+if __name__ == "__main__": unittest.main()
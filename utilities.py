@@ -1,6 +1,15 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from dataclasses import dataclass
-from PIL import Image, ImageDraw
-from measurements import Color
+from itertools import islice
+from math import pi as PI
+import contextvars, cProfile, hashlib, io, json, os, pstats, threading, time, tracemalloc, zlib
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image, ImageDraw, TiffImagePlugin
+from measurements import Color, Projection
 
 @dataclass
 class Table:
@@ -14,6 +23,18 @@ class Table:
     def __iter__(self):
         return iter(self.li)
     
+    @staticmethod
+    def chunks(filepath: str, rows: int = 100000):
+        '''
+        Streams the file as lists of at most rows split lines,
+        each with the number of bytes read so far.
+        '''
+        with open(filepath, "rb") as ifile:
+            while True:
+                lines = list(islice(ifile, rows))
+                if not lines: return None
+                yield [line.decode().strip().split(",") for line in lines], ifile.tell()
+    
     def size(self):
         x: int = len(self.li)
         y: int = len(self.li[0])
@@ -35,10 +56,934 @@ class Table:
     def get(self):
         return self.li
 
+@dataclass
+class Bundle:
+    '''
+    Folder of .npy arrays compiled from a set of source files.
+    A manifest records the format version, the layout the arrays were
+    compiled with and the mtime, size and sha256 of every source, so
+    stale bundles can be detected. layout is any string naming how the
+    arrays derive from the sources, typically a version bumped by hand.
+    '''
+    VERSION: int = 1
+
+    def __init__(self, folder: str, sources: list[str], layout: str = ""):
+        self.folder: str = folder
+        self.sources: list[str] = sources
+        self.layout: str = layout
+        self.manifest: str = f"{folder}/manifest.json"
+        return None
+    
+    @staticmethod
+    def fingerprint(filepath: str, digest: bool = True):
+        stat = os.stat(filepath)
+        fingerprint = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+        if digest:
+            with open(filepath, "rb") as ifile:
+                fingerprint["sha256"] = hashlib.sha256(ifile.read()).hexdigest()
+        return fingerprint
+    
+    def read(self):
+        try:
+            with open(self.manifest, "r") as ifile: return json.load(ifile)
+        except (OSError, ValueError): return None
+    
+    def isFresh(self):
+        manifest = self.read()
+        if manifest is None or manifest.get("version") != Bundle.VERSION: return False
+        if manifest.get("layout") != self.layout: return False
+        recorded = manifest.get("sources", {})
+        if sorted(recorded) != sorted(os.path.basename(f) for f in self.sources): return False
+        touched = False
+        for filepath in self.sources:
+            known = recorded[os.path.basename(filepath)]
+            current = Bundle.fingerprint(filepath, digest = False)
+            if current["mtime"] == known["mtime"] and current["size"] == known["size"]: continue
+            current = Bundle.fingerprint(filepath)
+            if current["sha256"] != known["sha256"]: return False
+            recorded[os.path.basename(filepath)] = current
+            touched = True
+        if touched: self.write(manifest)
+        return True
+    
+    def write(self, manifest: dict):
+        temporary = f"{self.manifest}.{os.getpid()}.tmp"
+        with open(temporary, "w") as ofile: json.dump(manifest, ofile, indent = 1)
+        os.replace(temporary, self.manifest)
+        return None
+    
+    def save(self, arrays: dict[str, np.ndarray]):
+        os.makedirs(self.folder, exist_ok = True)
+        for name, array in arrays.items():
+            temporary = f"{self.folder}/{name}.{os.getpid()}.tmp.npy"
+            np.save(temporary, np.ascontiguousarray(array), allow_pickle = False)
+            os.replace(temporary, f"{self.folder}/{name}.npy")
+        self.write({"version": Bundle.VERSION,
+                    "layout": self.layout,
+                    "arrays": sorted(arrays),
+                    "sources": {os.path.basename(f): Bundle.fingerprint(f) for f in self.sources}})
+        return None
+    
+    def load(self):
+        manifest = self.read()
+        return {name: np.load(f"{self.folder}/{name}.npy", mmap_mode = "r", allow_pickle = False)
+                for name in manifest["arrays"]}
+
+@dataclass
+class Shared:
+    '''
+    Packs named arrays into one shared memory block, so worker
+    processes can attach to them without pickling or re-loading.
+    '''
+    @staticmethod
+    def pack(arrays: dict[str, np.ndarray]):
+        layout: list[tuple[str, str, tuple[int, ...], int]] = []
+        offset = 0
+        for name, array in arrays.items():
+            offset = (offset + 63) // 64 * 64
+            layout.append((name, array.dtype.str, array.shape, offset))
+            offset += array.nbytes
+        block = shared_memory.SharedMemory(create = True, size = max(offset, 1))
+        for (name, dtype, shape, offset), array in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype, buffer = block.buf, offset = offset)[...] = array
+        return block, layout
+    
+    @staticmethod
+    def attach(name: str, layout: list[tuple[str, str, tuple[int, ...], int]]):
+        block = shared_memory.SharedMemory(name = name)
+        arrays = {key: np.ndarray(shape, dtype, buffer = block.buf, offset = offset)
+                  for key, dtype, shape, offset in layout}
+        for array in arrays.values(): array.flags.writeable = False
+        return block, arrays
+
+@dataclass
+class Cache:
+    '''
+    Least recently used byte cache: a bounded in-memory tier in front of
+    an optional folder on disk, which keeps every entry it is given.
+    Keys are tuples, stored on disk as nested folders.
+    '''
+    def __init__(self, capacity: int = 256, folder: str | None = None, suffix: str = ""):
+        self.capacity: int = capacity
+        self.folder: str | None = folder
+        self.suffix: str = suffix
+        self.entries: OrderedDict = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        return None
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def path(self, key: tuple):
+        return f"{self.folder}/{'/'.join(map(str, key))}{self.suffix}"
+    
+    def get(self, key: tuple):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        data = None
+        if self.folder is not None:
+            try:
+                with open(self.path(key), "rb") as ifile: data = ifile.read()
+            except OSError: pass
+        if data is None: self.misses += 1; return None
+        self.hits += 1
+        self.remember(key, data)
+        return data
+    
+    def put(self, key: tuple, data: bytes):
+        self.remember(key, data)
+        if self.folder is None: return None
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp", "wb") as ofile: ofile.write(data)
+        os.replace(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp", path)
+        return None
+    
+    def remember(self, key: tuple, data: bytes):
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity: self.entries.popitem(last = False)
+        return None
+
+@dataclass
+class Writer:
+    '''
+    Background writer: runs submitted jobs, typically encode-and-save, on
+    a small thread pool so they overlap with the next render. At most
+    queue jobs wait beyond the running ones; submit() blocks past that
+    instead of holding every pending frame in memory. wait() raises the
+    first failure of the jobs submitted since the last wait().
+    '''
+    def __init__(self, workers: int = 1, queue: int = 4):
+        self.pool: ThreadPoolExecutor = ThreadPoolExecutor(workers)
+        self.slots: threading.BoundedSemaphore = threading.BoundedSemaphore(workers + queue)
+        self.futures: list[Future] = []
+        self.lock: threading.Lock = threading.Lock()
+        return None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exception):
+        self.close()
+        return False
+    
+    def submit(self, function, *args):
+        self.slots.acquire()
+        # The job's stages belong to the render that queued it (see Instruments).
+        try: future = self.pool.submit(contextvars.copy_context().run, Instruments.defer(function), *args)
+        except BaseException: self.slots.release(); raise
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            self.futures = [f for f in self.futures if not f.done() or f.exception() is not None]
+            self.futures.append(future)
+        return future
+    
+    def wait(self):
+        with self.lock: futures, self.futures = self.futures, []
+        for future in futures: future.result()
+        return None
+    
+    def close(self):
+        try: self.wait()
+        finally: self.pool.shutdown()
+        return None
+
+@dataclass
+class Instruments:
+    '''
+    Opt-in render instrumentation. While a render runs under render(),
+    stage() times the named stages and count() accumulates counters into
+    one record, which is handed to every sink when the render ends. Sinks
+    are plain callables taking the record; jsonLines() builds one that
+    appends records to a file. memory adds tracemalloc allocation figures
+    per stage, profile adds the cProfile hot spots of the whole render.
+    Outside render() both calls only read a context variable. Jobs the
+    render hands to a Writer run in a copy of its context, and the record
+    waits for them before reaching the sinks (see defer).
+    '''
+    current = ContextVar("instruments", default = None)
+    idle = nullcontext()
+    lock = threading.Lock()
+
+    def __init__(self, *sinks, memory: bool = False, profile: bool = False):
+        self.sinks: list = list(sinks)
+        self.memory: bool = memory
+        self.profile: bool = profile
+        return None
+    
+    @staticmethod
+    def jsonLines(target: 'str | io.TextIOBase'):
+        def sink(record: dict):
+            line = json.dumps(record) + "\n"
+            if not isinstance(target, str): target.write(line); return None
+            with open(target, "a") as ofile: ofile.write(line)
+            return None
+        return sink
+    
+    @contextmanager
+    def render(self, **context):
+        record = {**context, "seconds": 0.0, "stages": {}, "counts": {}}
+        pending = {"jobs": 0, "ended": False}
+        token = Instruments.current.set((self, record, pending))
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing: tracemalloc.start()
+        profiler = cProfile.Profile() if self.profile else None
+        start = time.perf_counter()
+        try:
+            if profiler: profiler.enable()
+            yield record
+        finally:
+            if profiler: profiler.disable()
+            record["seconds"] = time.perf_counter() - start
+            if tracing: tracemalloc.stop()
+            Instruments.current.reset(token)
+            if profiler:
+                text = io.StringIO()
+                pstats.Stats(profiler, stream = text).sort_stats("cumulative").print_stats(20)
+                record["profile"] = text.getvalue()
+            self.settle(record, pending, ended = True)
+        return None
+    
+    def settle(self, record: dict, pending: dict, ended: bool = False, finished: bool = False):
+        # Whichever of the render and its deferred jobs ends last hands the record over.
+        with Instruments.lock:
+            pending["ended"] |= ended
+            pending["jobs"] -= finished
+            if not pending["ended"] or pending["jobs"]: return None
+        for sink in self.sinks: sink(record)
+        return None
+    
+    @staticmethod
+    def defer(function):
+        '''
+        function wrapped so that the record of the running render waits
+        for it to return before reaching the sinks.
+        '''
+        active = Instruments.current.get()
+        if active is None: return function
+        instruments, record, pending = active
+        with Instruments.lock: pending["jobs"] += 1
+        def job(*args):
+            try: return function(*args)
+            finally: instruments.settle(record, pending, finished = True)
+        return job
+    
+    @staticmethod
+    def stage(name: str):
+        active = Instruments.current.get()
+        if active is None: return Instruments.idle
+        return active[0].measure(active[1], name)
+    
+    @staticmethod
+    def count(name: str, value: int):
+        active = Instruments.current.get()
+        if active is None: return None
+        counts = active[1]["counts"]
+        counts[name] = counts.get(name, 0) + int(value)
+        return None
+    
+    @contextmanager
+    def measure(self, record: dict, name: str):
+        stage = record["stages"].setdefault(name, {"seconds": 0.0, "calls": 0})
+        tracing = self.memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            blocks = Instruments.blocks()
+        start = time.perf_counter()
+        try: yield stage
+        finally:
+            stage["seconds"] += time.perf_counter() - start
+            stage["calls"] += 1
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                stage["allocated"] = stage.get("allocated", 0) + current - before
+                stage["peak"] = max(stage.get("peak", 0), peak - before)
+                stage["blocks"] = stage.get("blocks", 0) + Instruments.blocks() - blocks
+        return None
+    
+    @staticmethod
+    def blocks():
+        return sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+
+@dataclass
+class Raster:
+    '''
+    Batched replacement for the Canvas primitives. Every primitive gets
+    a draw-order key and each pixel takes the colour of the largest key
+    covering it, which is the same "last drawn wins" result as drawing
+    one by one. Primitives are only recorded until the frame is resolved,
+    then every batch of one kind is stamped at once: discs from sprites
+    rasterised once per size by PIL itself, and lines by a vectorised
+    copy of PIL's own line scan conversion, so the output matches Canvas
+    pixel for pixel and only covered pixels are ever composited. calls
+    keeps every primitive batch in draw order for vector output (see
+    Atlas).
+    '''
+    sprites = {}
+
+    def __init__(self, x: int = 0, y: int = 0, background: int = 0):
+        x, y = x or Projection.WIDTH, y or Projection.HEIGHT
+        self.shape: tuple[int, int] = (x, y)
+        self.background: int = background
+        self.colors: list[np.ndarray] = []
+        self.count: int = 0
+        self.calls: list[tuple] = []
+        self.resolved: tuple[np.ndarray, np.ndarray] | None = None
+        return None
+    
+    @staticmethod
+    def sprite(size: float):
+        if size not in Raster.sprites:
+            center = int(size) + 2
+            img = Image.new("L", (2 * center + 1, 2 * center + 1), 0)
+            ImageDraw.Draw(img).ellipse((center - size, center - size, center + size, center + size), fill = 255)
+            dx, dy = np.nonzero(np.asarray(img))
+            Raster.sprites[size] = (dx - center, dy - center)
+        return Raster.sprites[size]
+    
+    @staticmethod
+    def edgeSprite(x: int, y: int, size: float):
+        # PIL truncates negative bounds towards zero, so discs crossing the top or
+        # left border are drawn in place instead of being shifted from a sprite.
+        ox = 0 if x - size < 0 else x - int(size) - 2
+        oy = 0 if y - size < 0 else y - int(size) - 2
+        img = Image.new("L", (max(int(y - oy + size) + 3, 1), max(int(x - ox + size) + 3, 1)), 0)
+        ImageDraw.Draw(img).ellipse((y - oy - size, x - ox - size, y - oy + size, x - ox + size), fill = 255)
+        px, py = np.nonzero(np.asarray(img))
+        return px + ox, py + oy
+    
+    def reserve(self, colors: np.ndarray):
+        keys = np.arange(self.count, self.count + len(colors), dtype = np.int64)
+        self.resolved = None
+        self.colors.append(np.array(colors, dtype = np.uint32))
+        self.count += len(colors)
+        return keys
+    
+    def circles(self, x: np.ndarray, y: np.ndarray, sizes: 'np.ndarray | float', colors: 'np.ndarray | int'):
+        x, y = np.asarray(x, dtype = np.int64), np.asarray(y, dtype = np.int64)
+        sizes = np.broadcast_to(np.asarray(sizes, dtype = np.float64), x.shape)
+        keys = self.reserve(np.broadcast_to(np.asarray(colors, dtype = np.uint32), x.shape))
+        self.calls.append(("circles", x, y, sizes, keys))
+        return None
+    
+    def discs(self, x: np.ndarray, y: np.ndarray, sizes: np.ndarray, keys: np.ndarray):
+        stamps = []
+        edge = (x - sizes < 0) | (y - sizes < 0)
+        for size in np.unique(sizes).tolist():
+            dx, dy = Raster.sprite(size)
+            chosen = (sizes == size) & ~edge
+            px = (x[chosen][:, None] + dx[None, :]).reshape(-1)
+            py = (y[chosen][:, None] + dy[None, :]).reshape(-1)
+            stamps.append(self.stamp(px, py, np.repeat(keys[chosen], len(dx))))
+        for i in np.flatnonzero(edge).tolist():
+            px, py = Raster.edgeSprite(int(x[i]), int(y[i]), float(sizes[i]))
+            stamps.append(self.stamp(px, py, np.full(len(px), keys[i])))
+        return stamps
+    
+    def stamp(self, px: np.ndarray, py: np.ndarray, keys: np.ndarray):
+        inside = (0 <= px) & (px < self.shape[0]) & (0 <= py) & (py < self.shape[1])
+        return (px * self.shape[1] + py)[inside], keys[inside]
+    
+    def lines(self, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray, size: int, colors: 'np.ndarray | int'):
+        x0, y0 = np.asarray(x0, dtype = np.int64), np.asarray(y0, dtype = np.int64)
+        x1, y1 = np.asarray(x1, dtype = np.int64), np.asarray(y1, dtype = np.int64)
+        keys = self.reserve(np.broadcast_to(np.asarray(colors, dtype = np.uint32), x0.shape))
+        if not len(keys): return None
+        self.calls.append(("lines", x0, y0, x1, y1, size, keys))
+        return None
+    
+    @staticmethod
+    def roundUp(f: np.ndarray):
+        # PIL's ROUND_UP and ROUND_DOWN, kept in the precision of f.
+        half = f.dtype.type(0.5)
+        return np.where(f >= 0, np.floor(f + half), -np.floor(np.abs(f) + half)).astype(np.int64)
+    
+    @staticmethod
+    def roundDown(f: np.ndarray):
+        half = f.dtype.type(0.5)
+        return np.where(f >= 0, np.ceil(f - half), -np.ceil(np.abs(f) - half)).astype(np.int64)
+    
+    @staticmethod
+    def roundf(f: np.ndarray):
+        # C roundf: halves go away from zero.
+        whole = np.floor(np.abs(f))
+        return np.copysign(whole + (np.abs(f) - whole >= 0.5), f).astype(f.dtype)
+    
+    @staticmethod
+    def thin(x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray):
+        '''
+        Pixels of one pixel wide segments as PIL's Bresenham walk draws
+        them: a point per step along the longer axis, then the end point.
+        '''
+        dx, dy = x1 - x0, y1 - y0
+        # PIL only walks along columns when they are strictly longer.
+        across = np.abs(dy) > np.abs(dx)
+        major, minor = np.where(across, np.abs(dy), np.abs(dx)), np.where(across, np.abs(dx), np.abs(dy))
+        owner = np.repeat(np.arange(len(x0)), major + 1)
+        step = np.arange(len(owner)) - np.repeat(np.cumsum(major + 1) - major - 1, major + 1)
+        major, minor, across = major[owner], minor[owner], across[owner]
+        aside = np.where(step == major, minor, (2 * minor * step + major) // np.maximum(2 * major, 1))
+        px = x0[owner] + np.sign(dx)[owner] * np.where(across, aside, step)
+        py = y0[owner] + np.sign(dy)[owner] * np.where(across, step, aside)
+        return px, py, owner
+    
+    @staticmethod
+    def wide(x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray, size: int, shape: tuple[int, int]):
+        '''
+        Pixels of size wide segments, all at once, by the same steps as
+        PIL's wide lines: each segment becomes a four sided polygon that
+        is scan converted row by row in float32, so the result matches
+        ImageDraw.line exactly. Works in PIL's (column, row) order.
+        '''
+        u0, v0, u1, v1 = y0, x0, y1, x1
+        du, dv = u1 - u0, v1 - v0
+        dot = (du == 0) & (dv == 0)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            small = np.float64((size - 1) / 2)
+            hypot = np.hypot(du, dv)
+            high, low = Raster.roundUp(small) / hypot, Raster.roundDown(small) / hypot
+            dumin, dumax = Raster.roundDown(low * dv), Raster.roundDown(high * dv)
+            dvmin, dvmax = Raster.roundDown(low * du), Raster.roundDown(high * du)
+        # Corners and the four edges between them, as PIL's add_edge keeps them.
+        cu = np.stack([u0 - dumin, u1 - dumin, u1 + dumax, u0 + dumax], axis = 1)
+        cv = np.stack([v0 + dvmax, v1 + dvmax, v1 - dvmin, v0 - dvmin], axis = 1)
+        eu, ev = cu, cv
+        fu, fv = np.roll(cu, -1, axis = 1), np.roll(cv, -1, axis = 1)
+        vmin, vmax = np.minimum(ev, fv), np.maximum(ev, fv)
+        flat = (ev == fv) | dot[:, None]
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            slope = np.where(flat, 0, (fu - eu).astype(np.float32) / (fv - ev).astype(np.float32)).astype(np.float32)
+        # Horizontal edges are drawn on their own, every other edge is crossed by the scan.
+        spans = [(ev[flat & ~dot[:, None]], np.minimum(eu, fu)[flat & ~dot[:, None]], np.maximum(eu, fu)[flat & ~dot[:, None]],
+                  np.nonzero(flat & ~dot[:, None])[0]),
+                 (v0[dot], u0[dot], u0[dot], np.flatnonzero(dot))]
+        def at(i: 'int | np.ndarray', r: np.ndarray, o: np.ndarray):
+            return (r - ev[o, i]).astype(np.float32) * slope[o, i] + eu[o, i].astype(np.float32)
+        def expand(first: np.ndarray, rows: np.ndarray):
+            rows = np.maximum(rows, 0)
+            owner = np.repeat(np.arange(len(first)), rows)
+            return owner, first[owner] + np.arange(len(owner)) - np.repeat(np.cumsum(rows) - rows, rows)
+        # Rows strictly between two corners cross the same two edges and need none
+        # of the corner bookkeeping below; a span between those two edges fills them.
+        corners, bands, generic = np.sort(cv, axis = 1), [], []
+        for k in range(3):
+            above, below = corners[:, k], corners[:, k + 1]
+            cover = ~flat & (vmin <= above[:, None]) & (vmax >= below[:, None])
+            first, last = np.maximum(above + 1, 0), np.minimum(below - 1, shape[0] - 1)
+            plain = cover.sum(axis = 1) == 2
+            owner, row = expand(first, np.where(plain & ~dot, last - first + 1, 0))
+            i, j = cover.argmax(axis = 1)[owner], 3 - cover[:, ::-1].argmax(axis = 1)[owner]
+            left, right = at(i, row, owner), at(j, row, owner)
+            bands.append((row, Raster.roundUp(np.minimum(left, right)), Raster.roundDown(np.maximum(left, right)), owner))
+            generic.append(expand(first, np.where(plain | dot, 0, last - first + 1)))
+        for k in range(4):
+            fresh = ~dot & (0 <= corners[:, k]) & (corners[:, k] < shape[0]) & ((k == 0) | (corners[:, k] != corners[:, k - 1]))
+            generic.append((np.flatnonzero(fresh), corners[fresh, k]))
+        spans += bands
+        owner, row = (np.concatenate(part) for part in zip(*generic))
+        end = vmax.max(axis = 1)[owner]
+        cross = np.full((len(owner), 8), np.nan, dtype = np.float32)
+        for i in range(4):
+            lo, hi = vmin[owner, i], vmax[owner, i]
+            active = ~flat[owner, i] & (lo <= row) & (row <= hi)
+            value = at(i, row, owner)
+            double = active & (row == hi) & (row < end)
+            # PIL nudges corners where two slanted edges meet on the same pixel.
+            loose = np.flatnonzero(active & ~double & ((row == lo) | (row == hi)) & (slope[owner, i] != 0))
+            for k in range(i):
+                r, o = row[loose], owner[loose]
+                step = np.where(r == hi[loose], -1, 1)
+                lk, hk = vmin[o, k], vmax[o, k]
+                near, nearOther = at(i, r + step, o), at(k, r + step, o)
+                joined = (~flat[o, k] & ((r == lk) | (r == hk)) & (slope[o, k] != 0) & (lk <= r + step) & (r + step <= hk)
+                          & (Raster.roundf(value[loose]) == Raster.roundf(at(k, r, o))))
+                current = value[loose]
+                raised = joined & (current > near + 1) & (current > nearOther + 1)
+                lowered = joined & ~raised & (current < near - 1) & (current < nearOther - 1)
+                value[loose[raised]] = Raster.roundf(np.maximum(near, nearOther)[raised]) + 1
+                value[loose[lowered]] = Raster.roundf(np.minimum(near, nearOther)[lowered]) - 1
+                loose = loose[~joined]
+            cross[:, 2 * i] = np.where(active, value, np.nan)
+            cross[:, 2 * i + 1] = np.where(double, value, np.nan)
+        cross.sort(axis = 1)
+        count = np.count_nonzero(~np.isnan(cross), axis = 1)
+        for p in range(4):
+            pair = 2 * p + 1 < count
+            spans.append((row[pair], Raster.roundUp(cross[pair, 2 * p]), Raster.roundDown(cross[pair, 2 * p + 1]), owner[pair]))
+        row, start, stop, owner = (np.concatenate(part) for part in zip(*spans))
+        # PIL's hline clipping.
+        start, stop = np.maximum(start, 0), np.minimum(stop, shape[1] - 1)
+        keep = (0 <= row) & (row < shape[0]) & (start <= stop)
+        row, start, stop, owner = row[keep], start[keep], stop[keep], owner[keep]
+        width = stop - start + 1
+        py = np.repeat(start - np.cumsum(width) + width, width) + np.arange(width.sum())
+        return np.repeat(row, width), py, np.repeat(owner, width)
+    
+    def resolve(self):
+        '''
+        Covered pixels (flat indexes) and the key of the last
+        primitive drawn over each of them, kept until another
+        primitive is drawn.
+        '''
+        if self.resolved is None: self.resolved = self.scan()
+        return self.resolved
+    
+    def scan(self):
+        # Keys keep the draw order, so every batch of one kind is stamped at once.
+        stamps = [(np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64))]
+        circles = [call[1:] for call in self.calls if call[0] == "circles"]
+        if circles: stamps += self.discs(*(np.concatenate(part) for part in zip(*circles)))
+        lines = [call[1:] for call in self.calls if call[0] == "lines"]
+        for size in sorted({line[4] for line in lines if line[4] >= 1}):
+            x0, y0, x1, y1, keys = (np.concatenate(part) for part in zip(*[line[:4] + line[5:] for line in lines if line[4] == size]))
+            px, py, owner = Raster.thin(x0, y0, x1, y1) if size == 1 else Raster.wide(x0, y0, x1, y1, size, self.shape)
+            stamps.append(self.stamp(px, py, keys[owner]))
+        pixels, keys = (np.concatenate(part) for part in zip(*stamps))
+        if not len(pixels): return pixels, keys
+        # One sort of pixel * count + key puts each pixel's largest key last.
+        composite = np.sort(pixels * self.count + keys)
+        pixels, keys = np.divmod(composite, self.count)
+        last = np.append(pixels[1:] != pixels[:-1], True)
+        return pixels[last], keys[last]
+    
+    def framebuffer(self, out: np.ndarray | None = None):
+        pixels, keys = self.resolve()
+        colors = np.concatenate([*self.colors, np.zeros(0, dtype = np.uint32)])
+        row = np.tile(Color.rgb_to_array(np.array([self.background]))[0], self.shape[1])
+        frame = np.empty((*self.shape, 3), dtype = np.uint8) if out is None else out
+        frame[...] = np.broadcast_to(row, (self.shape[0], row.size)).reshape(*self.shape, 3)
+        frame.reshape(-1, 3)[pixels] = Color.rgb_to_array(colors[keys])
+        return frame
+    
+    def indexed(self):
+        '''
+        Palette framebuffer: one byte per pixel plus a palette of at most
+        256 colours, the background being entry 0.
+        '''
+        pixels, keys = self.resolve()
+        colors = np.concatenate([*self.colors, np.zeros(0, dtype = np.uint32)])
+        used = np.unique(colors[keys])
+        palette = np.concatenate([[self.background], used[used != self.background]]).astype(np.uint32)
+        if len(palette) > 256: raise ValueError(f"{len(palette)} colours do not fit in a palette.")
+        lookup = np.argsort(palette)
+        indexes = lookup[np.searchsorted(palette, colors[keys], sorter = lookup)]
+        frame = np.zeros(self.shape, dtype = np.uint8)
+        frame.reshape(-1)[pixels] = indexes
+        return frame, Color.rgb_to_array(palette)
+    
+    def image(self, mode: str = "RGB"):
+        if not mode == "P": return Image.fromarray(self.framebuffer())
+        frame, palette = self.indexed()
+        img = Image.fromarray(frame)
+        img.putpalette(palette.tobytes())
+        return img
+
+@dataclass
+class Exposure:
+    '''
+    Additive float32 image of point sources. Each star adds its flux
+    spread by a Gaussian PSF of sigma pixels, integrated exactly over
+    every pixel it covers, so frames are anti-aliased without extra
+    samples. Stamps grow with the flux until they fade below FLOOR and
+    are stamped in batches of equal size. framebuffer() tone maps the
+    sum to 8-bit sRGB-like values, saturating smoothly towards white;
+    with supersample > 1 the sum is kept on a finer grid and tone mapped
+    there before averaging, which smooths the edges of saturated cores.
+    splat() only records stars: resolve() stamps them into one band of
+    about BAND cells of the finer grid at a time, so the finer canvas is
+    never held whole, and only pixels some stamp touched are ever read
+    or tone mapped. total is the flux per channel that landed on the
+    canvas, once resolved.
+    '''
+    FLOOR = 1e-4
+    BATCH = 1 << 22
+    BAND = 1 << 20
+
+    def __init__(self, x: int = 0, y: int = 0, sigma: float = 0.8, supersample: int = 1):
+        x, y = x or Projection.WIDTH, y or Projection.HEIGHT
+        self.shape: tuple[int, int] = (x, y)
+        self.sigma: float = sigma
+        self.supersample: int = supersample
+        self.stars: list[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        self.resolved: tuple[np.ndarray, np.ndarray] | None = None
+        self.total: np.ndarray = np.zeros(3)
+        return None
+    
+    @staticmethod
+    def erf(x: np.ndarray):
+        # Abramowitz and Stegun 7.1.26, within 1.5e-7.
+        t = 1 / (1 + 0.3275911 * np.abs(x))
+        poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+        return np.sign(x) * (1 - poly * np.exp(-x * x))
+    
+    @staticmethod
+    def weights(offsets: np.ndarray, cells: np.ndarray, sigma: float):
+        # Share of a unit Gaussian, offset from each row's centre cell, falling in each cell.
+        edges = (cells[None, :] - offsets[:, None] + 0.5) / (sigma * np.sqrt(2))
+        return (Exposure.erf(edges) - Exposure.erf(edges - 1 / (sigma * np.sqrt(2)))) / 2
+    
+    def splat(self, x: np.ndarray, y: np.ndarray, flux: np.ndarray, colors: 'np.ndarray | int'):
+        '''
+        Adds stars at float pixel positions x, y with the given total
+        flux, tinted by their packed rgb colors.
+        '''
+        s = self.supersample
+        sigma = self.sigma * s
+        fx, fy = (np.asarray(x, dtype = np.float64) + 0.5) * s - 0.5, (np.asarray(y, dtype = np.float64) + 0.5) * s - 0.5
+        tint = Color.rgb_to_array(np.broadcast_to(np.asarray(colors, dtype = np.uint32), fx.shape)) / 255.0
+        # Averaging s * s fine pixels back down divides the flux, so each star brings s * s times as much.
+        energy = tint * (np.asarray(flux, dtype = np.float64) * s * s)[:, None]
+        peak = energy.max(axis = 1, initial = 0) / (2 * PI * sigma * sigma)
+        radius = np.maximum(np.ceil(sigma * np.sqrt(2 * np.log(np.maximum(peak / Exposure.FLOOR, 1)))), 1).astype(np.int64)
+        self.stars.append((fx, fy, energy, radius))
+        self.resolved = None
+        return None
+    
+    def resolve(self):
+        '''
+        Covered pixels (flat indexes) and their tone mapped rgb levels,
+        kept until more stars are added.
+        '''
+        if self.resolved is None: self.resolved = self.expose()
+        return self.resolved
+    
+    def expose(self):
+        s, (x, y) = self.supersample, self.shape
+        X, Y, sigma = x * s, y * s, self.sigma * s
+        empty = (np.zeros(0), np.zeros(0), np.zeros((0, 3)), np.zeros(0, dtype = np.int64))
+        fx, fy, energy, radius = (np.concatenate(part) for part in zip(empty, *self.stars))
+        cx, cy = np.rint(fx).astype(np.int64), np.rint(fy).astype(np.int64)
+        # Bands are whole pixel rows, so every pixel is averaged from one band.
+        rows = s * max(Exposure.BAND // (Y * s), 1)
+        buffer = np.zeros(rows * Y * 3, dtype = np.float32)
+        touched, covered = np.zeros(rows * Y, dtype = bool), np.zeros(rows // s * y, dtype = bool)
+        pixels, levels, total = [np.zeros(0, dtype = np.int64)], [np.zeros((0, 3), dtype = np.uint8)], np.zeros(3)
+        for top in range(0, X, rows):
+            reached = np.flatnonzero((cx + radius >= top) & (cx - radius < top + rows))
+            if not len(reached): continue
+            for r in np.unique(radius[reached]).tolist():
+                offsets = np.arange(-r, r + 1)
+                group = reached[radius[reached] == r]
+                batch = max(Exposure.BATCH // len(offsets) ** 2, 1)
+                for start in range(0, len(group), batch):
+                    chosen = group[start:start + batch]
+                    wx = Exposure.weights(fx[chosen] - cx[chosen], offsets, sigma)
+                    wy = Exposure.weights(fy[chosen] - cy[chosen], offsets, sigma)
+                    px, py = cx[chosen][:, None] + offsets - top, cy[chosen][:, None] + offsets
+                    inside = ((0 <= px) & (px < min(rows, X - top)))[:, :, None] & ((0 <= py) & (py < Y))[:, None, :]
+                    cells = (px[:, :, None] * Y + py[:, None, :])[inside]
+                    share = (wx[:, :, None] * wy[:, None, :])[inside]
+                    owner = np.broadcast_to(np.arange(len(chosen))[:, None, None], inside.shape)[inside]
+                    # Flat indexes take numpy's fast path for add.at.
+                    np.add.at(buffer, (cells[:, None] * 3 + np.arange(3)).reshape(-1), (share[:, None] * energy[chosen][owner]).astype(np.float32).reshape(-1))
+                    touched[cells] = True
+            # Only the rows the band's stamps reached are searched.
+            lo = max(int((cx[reached] - radius[reached]).min()) - top, 0) * Y
+            hi = min(int((cx[reached] + radius[reached]).max()) - top + 1, rows, X - top) * Y
+            cells = np.flatnonzero(touched[lo:hi]) + lo
+            sums = buffer.reshape(-1, 3)[cells].astype(np.float64)
+            total += sums.sum(axis = 0)
+            tone = (1 - np.exp(-sums)) ** (1 / 2.2)
+            fine, column = np.divmod(cells, Y)
+            local = fine // s * y + column // s
+            if s > 1:
+                covered[local] = True
+                kept = np.flatnonzero(covered)
+                covered[kept] = False
+                slots = np.searchsorted(kept, local)
+                tone = np.stack([np.bincount(slots, channel, len(kept)) for channel in tone.T], axis = 1) / (s * s)
+                local = kept
+            pixels.append(top // s * y + local)
+            levels.append(np.rint(tone * 255).astype(np.uint8))
+            buffer.reshape(-1, 3)[cells], touched[cells] = 0, False
+        self.total = total / (s * s)
+        return np.concatenate(pixels), np.concatenate(levels)
+    
+    def framebuffer(self, out: np.ndarray | None = None):
+        pixels, levels = self.resolve()
+        frame = np.empty((*self.shape, 3), dtype = np.uint8) if out is None else out
+        frame[...] = 0
+        frame.reshape(-1, 3)[pixels] = levels
+        return frame
+    
+    def image(self, mode: str = "RGB"):
+        return Image.fromarray(self.framebuffer())
+
+@dataclass
+class Encoder:
+    '''
+    Byte encodings of a Raster. "png" takes a zlib level from 0 to 9
+    (1 is fast, 6 is PIL's default), "webp" is lossless with an effort
+    level from 0 to 6, and "rgb" is the raw framebuffer, rows of r, g, b
+    bytes, handed over as a memoryview without copying or encoding. Any
+    other format PIL can save, as named by PIL in lower case ("jpeg",
+    "bmp", "gif"...), is written with PIL's defaults and takes no level.
+    '''
+    FORMATS = {"png": (6, 9), "webp": (4, 6), "rgb": (0, 0)}
+    SUFFIXES = {".png": "png", ".webp": "webp", ".rgb": "rgb", ".raw": "rgb"}
+    TYPES = {"png": "image/png", "webp": "image/webp", "rgb": "application/octet-stream"}
+
+    @staticmethod
+    def level(format: str, level: int | None = None):
+        '''
+        The level an encoding runs at; ValueError for unknown formats or levels.
+        '''
+        if format not in Encoder.FORMATS:
+            if format.upper() not in Image.SAVE: raise ValueError(f"Unknown format {format!r}.")
+            if level is not None: raise ValueError(f"{format} takes no level.")
+            return None
+        default, top = Encoder.FORMATS[format]
+        if level is None: return default
+        if not 0 <= level <= top: raise ValueError(f"Level {level} out of range for {format}.")
+        return level
+    
+    @staticmethod
+    def formatOf(filepath: str):
+        '''
+        The format a filepath's suffix names, PIL's guess for suffixes not
+        in SUFFIXES; ValueError when nothing can write it.
+        '''
+        suffix = os.path.splitext(filepath)[1].lower()
+        if suffix in Encoder.SUFFIXES: return Encoder.SUFFIXES[suffix]
+        format = Image.registered_extensions().get(suffix)
+        if format is None or format not in Image.SAVE: raise ValueError(f"No encoding writes {suffix or filepath!r} files.")
+        return format.lower()
+    
+    @staticmethod
+    def typeOf(format: str):
+        return Encoder.TYPES.get(format) or Image.MIME.get(format.upper(), "application/octet-stream")
+    
+    @staticmethod
+    def compose(raster: Raster, mode: str = "RGB", format: str = "png"):
+        if format == "rgb": return raster.framebuffer()
+        return raster.image(mode if format == "png" else "RGB")
+    
+    @staticmethod
+    def pack(composed: 'Image.Image | np.ndarray', format: str = "png", level: int | None = None):
+        level = Encoder.level(format, level)
+        if format == "rgb": return memoryview(composed).cast("B")
+        stream = io.BytesIO()
+        match format:
+            case "png": composed.save(stream, "PNG", compress_level = level)
+            case "webp": composed.save(stream, "WEBP", lossless = True, method = level)
+            case _: composed.save(stream, format.upper())
+        return stream.getvalue()
+    
+    @staticmethod
+    def encode(raster: Raster, mode: str = "RGB", format: str = "png", level: int | None = None):
+        Encoder.level(format, level)
+        return Encoder.pack(Encoder.compose(raster, mode, format), format, level)
+
+@dataclass
+class Atlas:
+    '''
+    Multi-page PDF or TIFF written one page at a time: add() appends a
+    prepared page and lets it go, so memory holds one page however long
+    the atlas grows. PDF pages are a deflated image shown at resolution
+    dots per inch or, with vector, the circles and lines of the Raster as
+    PDF paths, which print sharp at any size; Exposures, having no
+    shapes, stay images. page() does all the work but the writing, so
+    pages can be prepared in parallel and added in order.
+    '''
+    SUFFIXES = {".pdf": "pdf", ".tif": "tiff", ".tiff": "tiff"}
+    # Control point distance of the four Bezier quarters closest to a circle.
+    KAPPA = 0.5522847498
+
+    def __init__(self, filepath: str, vector: bool = False, resolution: int = 300, level: int = 6):
+        self.format: str = Atlas.formatOf(filepath)
+        if vector and not self.format == "pdf": raise ValueError("Only PDF atlases hold vector pages.")
+        self.vector: bool = vector
+        self.resolution: int = resolution
+        self.level: int = Encoder.level("png", level)
+        self.pages: int = 0
+        if self.format == "tiff":
+            self.tiff = TiffImagePlugin.AppendingTiffWriter(filepath, new = True)
+            return None
+        self.file = open(filepath, "wb")
+        self.offsets: dict[int, int] = {}
+        self.kids: list[int] = []
+        self.objects: int = 2
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        # Object 2, the page tree, is written by close() once every page is known.
+        self.object(1, b"/Type /Catalog /Pages 2 0 R")
+        return None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exception):
+        self.close()
+        return False
+    
+    @staticmethod
+    def formatOf(filepath: str):
+        suffix = os.path.splitext(filepath)[1].lower()
+        if suffix not in Atlas.SUFFIXES: raise ValueError(f"Atlases are PDF or TIFF files, not {suffix or filepath!r}.")
+        return Atlas.SUFFIXES[suffix]
+    
+    def page(self, raster: 'Raster | Exposure', mode: str = "RGB"):
+        '''
+        A page ready for add(): an image for TIFF, or for PDF its size in
+        points, content stream and image XObject, if any, deflated. Only
+        reads the settings, so any thread may call it.
+        '''
+        if self.format == "tiff": return raster.image(mode)
+        rows, cols = raster.shape
+        scale, level = 72 / self.resolution, self.level
+        size = (cols * scale, rows * scale)
+        if self.vector and isinstance(raster, Raster):
+            return (size, zlib.compress(Atlas.paths(raster, scale).encode(), level), None)
+        if mode == "P":
+            frame, palette = raster.indexed()
+            space = f"[/Indexed /DeviceRGB {len(palette) - 1} <{palette.tobytes().hex()}>]"
+        else: frame, space = raster.framebuffer(), "/DeviceRGB"
+        image = (f"/Type /XObject /Subtype /Image /Width {cols} /Height {rows} /ColorSpace {space} "
+                 f"/BitsPerComponent 8 /Filter /FlateDecode").encode()
+        content = f"q {size[0]:.2f} 0 0 {size[1]:.2f} 0 0 cm /Page Do Q".encode()
+        return (size, zlib.compress(content, level), (image, zlib.compress(frame, level)))
+    
+    @staticmethod
+    def paths(raster: Raster, scale: float):
+        '''
+        PDF operators painting the background of raster and then its
+        circles and lines in draw order, scale points to the pixel.
+        '''
+        rows, cols = raster.shape
+        colors = np.concatenate([*raster.colors, np.zeros(0, dtype = np.uint32)])
+        paint = lambda rgb, op: "{:.3f} {:.3f} {:.3f} {}".format(*(Color.rgb_to_array(np.array([rgb]))[0] / 255), op)
+        ops = [paint(raster.background, "rg"), f"0 0 {cols * scale:.2f} {rows * scale:.2f} re f"]
+        fill, stroke = None, None
+        for call in raster.calls:
+            # Pixel centres, with rows counted up from the bottom of the page.
+            if call[0] == "circles":
+                _, x, y, sizes, keys = call
+                r = (sizes + 0.5) * scale
+                cx, cy, k = (y + 0.5) * scale, (rows - x - 0.5) * scale, r * Atlas.KAPPA
+                points = np.stack([cx + r, cy, cx + r, cy + k, cx + k, cy + r, cx, cy + r, cx - k, cy + r, cx - r, cy + k, cx - r, cy,
+                                   cx - r, cy - k, cx - k, cy - r, cx, cy - r, cx + k, cy - r, cx + r, cy - k, cx + r, cy], axis = 1)
+                for rgb, p in zip(colors[keys].tolist(), points.round(2).tolist()):
+                    if not rgb == fill: ops.append(paint(rgb, "rg")); fill = rgb
+                    ops.append("{} {} m {} {} {} {} {} {} c {} {} {} {} {} {} c {} {} {} {} {} {} c {} {} {} {} {} {} c f".format(*p))
+            else:
+                _, x0, y0, x1, y1, size, keys = call
+                ops.append(f"{size * scale:.2f} w")
+                ends = np.stack([y0 + 0.5, rows - x0 - 0.5, y1 + 0.5, rows - x1 - 0.5], axis = 1) * scale
+                for rgb, p in zip(colors[keys].tolist(), ends.round(2).tolist()):
+                    if not rgb == stroke: ops.append(paint(rgb, "RG")); stroke = rgb
+                    ops.append("{} {} m {} {} l S".format(*p))
+        return "\n".join(ops)
+    
+    def object(self, number: int, head: bytes, stream: bytes | None = None):
+        self.offsets[number] = self.file.tell()
+        if stream is None: self.file.write(b"%d 0 obj\n<< %s >>\nendobj\n" % (number, head))
+        else: self.file.write(b"%d 0 obj\n<< %s /Length %d >>\nstream\n%s\nendstream\nendobj\n" % (number, head, len(stream), stream))
+        return number
+    
+    def add(self, page: 'tuple | Image.Image'):
+        self.pages += 1
+        if self.format == "tiff":
+            page.save(self.tiff, "TIFF", compression = "tiff_deflate", dpi = (self.resolution, self.resolution))
+            self.tiff.newFrame()
+            return None
+        (width, height), content, image = page
+        number = self.objects + 1
+        resources = "<< >>"
+        if image is not None:
+            self.object(number, *image)
+            resources, number = f"<< /XObject << /Page {number} 0 R >> >>", number + 1
+        self.object(number, b"/Filter /FlateDecode", content)
+        self.object(number + 1, (f"/Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] "
+                                 f"/Resources {resources} /Contents {number} 0 R").encode())
+        self.kids.append(number + 1)
+        self.objects = number + 1
+        return None
+    
+    def close(self):
+        if self.format == "tiff":
+            self.tiff.close()
+            return None
+        if self.file.closed: return None
+        self.object(2, f"/Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in self.kids)}] /Count {len(self.kids)}".encode())
+        start, size = self.file.tell(), self.objects + 1
+        self.file.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        self.file.write("".join(f"{self.offsets[n]:010d} 00000 n \n" for n in range(1, size)).encode())
+        self.file.write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{start}\n%%EOF\n".encode())
+        self.file.close()
+        return None
+
 @dataclass
 class Canvas:
     @staticmethod
-    def create(x: int = 1572, y: int = 1572):
+    def create(x: int = 0, y: int = 0):
+        x, y = x or Projection.WIDTH, y or Projection.HEIGHT
         return Image.new("RGB", (x, y), Color.hex_to_tuple(Color.BLACK))
     
     @staticmethod